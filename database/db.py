@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, scoped_session
 from sqlalchemy.ext.declarative import declarative_base
 from database.models import Base, User, UserRole
@@ -16,9 +16,28 @@ def get_session():
     """Get a database session."""
     return SessionLocal()
 
+def _add_missing_columns():
+    """
+    create_all() creates missing tables but never alters existing ones: add the nullable
+    columns introduced since a table was created (e.g. documents.structured_data).
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info(f"Added column {table.name}.{column.name}")
+
 def init_db():
-    """Initialize the database (create tables)."""
+    """Initialize the database (create tables and add new columns to existing ones)."""
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
     session = get_session()
     try:
         admin_user = session.query(User).filter(User.username == 'admin').first()
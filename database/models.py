@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Enum, Boolean
+from sqlalchemy import Column, Integer, String, Float, Text, DateTime, ForeignKey, Enum, Boolean, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 
 from sqlalchemy.orm import relationship
@@ -72,7 +72,8 @@ class ProcessingStatus(enum.Enum):
 
 class ApplicationStatus(enum.Enum):
     SUBMITTED = "submitted"
-    PROCESSING = "processing"
+    PROCESSING = "processing"  # documents are being OCR'd
+    ANALYZING = "analyzing"  # an LLM analysis task is running
     EVALUATED = "evaluated"
     REJECTED = "rejected"
     APPROVED = "approved"
@@ -85,6 +86,8 @@ class Application(Base):
     student_name = Column(String(255), nullable=True)
     submission_date = Column(DateTime, default=datetime.utcnow)
     status = Column(String(20), default=ApplicationStatus.SUBMITTED.value)
+    # Status before the running analysis set ANALYZING, restored if that analysis is interrupted
+    status_before_analysis = Column(String(20), nullable=True)
     evaluation_score = Column(Float, nullable=True)
     evaluation_date = Column(DateTime, nullable=True)
 
@@ -95,6 +98,7 @@ class Application(Base):
     student_info = relationship("StudentInfo", back_populates="application", uselist=False, cascade="all, delete-orphan")
     summary = relationship("Summary", back_populates="application", uselist=False, cascade="all, delete-orphan")
     evaluations = relationship("ReviewerEvaluation", back_populates="application", cascade="all, delete-orphan")
+    stage_results = relationship("StageResult", back_populates="application", cascade="all, delete-orphan")
 
     def __repr__(self):
         return f"<Application(id={self.id}, student_name={self.student_name}, status={self.status})>"
@@ -110,6 +114,7 @@ class Document(Base):
     upload_date = Column(DateTime, default=datetime.utcnow)
     document_type = Column(String(50), default=DocumentType.OTHER.value)
     content_text = Column(Text, nullable=True)
+    structured_data = Column(Text, nullable=True)  # JSON, e.g. grade table rows of a degree transcript
     processing_status = Column(String(20), default=ProcessingStatus.PENDING.value)
     
     # Relationships
@@ -154,6 +159,23 @@ class Summary(Base):
 
     def __repr__(self):
         return f"<Summary(id={self.id}, application_id={self.application_id})>"
+
+class StageResult(Base):
+    """Raw LLM output of one analysis stage and the hash of the inputs it was generated from."""
+    __tablename__ = 'stage_results'
+    __table_args__ = (UniqueConstraint('application_id', 'stage'),)
+
+    id = Column(Integer, primary_key=True)
+    application_id = Column(Integer, ForeignKey('applications.id'), nullable=False)
+    stage = Column(String(50), nullable=False)
+    input_hash = Column(String(64), nullable=False)  # document text, prompt version and model
+    output = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    application = relationship("Application", back_populates="stage_results")
+
+    def __repr__(self):
+        return f"<StageResult(application_id={self.application_id}, stage={self.stage})>"
     
 class ReviewerDecision(enum.Enum):
     APPROVED = "approved"
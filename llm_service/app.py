@@ -7,15 +7,23 @@ import sys
 import uuid
 import json
 import logging
+import threading
 from datetime import datetime
+from functools import partial
 
 # Add parent directory to path to import database modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from llm_service.config import LLM_SERVICE_HOST, LLM_SERVICE_PORT
+from llm_service.config import (
+    LLM_SERVICE_HOST, LLM_SERVICE_PORT, LLM_ANALYSIS_WORKERS, LLM_TASK_TTL, LLM_BATCH_CONCURRENCY, LLM_WARMUP,
+    LLM_SIMILARITY_ENABLED, LLM_SIMILARITY_TYPES, LLM_SIMILARITY_DIM, LLM_SIMILARITY_THRESHOLD, LLM_SIMILARITY_TOP_K, LLM_SIMILARITY_PATH
+)
 from llm_service.utils.llm_processor import LLMProcessor
+from llm_service.utils.analysis_tasks import TaskRegistry
+from llm_service.utils.slot_scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, request_priority
+from llm_service.utils.similarity_index import SimilarityIndex
 from database.db import get_session
-from database.models import Application, StudentInfo, Summary, ApplicationStatus
+from database.models import Application, Document, StudentInfo, Summary, StageResult, ApplicationStatus
 
 # Configure logging
 logging.basicConfig(
@@ -31,18 +39,129 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__)
 
+# One processor per process: pooled keep-alive connections to Ollama and a
+# background health probe instead of a status check on every request
+llm_processor = LLMProcessor()
+analysis_tasks = TaskRegistry(LLM_ANALYSIS_WORKERS, LLM_TASK_TTL, batch_workers=LLM_BATCH_CONCURRENCY)
+# Near-duplicate index of motivation letters and CVs; documents are added as they are analyzed
+# or queried, and the whole index is reconciled with the database once at startup
+similarity_index = SimilarityIndex(LLM_SIMILARITY_DIM, LLM_SIMILARITY_TYPES, LLM_SIMILARITY_PATH or None) if LLM_SIMILARITY_ENABLED else None
+
+# Statuses an analysis result replaces with EVALUATED; a reviewer's decision is kept on re-analysis
+_UNDECIDED_STATUSES = (
+    ApplicationStatus.SUBMITTED.value, ApplicationStatus.PROCESSING.value,
+    ApplicationStatus.ANALYZING.value, ApplicationStatus.EVALUATED.value,
+)
+
+def _reset_interrupted_analyses():
+    """
+    Applications left ANALYZING by a previous process have no task any more: give them back the status
+    they had before the analysis (rows from before status_before_analysis existed fall back to
+    EVALUATED if summarized, else SUBMITTED).
+    """
+    session = get_session()
+    try:
+        stale = session.query(Application).filter(Application.status == ApplicationStatus.ANALYZING.value).all()
+        summarized = {row.application_id for row in session.query(Summary.application_id).filter(
+            Summary.application_id.in_([application.id for application in stale])
+        )} if stale else set()
+        for application in stale:
+            if application.status_before_analysis:
+                application.status = application.status_before_analysis
+            else:
+                application.status = ApplicationStatus.EVALUATED.value if application.id in summarized else ApplicationStatus.SUBMITTED.value
+            application.status_before_analysis = None
+        session.commit()
+        if stale:
+            logger.info(f"Reset {len(stale)} applications whose analysis was interrupted")
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Could not reset interrupted analyses: {str(e)}")
+    finally:
+        session.close()
+
+def _stored_documents(application_id=None):
+    """(document_id, application_id, document_type, text) of the stored documents of the indexed types."""
+    session = get_session()
+    try:
+        query = session.query(Document.id, Document.application_id, Document.document_type, Document.content_text).filter(
+            Document.document_type.in_(LLM_SIMILARITY_TYPES), Document.content_text.isnot(None)
+        )
+        if application_id is not None:
+            query = query.filter(Document.application_id == application_id)
+        for row in query.yield_per(500):
+            yield tuple(row)
+    finally:
+        session.close()
+
+def _sync_similarity_index():
+    try:
+        indexed = similarity_index.sync(_stored_documents())
+        similarity_index.save()
+        logger.info(f"Similarity index is up to date: {indexed} documents")
+    except Exception as e:
+        logger.error(f"Could not sync the similarity index: {str(e)}")
+
+def _start_background_work():
+    """Startup work that must run once per serving process: health probe, model warm-up and index sync."""
+    llm_processor.client.start_health_probe()
+    if LLM_WARMUP:
+        llm_processor.warm_up()
+    _reset_interrupted_analyses()
+    if similarity_index:
+        threading.Thread(target=_sync_similarity_index, name="similarity-sync", daemon=True).start()
+
+if __name__ != '__main__':
+    # Imported by a WSGI server; when run directly it is started below
+    _start_background_work()
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    """Health check endpoint."""
+    """
+    Health check endpoint. With ?require_warm=1 it answers 503 until the models are loaded
+    on a backend, so load balancers only route to instances that won't pay the model load.
+    """
+    ollama_status = llm_processor.client.status()
+    warm = ollama_status["model_resident"] is not False
+    body = {
+        "status": "healthy" if warm else "warming",
+        "service": "llm_service",
+        "model": "LLaMA2-7B (Ollama)",
+        "model_resident": ollama_status["model_resident"],
+        "ollama": ollama_status
+    }
+    if not warm and request.args.get('require_warm', '').lower() in ('1', 'true', 'yes'):
+        return jsonify(body), 503
+    return jsonify(body)
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Runtime metrics of the LLM service."""
     return jsonify({
-        "status": "healthy", 
         "service": "llm_service",
-        "model": "LLaMA2-7B (Ollama)"
+        "response_cache": llm_processor.cache.stats() if llm_processor.cache else None,
+        "schema_validation": llm_processor.get_schema_stats(),
+        "streaming": llm_processor.get_stream_stats(),
+        "prefill": llm_processor.get_prefill_stats(),
+        "fast_path": llm_processor.get_fast_path_stats(),
+        "stage_routing": llm_processor.get_routing_report(),
+        "output_budget": llm_processor.output_budget.snapshot(),
+        "generations": llm_processor.generation_stats.snapshot(),
+        "analysis_tasks": analysis_tasks.stats(),
+        "ollama_slots": llm_processor.client.scheduler.stats(),
+        "ollama_backends": llm_processor.client.stats(),
+        "cancellation": llm_processor.get_cancel_stats(),
+        "similarity": similarity_index.stats() if similarity_index else None
     })
 
 @app.route('/api/analyze', methods=['POST'])
 def analyze_documents():
-    """Analyze documents and extract student information."""
+    """
+    Queue the analysis of an application's documents.
+    Returns 202 with a task id right away; progress is reported by /api/status/<task_id>
+    and the results are written to the database when the task finishes.
+    Optional "deadline_seconds": the analysis is cancelled if it has not finished by then.
+    """
     try:
         data = request.json
         
@@ -54,126 +173,357 @@ def analyze_documents():
         
         application_id = data.get('application_id')
         documents = data.get('documents', [])
+        bypass_cache = bool(data.get('bypass_cache', False))
+        deadline_seconds, error = _deadline_seconds(data)
+        if error:
+            return jsonify({"error": error}), 400
         
         if not application_id or not documents:
             return jsonify({"error": "Missing required parameters"}), 400
         
-        # Generate task ID
-        task_id = str(uuid.uuid4())
-        
-        # Phân loại tài liệu theo loại
-        categorized_docs = {}
-        for doc in documents:
-            doc_type = doc.get('document_type', 'unknown')
-            content = doc.get('content_text', '')
-            language = doc.get('language', 'en')  
-            
-            if doc_type not in categorized_docs:
-                categorized_docs[doc_type] = []
-            
-            categorized_docs[doc_type].append({
-                'content': content,
-                'language': language,
-                'document_id': doc.get('document_id')
-            })
+        categorized_docs = _categorize_documents(documents)
         
-        # Xử lý với LLM processor
-        llm_processor = LLMProcessor()
-        result = llm_processor.process_application(application_id, categorized_docs)
-        
-        # Cập nhật database
         session = get_session()
         try:
-            # Cập nhật trạng thái application
             application = session.query(Application).filter(Application.id == application_id).first()
-            
             if not application:
                 return jsonify({"error": f"Application not found with ID: {application_id}"}), 404
-            
-            application.status = ApplicationStatus.EVALUATED.value
-            application.evaluation_score = result.get('evaluation', {}).get('score', 0)
-            application.evaluation_date = datetime.utcnow()
-            
-            # Kiểm tra xem đã có StudentInfo chưa
-            student_info = session.query(StudentInfo).filter(StudentInfo.application_id == application_id).first()
-            
-            if student_info:
-                # Cập nhật thông tin sinh viên hiện có
-                student_info.name = result.get('student_info', {}).get('name', '')
-                student_info.gender = result.get('student_info', {}).get('gender', '')
-                student_info.date_of_birth = result.get('student_info', {}).get('date_of_birth', '')
-                student_info.age = result.get('student_info', {}).get('age', 0)
-                student_info.nationality = result.get('student_info', {}).get('nationality', '')
-                student_info.previous_university = result.get('student_info', {}).get('previous_university', '')
-                student_info.gpa = result.get('student_info', {}).get('gpa', 0.0)
-                student_info.russian_language_level = result.get('student_info', {}).get('russian_language_level', '')
-            else:
-                # Tạo mới thông tin sinh viên
-                student_info = StudentInfo(
-                    application_id=application_id,
-                    name=result.get('student_info', {}).get('name', ''),
-                    gender=result.get('student_info', {}).get('gender', ''),
-                    date_of_birth=result.get('student_info', {}).get('date_of_birth', ''),
-                    age=result.get('student_info', {}).get('age', 0),
-                    nationality=result.get('student_info', {}).get('nationality', ''),
-                    previous_university=result.get('student_info', {}).get('previous_university', ''),
-                    gpa=result.get('student_info', {}).get('gpa', 0.0),
-                    russian_language_level=result.get('student_info', {}).get('russian_language_level', '')
-                )
-                session.add(student_info)
-            
-            # Kiểm tra xem đã có Summary chưa
-            summary = session.query(Summary).filter(Summary.application_id == application_id).first()
-            
-            if summary:
-                # Cập nhật tóm tắt hiện có
-                summary.cv_summary = result.get('summaries', {}).get('cv_summary', '')
-                summary.motivation_letter_summary = result.get('summaries', {}).get('motivation_letter_summary', '')
-                summary.recommendation_letter_summary = result.get('summaries', {}).get('recommendation_letter_summary', '')
-                summary.recommendation_author = result.get('summaries', {}).get('recommendation_author', '')
-                summary.achievements_summary = result.get('summaries', {}).get('achievements_summary', '')
-                summary.additional_documents_summary = result.get('summaries', {}).get('additional_documents_summary', '')
-                summary.evaluation_comments = result.get('evaluation', {}).get('comments', '')
-            else:
-                # Tạo mới tóm tắt
-                summary = Summary(
-                    application_id=application_id,
-                    cv_summary=result.get('summaries', {}).get('cv_summary', ''),
-                    motivation_letter_summary=result.get('summaries', {}).get('motivation_letter_summary', ''),
-                    recommendation_letter_summary=result.get('summaries', {}).get('recommendation_letter_summary', ''),
-                    recommendation_author=result.get('summaries', {}).get('recommendation_author', ''),
-                    achievements_summary=result.get('summaries', {}).get('achievements_summary', ''),
-                    additional_documents_summary=result.get('summaries', {}).get('additional_documents_summary', ''),
-                    evaluation_comments=result.get('evaluation', {}).get('comments', '')
-                )
-                session.add(summary)
-            
-            session.commit()
-            
-            return jsonify({
-                "task_id": task_id,
-                "status": "completed",
-                "application_id": application_id
-            })
-            
-        except Exception as e:
-            session.rollback()
-            logger.error(f"Database error: {str(e)}")
-            return jsonify({"error": f"Database error: {str(e)}"}), 500
+            previous_status = application.status
         finally:
             session.close()
+        
+        task, created = analysis_tasks.submit(
+            application_id, partial(_run_analysis, application_id, categorized_docs, bypass_cache, previous_status, PRIORITY_INTERACTIVE),
+            deadline_seconds=deadline_seconds
+        )
+        if not created:
+            logger.info(f"Application {application_id} is already being analyzed by task {task.task_id}")
+        
+        return jsonify({
+            "task_id": task.task_id,
+            "status": task.status,
+            "created": created,
+            "application_id": application_id,
+            "status_url": f"/api/status/{task.task_id}"
+        }), 202
     
     except Exception as e:
         logger.error(f"Error analyzing documents: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Queue the analysis of many applications, e.g. for an overnight intake run.
+    Body: {"applications": [{"application_id": ..., "documents": [...]}, ...], "bypass_cache": false}
+    and optionally "deadline_seconds", applied to every application from submission.
+    Batch generations only get an Ollama slot when no single-application request is waiting.
+    """
+    try:
+        data = request.json
+        if not data or not data.get('applications'):
+            return jsonify({"error": "No applications provided"}), 400
+        bypass_cache = bool(data.get('bypass_cache', False))
+        deadline_seconds, error = _deadline_seconds(data)
+        if error:
+            return jsonify({"error": error}), 400
+        
+        items = []
+        for entry in data['applications']:
+            if not entry.get('application_id') or not entry.get('documents'):
+                return jsonify({"error": "Every application needs application_id and documents"}), 400
+            items.append((entry['application_id'], _categorize_documents(entry['documents'])))
+        
+        session = get_session()
+        try:
+            ids = [application_id for application_id, _ in items]
+            statuses = dict(session.query(Application.id, Application.status).filter(Application.id.in_(ids)).all())
+        finally:
+            session.close()
+        missing = [application_id for application_id in ids if application_id not in statuses]
+        if missing:
+            return jsonify({"error": f"Applications not found: {missing}"}), 404
+        
+        # Applications with the same document types issue the same stage prompts; running them
+        # next to each other lets the slot scheduler chain prompts that share a cached prefix
+        items.sort(key=lambda item: sorted(item[1].keys()))
+        batch_id, tasks = analysis_tasks.submit_batch([
+            (application_id, partial(_run_analysis, application_id, categorized_docs, bypass_cache, statuses[application_id], PRIORITY_BATCH))
+            for application_id, categorized_docs in items
+        ], deadline_seconds=deadline_seconds)
+        logger.info(f"Queued batch {batch_id} with {len(tasks)} applications")
+        
+        return jsonify({
+            "batch_id": batch_id,
+            "applications": len(tasks),
+            "task_ids": {task.application_id: task.task_id for task in tasks},
+            "status_url": f"/api/batch/{batch_id}"
+        }), 202
+    
+    except Exception as e:
+        logger.error(f"Error queuing batch analysis: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/batch/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    """Aggregate progress of a batch: applications/hour and per-application latency."""
+    batch = analysis_tasks.get_batch(batch_id)
+    if not batch:
+        return jsonify({"error": f"Batch not found: {batch_id}"}), 404
+    return jsonify(batch)
+
+@app.route('/api/cancel/<task_id>', methods=['POST'])
+def cancel_task(task_id):
+    """
+    Cancel an analysis whose result is no longer wanted. Generations in flight are closed,
+    which makes Ollama stop; the application keeps its previous status and results.
+    """
+    task = analysis_tasks.cancel(task_id, reason="cancelled by client")
+    if not task:
+        return jsonify({"error": f"Task not found: {task_id}"}), 404
+    return jsonify(task)
+
+@app.route('/api/similarity/<int:application_id>', methods=['GET'])
+def get_similar_documents(application_id):
+    """
+    Near-duplicates of an application's motivation letters and CVs among other applications.
+    The application's stored documents are (re)indexed first, so new uploads are compared right away.
+    Optional query parameters: threshold (cosine similarity, 0-1) and top_k.
+    """
+    if not similarity_index:
+        return jsonify({"error": "Similarity detection is disabled"}), 503
+    try:
+        threshold = float(request.args.get('threshold', LLM_SIMILARITY_THRESHOLD))
+        top_k = int(request.args.get('top_k', LLM_SIMILARITY_TOP_K))
+    except ValueError:
+        return jsonify({"error": "threshold must be a number and top_k an integer"}), 400
+    if not 0 < threshold <= 1 or top_k <= 0:
+        return jsonify({"error": "threshold must be in (0, 1] and top_k positive"}), 400
+    
+    session = get_session()
+    try:
+        if not session.query(Application.id).filter(Application.id == application_id).first():
+            return jsonify({"error": f"Application not found with ID: {application_id}"}), 404
+    finally:
+        session.close()
+    
+    try:
+        documents = list(_stored_documents(application_id))
+        for document_id, _, document_type, text in documents:
+            similarity_index.add(document_id, application_id, document_type, text)
+        similarity_index.maybe_save()
+        report = similarity_index.application_report(
+            [(document_id, document_type) for document_id, _, document_type, _ in documents], threshold, top_k
+        )
+        return jsonify({
+            "application_id": application_id,
+            "threshold": threshold,
+            "flagged": any(entry["near_duplicates"] for entry in report),
+            "documents": report
+        })
+    except Exception as e:
+        logger.error(f"Error finding similar documents of application {application_id}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+def _deadline_seconds(data):
+    """Optional positive "deadline_seconds" of a request body; returns (value or None, error message or None)."""
+    value = data.get('deadline_seconds')
+    if value is None:
+        return None, None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None, "deadline_seconds must be a number"
+    if value <= 0:
+        return None, "deadline_seconds must be positive"
+    return value, None
+
+def _categorize_documents(documents):
+    """Group request documents by type in the shape LLMProcessor.process_application expects."""
+    # Phân loại tài liệu theo loại
+    categorized_docs = {}
+    for doc in documents:
+        doc_type = doc.get('document_type', 'unknown')
+        content = doc.get('content_text', '')
+        language = doc.get('language', 'en')  
+        structured_data = doc.get('structured_data')
+        if isinstance(structured_data, str):
+            try:
+                structured_data = json.loads(structured_data)
+            except json.JSONDecodeError:
+                structured_data = None
+        
+        if doc_type not in categorized_docs:
+            categorized_docs[doc_type] = []
+        
+        categorized_docs[doc_type].append({
+            'content': content,
+            'language': language,
+            'document_id': doc.get('document_id'),
+            'structured_data': structured_data or {}
+        })
+    return categorized_docs
+
+def _index_documents(application_id, categorized_docs):
+    """Add the application's documents to the similarity index (only new or changed texts are embedded)."""
+    if not similarity_index:
+        return
+    try:
+        for doc_type, docs in categorized_docs.items():
+            for doc in docs:
+                if doc.get('document_id') is not None:
+                    similarity_index.add(doc['document_id'], application_id, doc_type, doc.get('content'))
+        similarity_index.maybe_save()
+    except Exception as e:
+        logger.warning(f"Could not index the documents of application {application_id}: {str(e)}")
+
+def _set_application_status(application_id, status, status_before_analysis=None):
+    session = get_session()
+    try:
+        application = session.query(Application).filter(Application.id == application_id).first()
+        if application:
+            application.status = status
+            application.status_before_analysis = status_before_analysis
+            session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Could not set status of application {application_id}: {str(e)}")
+    finally:
+        session.close()
+
+def _run_analysis(application_id, categorized_docs, bypass_cache, previous_status, priority, progress):
+    """Background job: run the LLM stages, then write the results to the database."""
+    request_priority.set(priority)
+    _index_documents(application_id, categorized_docs)
+    _set_application_status(application_id, ApplicationStatus.ANALYZING.value, status_before_analysis=previous_status)
+    try:
+        stage_records = {} if bypass_cache else _load_stage_records(application_id)
+        result = llm_processor.process_application(application_id, categorized_docs, bypass_cache=bypass_cache,
+                                                   progress=progress, stage_records=stage_records)
+        progress("save", "running")
+        _save_analysis_result(application_id, result, stage_records, previous_status)
+        progress("save", "done", result)
+    except Exception:
+        # Let the application be analyzed again
+        _set_application_status(application_id, previous_status)
+        raise
+
+def _load_stage_records(application_id):
+    """Stored stage outputs of the previous analysis, keyed by stage name."""
+    session = get_session()
+    try:
+        rows = session.query(StageResult).filter(StageResult.application_id == application_id).all()
+        return {row.stage: {"input_hash": row.input_hash, "output": row.output} for row in rows}
+    finally:
+        session.close()
+
+def _save_analysis_result(application_id, result, stage_records, previous_status):
+    """
+    Write the analysis result into Application, StudentInfo and Summary, and the stage outputs into StageResult.
+    The application becomes EVALUATED unless a reviewer already decided on it (previous_status).
+    """
+    # Cập nhật database
+    session = get_session()
+    try:
+        # Cập nhật trạng thái application
+        application = session.query(Application).filter(Application.id == application_id).first()
+
+        if not application:
+            raise LookupError(f"Application not found with ID: {application_id}")
+
+        application.status = ApplicationStatus.EVALUATED.value if previous_status in _UNDECIDED_STATUSES else previous_status
+        application.status_before_analysis = None
+        application.evaluation_score = result.get('evaluation', {}).get('score', 0)
+        application.evaluation_date = datetime.utcnow()
+
+        # Kiểm tra xem đã có StudentInfo chưa
+        student_info = session.query(StudentInfo).filter(StudentInfo.application_id == application_id).first()
+
+        if student_info:
+            # Cập nhật thông tin sinh viên hiện có
+            student_info.name = result.get('student_info', {}).get('name', '')
+            student_info.gender = result.get('student_info', {}).get('gender', '')
+            student_info.date_of_birth = result.get('student_info', {}).get('date_of_birth', '')
+            student_info.age = result.get('student_info', {}).get('age', 0)
+            student_info.nationality = result.get('student_info', {}).get('nationality', '')
+            student_info.previous_university = result.get('student_info', {}).get('previous_university', '')
+            student_info.gpa = result.get('student_info', {}).get('gpa', 0.0)
+            student_info.russian_language_level = result.get('student_info', {}).get('russian_language_level', '')
+        else:
+            # Tạo mới thông tin sinh viên
+            student_info = StudentInfo(
+                application_id=application_id,
+                name=result.get('student_info', {}).get('name', ''),
+                gender=result.get('student_info', {}).get('gender', ''),
+                date_of_birth=result.get('student_info', {}).get('date_of_birth', ''),
+                age=result.get('student_info', {}).get('age', 0),
+                nationality=result.get('student_info', {}).get('nationality', ''),
+                previous_university=result.get('student_info', {}).get('previous_university', ''),
+                gpa=result.get('student_info', {}).get('gpa', 0.0),
+                russian_language_level=result.get('student_info', {}).get('russian_language_level', '')
+            )
+            session.add(student_info)
+
+        # Kiểm tra xem đã có Summary chưa
+        summary = session.query(Summary).filter(Summary.application_id == application_id).first()
+
+        if summary:
+            # Cập nhật tóm tắt hiện có
+            summary.cv_summary = result.get('summaries', {}).get('cv_summary', '')
+            summary.motivation_letter_summary = result.get('summaries', {}).get('motivation_letter_summary', '')
+            summary.recommendation_letter_summary = result.get('summaries', {}).get('recommendation_letter_summary', '')
+            summary.recommendation_author = result.get('summaries', {}).get('recommendation_author', '')
+            summary.achievements_summary = result.get('summaries', {}).get('achievements_summary', '')
+            summary.additional_documents_summary = result.get('summaries', {}).get('additional_documents_summary', '')
+            summary.evaluation_comments = result.get('evaluation', {}).get('comments', '')
+        else:
+            # Tạo mới tóm tắt
+            summary = Summary(
+                application_id=application_id,
+                cv_summary=result.get('summaries', {}).get('cv_summary', ''),
+                motivation_letter_summary=result.get('summaries', {}).get('motivation_letter_summary', ''),
+                recommendation_letter_summary=result.get('summaries', {}).get('recommendation_letter_summary', ''),
+                recommendation_author=result.get('summaries', {}).get('recommendation_author', ''),
+                achievements_summary=result.get('summaries', {}).get('achievements_summary', ''),
+                additional_documents_summary=result.get('summaries', {}).get('additional_documents_summary', ''),
+                evaluation_comments=result.get('evaluation', {}).get('comments', '')
+            )
+            session.add(summary)
+
+        # Stage outputs for the next, incremental analysis
+        stored = {row.stage: row for row in session.query(StageResult).filter(StageResult.application_id == application_id).all()}
+        for stage, row in stored.items():
+            if stage not in stage_records:
+                session.delete(row)
+        for stage, record in stage_records.items():
+            row = stored.get(stage)
+            if row is None:
+                session.add(StageResult(application_id=application_id, stage=stage, input_hash=record["input_hash"], output=record["output"]))
+            elif row.input_hash != record["input_hash"] or row.output != record["output"]:
+                row.input_hash = record["input_hash"]
+                row.output = record["output"]
+                row.created_at = datetime.utcnow()
+
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.error(f"Database error: {str(e)}")
+        raise
+    finally:
+        session.close()
+
 @app.route('/api/status/<task_id>', methods=['GET'])
 def get_task_status(task_id):
-    """Get status of a processing task."""
-    return jsonify({
-        "task_id": task_id,
-        "status": "completed"
-    })
+    """Get status of a processing task: current stage, completed stages, elapsed time and partial results."""
+    task = analysis_tasks.get(task_id)
+    if not task:
+        return jsonify({"error": f"Task not found: {task_id}"}), 404
+    return jsonify(task)
 
 if __name__ == '__main__':
-    app.run(host=LLM_SERVICE_HOST, port=LLM_SERVICE_PORT, debug=True)
+    debug = True
+    # The debug reloader runs this module in a watcher process and again in the serving child:
+    # only the child (or a process without the reloader) starts the background work
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        _start_background_work()
+    app.run(host=LLM_SERVICE_HOST, port=LLM_SERVICE_PORT, debug=debug)
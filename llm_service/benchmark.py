@@ -0,0 +1,173 @@
+"""
+Benchmark runner for the LLM service.
+
+Submits applications to /api/analyze with a fixed concurrency, polls /api/status until
+every task finished and reports throughput (applications/sec) and the latency distribution
+per application and per stage. Point the service at mock_ollama.py for repeatable numbers.
+
+Analyses write their results to the database like any other analysis, so run it against
+a development database. Applications come either from the database (documents that
+completed OCR, sent exactly as the web service sends them) or from a JSON fixtures file
+with a list of /api/analyze payloads whose application_ids exist in the database.
+
+Example:
+    python llm_service/mock_ollama.py --port 11435 &
+    OLLAMA_API_BASE=http://localhost:11435 python llm_service/app.py &
+    python llm_service/benchmark.py --application-id 1 --application-id 2 --repeat 10 --concurrency 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Add parent directory to path to import database modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def load_payloads_from_db(application_ids):
+    """/api/analyze payloads built from the OCR-completed documents of the given applications."""
+    from database.db import get_session
+    from database.models import Document, ProcessingStatus
+
+    session = get_session()
+    try:
+        payloads = []
+        for application_id in application_ids:
+            documents = session.query(Document).filter(
+                Document.application_id == application_id,
+                Document.processing_status == ProcessingStatus.COMPLETED.value,
+                Document.content_text.isnot(None)
+            ).all()
+            if not documents:
+                print(f"Application {application_id} has no processed documents, skipped.")
+                continue
+            payloads.append({
+                "application_id": application_id,
+                "documents": [
+                    {"document_id": doc.id, "document_type": doc.document_type,
+                     "content_text": doc.content_text, "structured_data": doc.structured_data}
+                    for doc in documents
+                ]
+            })
+        return payloads
+    finally:
+        session.close()
+
+
+def run_one(service_url, payload, bypass_cache, poll_interval, timeout):
+    """
+    Submit one analysis and wait for it.
+    Returns:
+        dict: Final task status from /api/status plus wall-clock latency seen by the client
+    """
+    started = time.monotonic()
+    response = requests.post(f"{service_url}/api/analyze", json={**payload, "bypass_cache": bypass_cache, "deadline_seconds": timeout},
+                             timeout=30)
+    response.raise_for_status()
+    task_id = response.json()["task_id"]
+    while time.monotonic() - started < timeout:
+        time.sleep(poll_interval)
+        status = requests.get(f"{service_url}/api/status/{task_id}", timeout=10).json()
+        if status.get("status") in ("completed", "failed", "cancelled"):
+            status["client_seconds"] = time.monotonic() - started
+            return status
+    # Don't leave the service generating for an analysis nobody waits for
+    requests.post(f"{service_url}/api/cancel/{task_id}", timeout=10)
+    return {"task_id": task_id, "status": "timeout", "client_seconds": time.monotonic() - started, "stage_seconds": {}}
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _distribution(values):
+    if not values:
+        return None
+    return {
+        "n": len(values),
+        "mean": round(sum(values) / len(values), 3),
+        "p50": round(_percentile(values, 0.5), 3),
+        "p90": round(_percentile(values, 0.9), 3),
+        "p99": round(_percentile(values, 0.99), 3),
+        "max": round(max(values), 3),
+    }
+
+
+def run_benchmark(service_url, payloads, concurrency, bypass_cache=True, poll_interval=0.2, timeout=1800):
+    """
+    Run every payload through the service and aggregate the results.
+    The service keeps one active analysis per application (a second submission joins the
+    running task), so payloads of the same application run one after another.
+    """
+    by_application = {}
+    for payload in payloads:
+        by_application.setdefault(payload["application_id"], []).append(payload)
+    if concurrency > len(by_application):
+        print(f"Only {len(by_application)} distinct application(s): at most that many analyses run at once.")
+
+    def run_application(application_payloads):
+        return [run_one(service_url, p, bypass_cache, poll_interval, timeout) for p in application_payloads]
+
+    wall_started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(by_application)))) as executor:
+        results = [r for group in executor.map(run_application, by_application.values()) for r in group]
+    wall = time.monotonic() - wall_started
+
+    completed = [r for r in results if r.get("status") == "completed"]
+    stage_values = {}
+    for r in completed:
+        for stage, seconds in (r.get("stage_seconds") or {}).items():
+            stage_values.setdefault(stage, []).append(seconds)
+    return {
+        "applications": len(results),
+        "completed": len(completed),
+        "failed": sum(1 for r in results if r.get("status") == "failed"),
+        "timed_out": sum(1 for r in results if r.get("status") in ("timeout", "cancelled")),
+        "wall_seconds": round(wall, 2),
+        "applications_per_sec": round(len(completed) / wall, 4) if wall > 0 else None,
+        "application_seconds": _distribution([r["client_seconds"] for r in completed]),
+        "service_seconds": _distribution([r["elapsed_seconds"] for r in completed if "elapsed_seconds" in r]),
+        "stage_seconds": {stage: _distribution(values) for stage, values in sorted(stage_values.items())},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark /api/analyze of the LLM service.")
+    parser.add_argument('--service-url', default=os.getenv('LLM_SERVICE_URL', 'http://localhost:5002'))
+    parser.add_argument('--application-id', dest='application_ids', type=int, action='append',
+                        help="Application to analyze, payload built from the database (repeatable)")
+    parser.add_argument('--fixtures', help="JSON file with a list of /api/analyze payloads")
+    parser.add_argument('--repeat', type=int, default=1, help="Submit every application this many times")
+    parser.add_argument('--concurrency', type=int, default=4, help="Analyses in flight at once")
+    parser.add_argument('--use-cache', action='store_true',
+                        help="Allow the response cache and stored stage outputs (default: every stage is generated)")
+    parser.add_argument('--timeout', type=float, default=1800, help="Seconds to wait for one analysis")
+    parser.add_argument('--output', help="Also write the report as JSON to this file")
+    args = parser.parse_args(argv)
+
+    payloads = []
+    if args.fixtures:
+        with open(args.fixtures, 'r', encoding='utf-8') as f:
+            payloads.extend(json.load(f))
+    if args.application_ids:
+        payloads.extend(load_payloads_from_db(args.application_ids))
+    if not payloads:
+        parser.error("nothing to run: give --application-id or --fixtures")
+
+    payloads = payloads * args.repeat
+    print(f"Running {len(payloads)} analyses against {args.service_url} with concurrency {args.concurrency}...")
+    report = run_benchmark(args.service_url, payloads, args.concurrency, bypass_cache=not args.use_cache, timeout=args.timeout)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    return 0 if report["completed"] == report["applications"] else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,14 +6,83 @@ import os
 # Service configuration
 LLM_SERVICE_HOST = os.getenv('LLM_SERVICE_HOST', '0.0.0.0')
 LLM_SERVICE_PORT = int(os.getenv('LLM_SERVICE_PORT', 5002))
+# Background analysis jobs: concurrent applications and how long finished tasks stay queryable (seconds)
+LLM_ANALYSIS_WORKERS = int(os.getenv('LLM_ANALYSIS_WORKERS', 2))
+LLM_TASK_TTL = float(os.getenv('LLM_TASK_TTL', 3600))
 
-# Ollama configuration
+# Ollama configuration; OLLAMA_API_BASE may list several backends separated by commas
 OLLAMA_API_BASE = os.getenv('OLLAMA_API_BASE', 'http://localhost:11434')
+OLLAMA_BACKENDS = [base.strip() for base in OLLAMA_API_BASE.split(',') if base.strip()]
 OLLAMA_MODEL = os.getenv('OLLAMA_MODEL', 'llama2:7b')
+# Smaller model for the extraction stages (empty = OLLAMA_MODEL); evaluation always uses OLLAMA_MODEL unless routed
+OLLAMA_EXTRACTION_MODEL = os.getenv('OLLAMA_EXTRACTION_MODEL', '')
 OLLAMA_TIMEOUT = int(os.getenv('OLLAMA_TIMEOUT', 120))
+# Should match OLLAMA_NUM_PARALLEL of the Ollama servers: stage prompts in flight at once per backend
+OLLAMA_NUM_PARALLEL = int(os.getenv('OLLAMA_NUM_PARALLEL', 4))
+# Keep-alive connection pool size and background health probe period (seconds)
+OLLAMA_POOL_SIZE = int(os.getenv('OLLAMA_POOL_SIZE', OLLAMA_NUM_PARALLEL * 2))
+OLLAMA_HEALTH_INTERVAL = float(os.getenv('OLLAMA_HEALTH_INTERVAL', 30))
+# Failed generations are retried on another backend (backoff doubles from OLLAMA_RETRY_BACKOFF seconds);
+# a backend failing OLLAMA_CIRCUIT_FAILURES times in a row is left out for OLLAMA_CIRCUIT_COOLDOWN seconds
+OLLAMA_MAX_RETRIES = int(os.getenv('OLLAMA_MAX_RETRIES', 2))
+OLLAMA_RETRY_BACKOFF = float(os.getenv('OLLAMA_RETRY_BACKOFF', 0.5))
+OLLAMA_CIRCUIT_FAILURES = int(os.getenv('OLLAMA_CIRCUIT_FAILURES', 3))
+OLLAMA_CIRCUIT_COOLDOWN = float(os.getenv('OLLAMA_CIRCUIT_COOLDOWN', 30))
+# Send a generation that has not started responding after this many seconds to a second backend too (0 = off)
+OLLAMA_HEDGE_AFTER = float(os.getenv('OLLAMA_HEDGE_AFTER', 0))
+# How long Ollama keeps the models loaded after a request ("30m", "1h", seconds, "-1" = forever);
+# with LLM_WARMUP they are loaded at startup and again after a backend restart
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+LLM_WARMUP = os.getenv('LLM_WARMUP', 'true').lower() in ('1', 'true', 'yes')
+# Applications of a batch analyzed at once; enough of them keep every Ollama slot busy
+LLM_BATCH_CONCURRENCY = int(os.getenv('LLM_BATCH_CONCURRENCY', OLLAMA_NUM_PARALLEL * len(OLLAMA_BACKENDS) * 2))
+
+# Prompt/response cache: in-memory LRU plus an on-disk tier (LLM_CACHE_DIR empty = memory only)
+LLM_CACHE_ENABLED = os.getenv('LLM_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LLM_CACHE_DIR = os.getenv('LLM_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache'))
+LLM_CACHE_MEMORY_ENTRIES = int(os.getenv('LLM_CACHE_MEMORY_ENTRIES', 512))
+LLM_CACHE_MAX_MB = int(os.getenv('LLM_CACHE_MAX_MB', 256))
+LLM_CACHE_TTL = float(os.getenv('LLM_CACHE_TTL', 30 * 24 * 3600))
 
 # Generation parameters
 MAX_TOKENS = int(os.getenv('MAX_TOKENS', 1024))
+# Context window requested from Ollama (LLaMA2 supports 4096)
+OLLAMA_NUM_CTX = int(os.getenv('OLLAMA_NUM_CTX', 4096))
+# "auto": one consolidated generation when all documents fit into num_ctx, "off": always one prompt per document
+LLM_CONSOLIDATED_MODE = os.getenv('LLM_CONSOLIDATED_MODE', 'auto')
+LLM_CONSOLIDATED_MAX_TOKENS = int(os.getenv('LLM_CONSOLIDATED_MAX_TOKENS', 1536))
+# Send a JSON schema in Ollama's "format" field (structured outputs, Ollama >= 0.5) and validate against it
+LLM_STRUCTURED_OUTPUT = os.getenv('LLM_STRUCTURED_OUTPUT', 'true').lower() in ('1', 'true', 'yes')
+LLM_SCHEMA_MAX_RETRIES = int(os.getenv('LLM_SCHEMA_MAX_RETRIES', 1))
+# Stream generations and stop reading as soon as the JSON object is complete
+LLM_STREAMING = os.getenv('LLM_STREAMING', 'true').lower() in ('1', 'true', 'yes')
+# load_duration above this (ms) counts as Ollama (re)loading the model
+LLM_RELOAD_THRESHOLD_MS = float(os.getenv('LLM_RELOAD_THRESHOLD_MS', 500))
+# Fill stages from deterministic rules (MRZ, GPA, TORFL level, IELTS/TOEFL) and skip their LLM call when confident
+LLM_FAST_PATH = os.getenv('LLM_FAST_PATH', 'true').lower() in ('1', 'true', 'yes')
+# Long documents are split into chunks of this many (estimated) tokens and summarized map-reduce style
+LLM_CHUNK_TOKENS = int(os.getenv('LLM_CHUNK_TOKENS', 1500))
+LLM_CHUNK_NOTES_TOKENS = int(os.getenv('LLM_CHUNK_NOTES_TOKENS', 400))
+# Per-stage model/num_predict/num_ctx/temperature/prompt_format: JSON object or path of a JSON file, e.g.
+# {"default": {"model": "llama3.2:3b"}, "evaluation": {"model": "llama2:13b", "num_ctx": 4096}}
+# Non-LLaMA2 models get prompt_format "chat" (their own template, with the system prompt in Ollama's "system" field)
+LLM_STAGE_ROUTES = os.getenv('LLM_STAGE_ROUTES', '')
+# Cap num_predict per stage (e.g. 128 for passport fields, 320 for the evaluation) instead of MAX_TOKENS for every stage
+LLM_STAGE_NUM_PREDICT = os.getenv('LLM_STAGE_NUM_PREDICT', 'false').lower() in ('1', 'true', 'yes')
+# Learn num_predict per stage from past output lengths (a high percentile plus a margin, capped by the stage budget)
+LLM_ADAPTIVE_NUM_PREDICT = os.getenv('LLM_ADAPTIVE_NUM_PREDICT', 'true').lower() in ('1', 'true', 'yes')
+LLM_NUM_PREDICT_PERCENTILE = float(os.getenv('LLM_NUM_PREDICT_PERCENTILE', 0.99))
+LLM_NUM_PREDICT_MARGIN = float(os.getenv('LLM_NUM_PREDICT_MARGIN', 0.2))
+LLM_NUM_PREDICT_MIN_SAMPLES = int(os.getenv('LLM_NUM_PREDICT_MIN_SAMPLES', 20))
+# Near-duplicate detection of documents between applications (copied or templated letters and CVs):
+# cosine similarity of hashed 3-word shingle vectors, roughly the share of phrases two documents have in common
+LLM_SIMILARITY_ENABLED = os.getenv('LLM_SIMILARITY_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LLM_SIMILARITY_TYPES = [t.strip() for t in os.getenv('LLM_SIMILARITY_TYPES', 'motivation_letter,cv').split(',') if t.strip()]
+LLM_SIMILARITY_DIM = int(os.getenv('LLM_SIMILARITY_DIM', 1024))
+LLM_SIMILARITY_THRESHOLD = float(os.getenv('LLM_SIMILARITY_THRESHOLD', 0.5))
+LLM_SIMILARITY_TOP_K = int(os.getenv('LLM_SIMILARITY_TOP_K', 5))
+# Saved index (empty = memory only, rebuilt from the database at every start)
+LLM_SIMILARITY_PATH = os.getenv('LLM_SIMILARITY_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'similarity_index.npz'))
 TEMPERATURE = float(os.getenv('TEMPERATURE', 0.3))
 TOP_P = float(os.getenv('TOP_P', 0.9))
 TOP_K = int(os.getenv('TOP_K', 50))
@@ -0,0 +1,250 @@
+"""
+Local stand-in for the Ollama API, for deterministic benchmarks and load tests of llm_service.
+
+Implements the endpoints LLMProcessor uses: GET /api/tags, GET /api/ps and POST /api/generate,
+streaming (NDJSON) and non-streaming; a generate request without prompt only "loads" the model. Every generation is answered from a recording when one exists,
+otherwise with synthetic JSON that is valid against the request's "format" schema. Latency is
+simulated per prompt token (prefill) and per generated token (decode), and at most --parallel
+generations run at once, like OLLAMA_NUM_PARALLEL on a real server.
+
+Modes:
+    synthetic  recordings (if any) are replayed, everything else is synthetic
+    replay     only recordings; a prompt that was not recorded gets HTTP 404
+    record     requests are forwarded to --upstream and the responses appended to --recordings
+
+Example:
+    python llm_service/mock_ollama.py --port 11435 --ms-per-token 20 --prompt-ms-per-token 0.5
+    OLLAMA_API_BASE=http://localhost:11435 python llm_service/app.py
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from flask import Flask, Response, jsonify, request
+import requests
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_service.utils.token_budget import estimate_tokens
+
+app = Flask(__name__)
+
+settings = {
+    "mode": "synthetic",
+    "model": "llama2:7b",
+    "upstream": None,
+    "recordings": None,
+    "ms_per_token": 20.0,
+    "prompt_ms_per_token": 0.5,
+    "jitter": 0.0,
+    "chars_per_chunk": 4,
+}
+_recordings = {}
+_recordings_lock = threading.Lock()
+_slots = None
+# Models that received a generation, reported by /api/ps as loaded
+_loaded = set()
+
+
+def recording_key(model, prompt, fmt):
+    """Recordings are matched on model, prompt and output format; sampling options are ignored."""
+    material = json.dumps({"model": model, "prompt": prompt, "format": fmt}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def load_recordings(path):
+    if not path or not os.path.exists(path):
+        return {}
+    recordings = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                recordings[entry["key"]] = entry["response"]
+    return recordings
+
+
+def _synthetic_value(field, field_schema, rng):
+    types = field_schema.get("type", "string")
+    types = types if isinstance(types, list) else [types]
+    if "object" in types:
+        return synthetic_object(field_schema, rng)
+    if "integer" in types:
+        return rng.randint(50, 95)
+    if "number" in types:
+        return round(rng.uniform(3.0, 5.0), 2)
+    if "boolean" in types:
+        return rng.random() < 0.5
+    if "string" in types:
+        words = rng.randint(3, 40)
+        return f"Synthetic {field.replace('_', ' ')}: " + " ".join(rng.choice(("lorem", "ipsum", "dolor", "sit", "amet")) for _ in range(words))
+    return None
+
+
+def synthetic_object(schema, rng):
+    """An object with every property of the schema filled with a value of its type."""
+    return {field: _synthetic_value(field, sub_schema, rng) for field, sub_schema in schema.get("properties", {}).items()}
+
+
+def synthetic_response(prompt, fmt):
+    """
+    Deterministic synthetic output for a prompt: seeded by the prompt, valid against the schema
+    in "format". Without a schema the quoted field names of the prompt's Field(s): line are used.
+    """
+    rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+    if isinstance(fmt, dict):
+        return json.dumps(synthetic_object(fmt, rng), ensure_ascii=False)
+    instruction = prompt.split("<</SYS>>")[-1]
+    match = re.search(r"Fields?:\s*(.*)", instruction)
+    fields = re.findall(r'"(\w+)"', match.group(1)) if match else []
+    return json.dumps({field: _synthetic_value(field, {"type": "string"}, rng) for field in fields}, ensure_ascii=False)
+
+
+def _record(key, response_text):
+    with _recordings_lock:
+        _recordings[key] = response_text
+        if settings["recordings"]:
+            with open(settings["recordings"], "a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "response": response_text}, ensure_ascii=False) + "\n")
+
+
+def _resolve(payload):
+    """
+    Output text for a generate request, or None when replay mode has no recording.
+    """
+    model = payload.get("model", settings["model"])
+    prompt = payload.get("prompt", "")
+    fmt = payload.get("format")
+    key = recording_key(model, prompt, fmt)
+
+    if settings["mode"] == "record":
+        upstream = requests.post(f"{settings['upstream']}/api/generate", json={**payload, "stream": False}, timeout=600)
+        upstream.raise_for_status()
+        text = upstream.json().get("response", "")
+        _record(key, text)
+        return text
+    with _recordings_lock:
+        recorded = _recordings.get(key)
+    if recorded is not None:
+        return recorded
+    if settings["mode"] == "replay":
+        return None
+    return synthetic_response(prompt, fmt)
+
+
+def _delay(tokens, ms_per_token):
+    if tokens <= 0 or ms_per_token <= 0:
+        return 0.0
+    jitter = settings["jitter"]
+    factor = 1.0 + random.uniform(-jitter, jitter) if jitter else 1.0
+    return tokens * ms_per_token * factor / 1000
+
+
+@app.route('/api/tags', methods=['GET'])
+def tags():
+    return jsonify({"models": [{"name": settings["model"], "model": settings["model"], "size": 0}]})
+
+
+@app.route('/api/ps', methods=['GET'])
+def ps():
+    return jsonify({"models": [{"name": model, "model": model, "size": 0} for model in sorted(_loaded)]})
+
+
+@app.route('/api/generate', methods=['POST'])
+def generate():
+    payload = request.json or {}
+    prompt = payload.get("prompt", "")
+    _loaded.add(payload.get("model", settings["model"]))
+    if not prompt:
+        return jsonify({"model": payload.get("model"), "response": "", "done": True, "done_reason": "load"})
+    num_predict = (payload.get("options") or {}).get("num_predict", -1)
+    stream = payload.get("stream", True)
+
+    _slots.acquire()
+    try:
+        started = time.monotonic()
+        text = _resolve(payload)
+    except Exception:
+        _slots.release()
+        raise
+    if text is None:
+        _slots.release()
+        return jsonify({"error": "no recording for this prompt"}), 404
+
+    # Chunks of a few characters stand in for tokens
+    step = settings["chars_per_chunk"]
+    pieces = [text[i:i + step] for i in range(0, len(text), step)]
+    done_reason = "stop"
+    if num_predict and 0 < num_predict < len(pieces):
+        pieces = pieces[:num_predict]
+        done_reason = "length"
+    prompt_tokens = estimate_tokens(prompt)
+    prefill = _delay(prompt_tokens, settings["prompt_ms_per_token"])
+
+    def final_chunk(response_text):
+        total = time.monotonic() - started
+        return {
+            "model": settings["model"], "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "response": response_text, "done": True, "done_reason": done_reason,
+            "total_duration": int(total * 1e9), "load_duration": 0,
+            "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(prefill * 1e9),
+            "eval_count": len(pieces), "eval_duration": int(max(0.0, total - prefill) * 1e9),
+        }
+
+    if not stream:
+        try:
+            time.sleep(prefill + sum(_delay(1, settings["ms_per_token"]) for _ in pieces))
+            return jsonify(final_chunk("".join(pieces)))
+        finally:
+            _slots.release()
+
+    def stream_chunks():
+        # The slot is freed when the client disconnects, as Ollama stops generating then
+        try:
+            time.sleep(prefill)
+            for piece in pieces:
+                time.sleep(_delay(1, settings["ms_per_token"]))
+                yield json.dumps({"model": settings["model"], "response": piece, "done": False}, ensure_ascii=False) + "\n"
+            yield json.dumps(final_chunk("")) + "\n"
+        finally:
+            _slots.release()
+
+    return Response(stream_chunks(), mimetype="application/x-ndjson")
+
+
+def main(argv=None):
+    global _slots
+    parser = argparse.ArgumentParser(description="Local stand-in for the Ollama API with record/replay.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--mode', choices=['synthetic', 'replay', 'record'], default='synthetic')
+    parser.add_argument('--model', default='llama2:7b', help="Model name reported by /api/tags")
+    parser.add_argument('--upstream', default='http://localhost:11434', help="Real Ollama used in record mode")
+    parser.add_argument('--recordings', help="JSONL file of recorded responses (read in all modes, appended in record mode)")
+    parser.add_argument('--parallel', type=int, default=4, help="Generations served at once, like OLLAMA_NUM_PARALLEL")
+    parser.add_argument('--ms-per-token', type=float, default=20.0, help="Simulated decode latency per generated token")
+    parser.add_argument('--prompt-ms-per-token', type=float, default=0.5, help="Simulated prefill latency per prompt token")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random latency variation, e.g. 0.1 for +/-10%%")
+    args = parser.parse_args(argv)
+
+    if args.mode == 'replay' and not args.recordings:
+        parser.error("--mode replay needs --recordings")
+    settings.update({
+        "mode": args.mode, "model": args.model, "upstream": args.upstream.rstrip('/'), "recordings": args.recordings,
+        "ms_per_token": args.ms_per_token, "prompt_ms_per_token": args.prompt_ms_per_token, "jitter": args.jitter,
+    })
+    _slots = threading.BoundedSemaphore(args.parallel)
+    _recordings.update(load_recordings(args.recordings))
+    print(f"Mock Ollama ({args.mode}, {len(_recordings)} recordings) on http://{args.host}:{args.port}")
+    app.run(host=args.host, port=args.port, threaded=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
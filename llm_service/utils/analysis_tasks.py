@@ -0,0 +1,243 @@
+"""
+Background analysis jobs with per-stage progress for the /api/status endpoint.
+"""
+import copy
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from llm_service.utils.cancellation import AnalysisCancelled, CancelToken, current_cancel_token
+
+logger = logging.getLogger(__name__)
+
+
+class AnalysisTask:
+    """Progress of one application analysis. Mutated only through TaskRegistry under its lock."""
+
+    def __init__(self, task_id: str, application_id: int, batch_id: Optional[str] = None,
+                 deadline_seconds: Optional[float] = None):
+        self.task_id = task_id
+        self.application_id = application_id
+        self.batch_id = batch_id
+        self.status = "queued"  # queued -> running -> completed | failed | cancelled
+        self.cancel_token = CancelToken(deadline_seconds)
+        self.current_stage: Optional[str] = None
+        self.running_stages: List[str] = []
+        self.completed_stages: List[str] = []
+        self.reused_stages: List[str] = []
+        self.stage_seconds: Dict[str, float] = {}
+        self.stage_started: Dict[str, float] = {}
+        self.partial_result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.submitted_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished_at or time.time()
+        return {
+            "task_id": self.task_id,
+            "application_id": self.application_id,
+            "batch_id": self.batch_id,
+            "status": self.status,
+            "current_stage": self.current_stage,
+            "running_stages": list(self.running_stages),
+            "completed_stages": list(self.completed_stages),
+            "reused_stages": list(self.reused_stages),
+            "stage_seconds": dict(self.stage_seconds),
+            "queued_seconds": round((self.started_at or end) - self.submitted_at, 1),
+            "elapsed_seconds": round(end - self.started_at, 1) if self.started_at else 0.0,
+            "partial_result": self.partial_result,
+            "error": self.error,
+            "cancellation": self.cancel_token.to_dict(),
+        }
+
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(fraction * len(ordered)))], 1)
+
+
+class TaskRegistry:
+    """
+    Runs analyses on thread pools and keeps their progress in memory.
+    Single interactive analyses and batch analyses use separate pools, so a request from
+    the web UI never waits behind a batch for a worker; at most one task per application
+    is active; finished tasks are kept for ttl seconds.
+    """
+
+    def __init__(self, workers: int, ttl: float, batch_workers: int = 1):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="analysis")
+        self._batch_executor = ThreadPoolExecutor(max_workers=max(1, batch_workers), thread_name_prefix="analysis-batch")
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, AnalysisTask] = {}
+        self._active_by_application: Dict[int, str] = {}
+        self._batches: Dict[str, Dict[str, Any]] = {}  # batch_id -> {"submitted_at", "task_ids"}
+
+    def submit(self, application_id: int, job: Callable[[Callable[[str, str, Optional[Dict[str, Any]]], None]], Any],
+               batch_id: Optional[str] = None, deadline_seconds: Optional[float] = None) -> Tuple[AnalysisTask, bool]:
+        """
+        Queue job(progress) for an application, on the batch pool if batch_id is given.
+        The job runs with the task's CancelToken as current_cancel_token; it expires deadline_seconds from now.
+        Returns:
+            tuple: The task and True if it was created, or the already active task of the application and False
+        """
+        with self._lock:
+            self._expire()
+            active_id = self._active_by_application.get(application_id)
+            if active_id:
+                return self._tasks[active_id], False
+            task = AnalysisTask(str(uuid.uuid4()), application_id, batch_id, deadline_seconds)
+            self._tasks[task.task_id] = task
+            self._active_by_application[application_id] = task.task_id
+        (self._batch_executor if batch_id else self._executor).submit(self._run, task, job)
+        return task, True
+
+    def submit_batch(self, jobs: List[Tuple[int, Callable]], deadline_seconds: Optional[float] = None) -> Tuple[str, List[AnalysisTask]]:
+        """
+        Queue (application_id, job) pairs as one batch, in the given order.
+        Applications that are already being analyzed keep their active task.
+        """
+        batch_id = str(uuid.uuid4())
+        with self._lock:
+            self._batches[batch_id] = {"submitted_at": time.time(), "task_ids": []}
+        tasks = []
+        for application_id, job in jobs:
+            task, _ = self.submit(application_id, job, batch_id=batch_id, deadline_seconds=deadline_seconds)
+            tasks.append(task)
+        with self._lock:
+            self._batches[batch_id]["task_ids"] = [task.task_id for task in tasks]
+        return batch_id, tasks
+
+    def get_batch(self, batch_id: str) -> Optional[Dict[str, Any]]:
+        """Aggregate progress of a batch: throughput in applications/hour and per-application latency."""
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if not batch:
+                return None
+            tasks = [self._tasks[task_id] for task_id in batch["task_ids"] if task_id in self._tasks]
+            counts = {"queued": 0, "running": 0, "completed": 0, "failed": 0, "cancelled": 0}
+            for task in tasks:
+                counts[task.status] += 1
+            finished = [t for t in tasks if t.finished_at]
+            processing = [t.finished_at - t.started_at for t in finished if t.started_at]
+            turnaround = [t.finished_at - t.submitted_at for t in finished]
+            started = [t.started_at for t in tasks if t.started_at]
+            done = len(finished) == len(tasks)
+            end = max(t.finished_at for t in finished) if finished and done else time.time()
+            elapsed = end - min(started) if started else 0.0
+            return {
+                "batch_id": batch_id,
+                "applications": len(tasks),
+                "status": "completed" if done else "running",
+                "counts": counts,
+                "elapsed_seconds": round(elapsed, 1),
+                "applications_per_hour": round(counts["completed"] * 3600 / elapsed, 1) if elapsed > 0 and counts["completed"] else None,
+                "latency_seconds": {
+                    "processing_p50": _percentile(processing, 0.5),
+                    "processing_p95": _percentile(processing, 0.95),
+                    "processing_max": round(max(processing), 1) if processing else None,
+                    "turnaround_p50": _percentile(turnaround, 0.5),
+                    "turnaround_p95": _percentile(turnaround, 0.95),
+                },
+                "tasks": [
+                    {"task_id": t.task_id, "application_id": t.application_id, "status": t.status,
+                     "current_stage": t.current_stage, "error": t.error,
+                     "elapsed_seconds": round((t.finished_at or time.time()) - t.started_at, 1) if t.started_at else 0.0}
+                    for t in tasks
+                ],
+            }
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            task = self._tasks.get(task_id)
+            return task.to_dict() if task else None
+
+    def cancel(self, task_id: str, reason: str = "cancelled by client") -> Optional[Dict[str, Any]]:
+        """
+        Cancel a queued or running task: a queued one never starts, a running one stops at its
+        next stage boundary or streamed token. Finished tasks are left as they are.
+        """
+        with self._lock:
+            task = self._tasks.get(task_id)
+            if not task:
+                return None
+            if task.status in ("queued", "running"):
+                task.cancel_token.cancel(reason)
+                logger.info(f"Analysis task {task_id} for application {task.application_id}: {reason}")
+            return task.to_dict()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "completed": 0, "failed": 0, "cancelled": 0}
+            for task in self._tasks.values():
+                counts[task.status] += 1
+            counts["batches"] = len(self._batches)
+            return counts
+
+    def _run(self, task: AnalysisTask, job: Callable) -> None:
+        with self._lock:
+            task.status = "running"
+            task.started_at = time.time()
+        token = current_cancel_token.set(task.cancel_token)
+        try:
+            # Cancelled or expired while queued: don't start
+            task.cancel_token.check()
+            job(lambda stage, state, result=None: self._progress(task, stage, state, result))
+            with self._lock:
+                task.status = "completed"
+                task.current_stage = None
+        except AnalysisCancelled as e:
+            logger.info(f"Analysis task {task.task_id} for application {task.application_id} cancelled: {str(e)}")
+            with self._lock:
+                task.status = "cancelled"
+                task.error = str(e)
+        except Exception as e:
+            logger.error(f"Analysis task {task.task_id} for application {task.application_id} failed: {str(e)}")
+            with self._lock:
+                task.status = "failed"
+                task.error = str(e)
+        finally:
+            current_cancel_token.reset(token)
+            with self._lock:
+                task.finished_at = time.time()
+                task.running_stages = []
+                self._active_by_application.pop(task.application_id, None)
+
+    def _progress(self, task: AnalysisTask, stage: str, state: str, result: Optional[Dict[str, Any]]) -> None:
+        """Progress callback handed to the job; state is "running", "done", "reused" or "skipped"."""
+        snapshot = copy.deepcopy(result) if result is not None else None
+        with self._lock:
+            if state == "running":
+                if stage not in task.running_stages:
+                    task.running_stages.append(stage)
+                task.current_stage = stage
+                task.stage_started[stage] = time.time()
+            else:
+                if state == "done" and stage in task.stage_started:
+                    task.stage_seconds[stage] = round(time.time() - task.stage_started[stage], 3)
+                if stage in task.running_stages:
+                    task.running_stages.remove(stage)
+                if state in ("done", "reused"):
+                    task.completed_stages.append(stage)
+                if state == "reused":
+                    task.reused_stages.append(stage)
+                if task.current_stage == stage:
+                    task.current_stage = task.running_stages[-1] if task.running_stages else None
+            if snapshot is not None:
+                task.partial_result = snapshot
+
+    def _expire(self) -> None:
+        """Drop finished tasks older than ttl; caller holds the lock."""
+        cutoff = time.time() - self.ttl
+        for task_id in [t.task_id for t in self._tasks.values() if t.finished_at and t.finished_at < cutoff]:
+            del self._tasks[task_id]
+        for batch_id in [b for b, batch in self._batches.items()
+                         if batch["submitted_at"] < cutoff and not any(t in self._tasks for t in batch["task_ids"])]:
+            del self._batches[batch_id]
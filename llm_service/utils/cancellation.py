@@ -0,0 +1,78 @@
+"""
+Deadlines and cancellation of analyses, checked between stages and while generations stream.
+"""
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+
+class AnalysisCancelled(Exception):
+    """Raised inside an analysis whose client cancelled it or whose deadline passed."""
+
+
+class CancelToken:
+    """
+    Cancellation state of one analysis: cancelled explicitly, or implicitly once the monotonic
+    deadline passes. Also counts the generation work thrown away or avoided because of it.
+    """
+
+    def __init__(self, deadline_seconds: Optional[float] = None):
+        self.deadline = time.monotonic() + deadline_seconds if deadline_seconds else None
+        self.reason: Optional[str] = None
+        self._lock = threading.Lock()
+        self.generations_cancelled = 0
+        self.tokens_discarded = 0
+        self.tokens_avoided_upper_bound = 0
+
+    def cancel(self, reason: str = "cancelled by client") -> None:
+        with self._lock:
+            if self.reason is None:
+                self.reason = reason
+
+    @property
+    def cancelled(self) -> bool:
+        if self.reason is None and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline exceeded")
+        return self.reason is not None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left until the deadline, None without one."""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def check(self) -> None:
+        """
+        Raises:
+            AnalysisCancelled: If the analysis was cancelled or its deadline passed
+        """
+        if self.cancelled:
+            raise AnalysisCancelled(self.reason)
+
+    def record_discarded(self, tokens: int, avoided: int = 0, generation_cancelled: bool = False) -> None:
+        """Count generated tokens nobody will use and the (upper bound of) tokens not generated."""
+        with self._lock:
+            self.tokens_discarded += tokens
+            self.tokens_avoided_upper_bound += avoided
+            self.generations_cancelled += 1 if generation_cancelled else 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        remaining = self.remaining()
+        return {
+            "deadline_in_seconds": round(remaining, 1) if remaining is not None else None,
+            "cancel_reason": self.reason,
+            "generations_cancelled": self.generations_cancelled,
+            "tokens_discarded": self.tokens_discarded,
+            "tokens_avoided_upper_bound": self.tokens_avoided_upper_bound,
+        }
+
+
+# Token of the analysis running in this context. Stage worker threads inherit it because
+# LLMProcessor runs them inside a copy of the caller's context.
+current_cancel_token: ContextVar[Optional[CancelToken]] = ContextVar("current_cancel_token", default=None)
+
+
+def check_cancelled() -> None:
+    """Raise AnalysisCancelled if the analysis of the current context was cancelled."""
+    token = current_cancel_token.get()
+    if token is not None:
+        token.check()
@@ -0,0 +1,224 @@
+"""
+Deterministic extraction of fields that follow fixed patterns in OCR text.
+
+Each extractor returns the complete field dict of a stage, or None when it is not
+confident about every field; the LLM stage then runs as usual.
+"""
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Schema names of the stages that have an extractor
+SUPPORTED_SCHEMAS = ("passport", "degree", "degree_header", "language_certificate", "additional_documents")
+
+# ISO 3166 alpha-3 codes of the most common applicant nationalities, as the LLM would name them
+NATIONALITY_NAMES = {
+    "RUS": "Russia", "VNM": "Vietnam", "CHN": "China", "IND": "India", "KAZ": "Kazakhstan", "UZB": "Uzbekistan",
+    "TJK": "Tajikistan", "KGZ": "Kyrgyzstan", "BLR": "Belarus", "UKR": "Ukraine", "ARM": "Armenia", "AZE": "Azerbaijan",
+    "MNG": "Mongolia", "EGY": "Egypt", "IRN": "Iran", "IRQ": "Iraq", "SYR": "Syria", "TUR": "Turkey", "PAK": "Pakistan",
+    "BGD": "Bangladesh", "NGA": "Nigeria", "GHA": "Ghana", "USA": "USA", "GBR": "United Kingdom", "DEU": "Germany",
+    "FRA": "France", "ITA": "Italy", "ESP": "Spain", "KOR": "South Korea", "JPN": "Japan", "IDN": "Indonesia",
+    "LAO": "Laos", "KHM": "Cambodia", "THA": "Thailand", "MYS": "Malaysia", "BRA": "Brazil", "MEX": "Mexico",
+}
+
+# TORFL (ТРКИ) levels and their CEFR equivalents
+TORFL_LEVELS = [
+    (re.compile(r"(?:ТЭУ|TEU)\b|элементарн\w* уров|elementary level", re.IGNORECASE), "A1"),
+    (re.compile(r"(?:ТБУ|TBU)\b|базов\w* уров|basic level", re.IGNORECASE), "A2"),
+    (re.compile(r"(?:ТРКИ|TORFL)[\s-]*(?:1|I)\b|перв\w* сертификационн", re.IGNORECASE), "B1"),
+    (re.compile(r"(?:ТРКИ|TORFL)[\s-]*(?:2|II)\b|втор\w* сертификационн", re.IGNORECASE), "B2"),
+    (re.compile(r"(?:ТРКИ|TORFL)[\s-]*(?:3|III)\b|трет\w* сертификационн", re.IGNORECASE), "C1"),
+    (re.compile(r"(?:ТРКИ|TORFL)[\s-]*(?:4|IV)\b|четвёрт\w* сертификационн|четверт\w* сертификационн", re.IGNORECASE), "C2"),
+]
+CEFR_PATTERN = re.compile(r"(?<![A-Za-zА-Яа-я])([ABCАВС])\s?([12])(?![0-9])")
+# A CEFR code only counts with level or certificate wording this close to it (not room numbers or form codes)
+CEFR_CONTEXT = re.compile(r"уров|level|CEFR|ТРКИ|TORFL|сертификат|certificate|европейск|european", re.IGNORECASE)
+CEFR_CONTEXT_CHARS = 40
+RUSSIAN_MARKERS = re.compile(r"ТРКИ|TORFL|русск|russian", re.IGNORECASE)
+CYRILLIC_LOOKALIKES = str.maketrans({"А": "A", "В": "B", "С": "C"})
+
+UNIVERSITY_PATTERN = re.compile(r"университет|university|институт|institute|академия|academy|college|колледж", re.IGNORECASE)
+# "University: ...", "Наименование вуза: ..." and similar labelled lines
+UNIVERSITY_LABEL = re.compile(
+    r"^\s*(?:name of (?:the )?(?:university|institution)|awarding institution|university|institution|"
+    r"наименование (?:вуза|организации|учебного заведения|образовательной организации)|учебное заведение|университет|вуз)\s*[:\-–—]\s*(.+)$",
+    re.IGNORECASE
+)
+# A header line naming the university is among the first lines and is a name, not a sentence
+HEADER_LINES = 8
+MAX_HEADER_WORDS = 15
+FIRST_PERSON = re.compile(r"\b(?:I|my|we|our|я|мой|моя|мы|наш)\b", re.IGNORECASE)
+# The GPA must name its 5-point scale ("4.5/5", "4,5 из 5", "4.5 out of 5", "по пятибалльной шкале")
+EXPLICIT_GPA_PATTERN = re.compile(
+    r"(?:GPA|средний балл|average grade)[^0-9\n]{0,25}([2-5][.,]\d{1,2})"
+    r"(?:\s*(?:/|из|out of|of)\s*5(?:[.,]0{1,2})?(?![0-9.,])|[^\n]{0,30}(?:5-point|five-point|пятибалльн))",
+    re.IGNORECASE
+)
+GRADE_WORDS = {5: re.compile(r"\bотлично\b", re.IGNORECASE),
+               4: re.compile(r"\bхорошо\b", re.IGNORECASE),
+               3: re.compile(r"\bудовлетворительно\b", re.IGNORECASE)}
+# Fewer counted grades than this is not a transcript, just a mention
+MIN_GRADE_WORDS = 5
+
+# Score reports longer than this probably contain other certificates the LLM should summarize too
+MAX_SCORE_REPORT_CHARS = 2500
+
+
+def _mrz_check_digit(value: str) -> int:
+    weights = (7, 3, 1)
+    total = 0
+    for i, ch in enumerate(value):
+        if ch.isdigit():
+            n = int(ch)
+        elif ch.isalpha():
+            n = ord(ch) - ord("A") + 10
+        else:
+            n = 0
+        total += n * weights[i % 3]
+    return total % 10
+
+
+def _find_mrz(text: str) -> Optional[List[str]]:
+    """The two 44-character lines of a passport (TD3) machine readable zone."""
+    lines = [re.sub(r"\s", "", line).upper().replace("«", "<") for line in text.splitlines()]
+    for first, second in zip(lines, lines[1:]):
+        if len(first) == 44 and len(second) == 44 and first.startswith("P") and re.fullmatch(r"[A-Z0-9<]{44}", second):
+            return [first, second]
+    return None
+
+
+def extract_passport(text: str) -> Optional[Dict[str, Any]]:
+    """Name, gender, date of birth and nationality from the MRZ, accepted only if its check digits match."""
+    mrz = _find_mrz(text)
+    if not mrz:
+        return None
+    first, second = mrz
+    number, number_check = second[0:9], second[9]
+    birth, birth_check = second[13:19], second[19]
+    if not (number_check.isdigit() and birth_check.isdigit() and birth.isdigit()):
+        return None
+    if _mrz_check_digit(number) != int(number_check) or _mrz_check_digit(birth) != int(birth_check):
+        return None
+
+    surname, _, given = first[5:].partition("<<")
+    surname = surname.replace("<", " ").strip()
+    given = given.replace("<", " ").strip()
+    if not surname or not given:
+        return None
+    year, month, day = int(birth[0:2]), int(birth[2:4]), int(birth[4:6])
+    year += 1900 if year > datetime.now().year % 100 else 2000
+    try:
+        date_of_birth = datetime(year, month, day).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+    gender = {"M": "Male", "F": "Female"}.get(second[20])
+    if not gender:
+        return None
+    code = second[10:13].replace("<", "")
+    return {
+        "name": f"{given.title()} {surname.title()}",
+        "gender": gender,
+        "date_of_birth": date_of_birth,
+        "nationality": NATIONALITY_NAMES.get(code, code),
+    }
+
+
+def _clean_name(value: str) -> Optional[str]:
+    value = re.sub(r"\s+", " ", value.strip(" \t.,;:\"'«»"))
+    return value if UNIVERSITY_PATTERN.search(value) and 10 <= len(value) <= 200 else None
+
+
+def _university_name(text: str) -> Optional[str]:
+    """The university from a labelled line, or from a name-like header line at the top of the document."""
+    lines = text[:1500].splitlines()
+    for line in lines:
+        label = UNIVERSITY_LABEL.match(line)
+        if label and _clean_name(label.group(1)):
+            return _clean_name(label.group(1))
+    header = [line for line in lines if line.strip()][:HEADER_LINES]
+    for line in header:
+        name = _clean_name(line)
+        if name and len(name.split()) <= MAX_HEADER_WORDS and not FIRST_PERSON.search(name) and ". " not in name:
+            return name
+    return None
+
+
+def _gpa(text: str) -> Optional[float]:
+    """GPA stated on an explicit 5-point scale, or the mean of counted grade words (same rule as the LLM prompt)."""
+    explicit = {float(value.replace(",", ".")) for value in EXPLICIT_GPA_PATTERN.findall(text)}
+    if len(explicit) == 1:
+        return round(explicit.pop(), 2)
+    counts = {grade: len(pattern.findall(text)) for grade, pattern in GRADE_WORDS.items()}
+    total = sum(counts.values())
+    if total < MIN_GRADE_WORDS:
+        return None
+    return round(sum(grade * count for grade, count in counts.items()) / total, 2)
+
+
+def extract_degree(text: str, needs_gpa: bool = True) -> Optional[Dict[str, Any]]:
+    """University name from the header and, if needed, the GPA."""
+    university = _university_name(text)
+    if not university:
+        return None
+    if not needs_gpa:
+        return {"university_name": university}
+    gpa = _gpa(text)
+    if gpa is None:
+        return None
+    return {"university_name": university, "gpa": gpa}
+
+
+def extract_language_level(text: str) -> Optional[Dict[str, Any]]:
+    """Russian level as CEFR, from TORFL (ТРКИ) level names or CEFR codes; only if exactly one level is found."""
+    if not RUSSIAN_MARKERS.search(text):
+        return None
+    levels = {level for pattern, level in TORFL_LEVELS if pattern.search(text)}
+    for match in CEFR_PATTERN.finditer(text):
+        window = text[max(0, match.start() - CEFR_CONTEXT_CHARS):match.end() + CEFR_CONTEXT_CHARS]
+        if CEFR_CONTEXT.search(window):
+            levels.add(f"{match.group(1).translate(CYRILLIC_LOOKALIKES)}{match.group(2)}")
+    if len(levels) != 1:
+        return None
+    return {"russian_language_level": levels.pop()}
+
+
+def extract_test_scores(text: str) -> Optional[Dict[str, Any]]:
+    """Summary of a single IELTS or TOEFL score report."""
+    if len(text) > MAX_SCORE_REPORT_CHARS:
+        return None
+    if re.search(r"\bIELTS\b", text, re.IGNORECASE):
+        overall = re.search(r"overall\s+band\s+score\D{0,15}(\d(?:[.,]\d)?)", text, re.IGNORECASE)
+        if not overall:
+            return None
+        parts = []
+        for skill in ("Listening", "Reading", "Writing", "Speaking"):
+            match = re.search(rf"{skill}\D{{0,15}}(\d(?:[.,]\d)?)", text, re.IGNORECASE)
+            if match:
+                parts.append(f"{skill} {match.group(1).replace(',', '.')}")
+        details = f" ({', '.join(parts)})" if parts else ""
+        return {"additional_documents_summary": f"IELTS Test Report Form: overall band score {overall.group(1).replace(',', '.')}{details}."}
+    if re.search(r"\bTOEFL\b", text, re.IGNORECASE):
+        total = re.search(r"total\s+score\D{0,15}(\d{1,3})", text, re.IGNORECASE)
+        if not total or int(total.group(1)) > 120:
+            return None
+        return {"additional_documents_summary": f"TOEFL iBT score report: total score {total.group(1)}/120."}
+    return None
+
+
+def extract_fields(schema_name: str, text: str) -> Optional[Dict[str, Any]]:
+    """
+    Fields of the stage identified by its schema name, or None if the rules are not confident.
+    """
+    if not text:
+        return None
+    if schema_name == "passport":
+        return extract_passport(text)
+    if schema_name == "degree":
+        return extract_degree(text, needs_gpa=True)
+    if schema_name == "degree_header":
+        return extract_degree(text, needs_gpa=False)
+    if schema_name == "language_certificate":
+        return extract_language_level(text)
+    if schema_name == "additional_documents":
+        return extract_test_scores(text)
+    return None
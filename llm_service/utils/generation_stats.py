@@ -0,0 +1,168 @@
+"""
+Token and timing statistics of Ollama generations, aggregated per stage into histograms.
+"""
+import threading
+from typing import Any, Dict, List, Optional
+
+DURATION_MS_BUCKETS = [50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000, 120000]
+TOKEN_BUCKETS = [16, 32, 64, 128, 256, 512, 1024, 2048, 4096]
+TOKENS_PER_SEC_BUCKETS = [1, 2, 5, 10, 20, 40, 80, 160, 320]
+
+# Histogram name -> (record field, buckets)
+HISTOGRAMS = {
+    "prompt_tokens": ("prompt_tokens", TOKEN_BUCKETS),
+    "eval_tokens": ("eval_tokens", TOKEN_BUCKETS),
+    "prompt_eval_ms": ("prompt_eval_ms", DURATION_MS_BUCKETS),
+    "eval_ms": ("eval_ms", DURATION_MS_BUCKETS),
+    "load_ms": ("load_ms", DURATION_MS_BUCKETS),
+    "prefill_tokens_per_sec": ("prefill_tokens_per_sec", TOKENS_PER_SEC_BUCKETS),
+    "decode_tokens_per_sec": ("decode_tokens_per_sec", TOKENS_PER_SEC_BUCKETS),
+}
+
+
+def generation_record(stage: str, final_chunk: Optional[Dict[str, Any]], first_token_ms: Optional[float] = None,
+                      wall_ms: Optional[float] = None, received_tokens: Optional[int] = None,
+                      model: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Build the statistics record of one generation.
+    With Ollama's final chunk the counters and durations are exact. A stream that was stopped
+    early never receives it; then prefill is approximated by the time to the first token and
+    decode by the rest of the wall time, and the record is marked approximate.
+    """
+    if final_chunk and "eval_count" in final_chunk:
+        record = {
+            "stage": stage,
+            "model": model,
+            "approximate": False,
+            "prompt_tokens": final_chunk.get("prompt_eval_count"),
+            "eval_tokens": final_chunk.get("eval_count"),
+            "prompt_eval_ms": final_chunk.get("prompt_eval_duration", 0) / 1e6,
+            "eval_ms": final_chunk.get("eval_duration", 0) / 1e6,
+            "load_ms": final_chunk.get("load_duration", 0) / 1e6,
+            "total_ms": final_chunk.get("total_duration", 0) / 1e6,
+        }
+    else:
+        prefill_ms = first_token_ms
+        record = {
+            "stage": stage,
+            "model": model,
+            "approximate": True,
+            "prompt_tokens": None,
+            "eval_tokens": received_tokens,
+            "prompt_eval_ms": prefill_ms,
+            "eval_ms": wall_ms - prefill_ms if wall_ms is not None and prefill_ms is not None else None,
+            "load_ms": None,
+            "total_ms": wall_ms,
+        }
+    if record["prompt_tokens"] and record["prompt_eval_ms"]:
+        record["prefill_tokens_per_sec"] = record["prompt_tokens"] * 1000 / record["prompt_eval_ms"]
+    if record["eval_tokens"] and record["eval_ms"]:
+        record["decode_tokens_per_sec"] = record["eval_tokens"] * 1000 / record["eval_ms"]
+    return record
+
+
+class _Histogram:
+    """Cumulative histogram ("le" buckets, like Prometheus) with sum and count."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        cumulative = {}
+        running = 0
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            running += count
+            cumulative[str(bound)] = running
+        return {"buckets": cumulative, "sum": round(self.sum, 1), "count": self.count}
+
+
+class GenerationStats:
+    """
+    Per-stage histograms of generation statistics for /api/metrics, plus counters of
+    cache hits, approximate records and model reloads (load_duration above reload_threshold_ms).
+    """
+
+    def __init__(self, reload_threshold_ms: float):
+        self.reload_threshold_ms = reload_threshold_ms
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict[str, Any]] = {}
+
+    def _stage(self, stage: str) -> Dict[str, Any]:
+        if stage not in self._stages:
+            self._stages[stage] = {
+                "generations": 0, "cache_hits": 0, "approximate": 0, "model_reloads": 0,
+                "histograms": {name: _Histogram(buckets) for name, (_, buckets) in HISTOGRAMS.items()},
+            }
+        return self._stages[stage]
+
+    def is_reload(self, record: Dict[str, Any]) -> bool:
+        return (record.get("load_ms") or 0) > self.reload_threshold_ms
+
+    def observe(self, record: Dict[str, Any]) -> None:
+        with self._lock:
+            for stage in (record["stage"], "all"):
+                entry = self._stage(stage)
+                entry["generations"] += 1
+                entry["approximate"] += 1 if record["approximate"] else 0
+                entry["model_reloads"] += 1 if self.is_reload(record) else 0
+                for name, (field, _) in HISTOGRAMS.items():
+                    if record.get(field) is not None:
+                        entry["histograms"][name].observe(record[field])
+
+    def observe_cache_hit(self, stage: str) -> None:
+        with self._lock:
+            for name in (stage, "all"):
+                self._stage(name)["cache_hits"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                stage: {
+                    "generations": entry["generations"],
+                    "cache_hits": entry["cache_hits"],
+                    "approximate": entry["approximate"],
+                    "model_reloads": entry["model_reloads"],
+                    "histograms": {name: h.to_dict() for name, h in entry["histograms"].items()},
+                }
+                for stage, entry in sorted(self._stages.items())
+            }
+
+
+def summarize(records: List[Dict[str, Any]], reload_threshold_ms: float) -> Dict[str, Any]:
+    """Per-stage (with the model used) and total sums of the generation records of one application, for the analysis result."""
+    def empty():
+        return {"generations": 0, "cache_hits": 0, "approximate": 0, "prompt_tokens": 0, "eval_tokens": 0,
+                "prompt_eval_ms": 0.0, "eval_ms": 0.0, "load_ms": 0.0, "model_reloads": 0}
+
+    stages: Dict[str, Dict[str, Any]] = {}
+    total = empty()
+    for record in records:
+        if record.get("model"):
+            stages.setdefault(record["stage"], empty())["model"] = record["model"]
+        for entry in (stages.setdefault(record["stage"], empty()), total):
+            if record.get("cache_hit"):
+                entry["cache_hits"] += 1
+                continue
+            entry["generations"] += 1
+            entry["approximate"] += 1 if record.get("approximate") else 0
+            for field in ("prompt_tokens", "eval_tokens", "prompt_eval_ms", "eval_ms", "load_ms"):
+                entry[field] += record.get(field) or 0
+            entry["model_reloads"] += 1 if (record.get("load_ms") or 0) > reload_threshold_ms else 0
+    for entry in list(stages.values()) + [total]:
+        for field in ("prompt_eval_ms", "eval_ms", "load_ms"):
+            entry[field] = round(entry[field], 1)
+        entry["decode_tokens_per_sec"] = round(entry["eval_tokens"] * 1000 / entry["eval_ms"], 1) if entry["eval_ms"] else None
+    return {"stages": stages, "total": total}
@@ -0,0 +1,64 @@
+"""
+JSON schemas for structured Ollama output and a minimal validator for them.
+Only the subset the stage schemas use is supported: object, string, number,
+integer, boolean and null types (single or list), properties and required.
+"""
+from typing import Any, Dict, List
+
+# JSON type of each extracted field; everything else is a string
+FIELD_TYPES = {
+    "gpa": "number",
+    "evaluation_score": "integer",
+}
+
+
+def field_schema(field: str) -> Dict[str, Any]:
+    """Schema of a single field; null is allowed for data missing from the document."""
+    return {"type": [FIELD_TYPES.get(field, "string"), "null"]}
+
+
+def build_object_schema(fields: List[str]) -> Dict[str, Any]:
+    """Schema of a flat object with all the given fields required."""
+    return {
+        "type": "object",
+        "properties": {field: field_schema(field) for field in fields},
+        "required": list(fields),
+    }
+
+
+def _type_matches(value: Any, expected: str) -> bool:
+    if expected == "object":
+        return isinstance(value, dict)
+    if expected == "string":
+        return isinstance(value, str)
+    if expected == "integer":
+        return isinstance(value, int) and not isinstance(value, bool)
+    if expected == "number":
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if expected == "boolean":
+        return isinstance(value, bool)
+    if expected == "null":
+        return value is None
+    return True
+
+
+def validate(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """
+    Validate a parsed JSON value.
+    Returns:
+        list: Human readable errors, empty if the value matches the schema
+    """
+    errors = []
+    expected = schema.get("type")
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(_type_matches(value, t) for t in types):
+            return [f"{path}: expected {'/'.join(types)}, got {type(value).__name__}"]
+    if isinstance(value, dict):
+        for key in schema.get("required", []):
+            if key not in value:
+                errors.append(f"{path}: missing required field '{key}'")
+        for key, sub_schema in schema.get("properties", {}).items():
+            if key in value:
+                errors.extend(validate(value[key], sub_schema, f"{path}.{key}"))
+    return errors
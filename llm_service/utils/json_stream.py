@@ -0,0 +1,49 @@
+"""
+Incremental detection of a complete top-level JSON object in streamed LLM output.
+"""
+
+
+class JsonObjectScanner:
+    """
+    Fed with generated text piece by piece, reports when the first top-level
+    JSON object has been closed. Braces inside string literals are ignored.
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.started = False
+        self.closed = False
+        self.end_offset = None  # length of the text up to and including the closing brace
+        self._consumed = 0
+
+    def feed(self, piece: str) -> bool:
+        """
+        Returns:
+            bool: True once the first top-level object is complete
+        """
+        if self.closed:
+            return True
+        for i, ch in enumerate(piece):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                if self.started:
+                    self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+                self.started = True
+            elif ch == "}" and self.started:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.closed = True
+                    self.end_offset = self._consumed + i + 1
+                    return True
+        self._consumed += len(piece)
+        return False
@@ -6,16 +6,119 @@ import sys
 import logging
 import json
 import re
+import hashlib
+import time
+import math
+import threading
+import contextvars
 import requests
-from typing import Dict, List, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Callable, Dict, List, Any, Optional, Tuple
 from datetime import datetime
 
 # Add parent directory to path to import config
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from llm_service.config import (
-    OLLAMA_API_BASE, OLLAMA_MODEL, OLLAMA_TIMEOUT,
-    MAX_TOKENS, TEMPERATURE, TOP_P, TOP_K, SYSTEM_PROMPT
+    OLLAMA_API_BASE, OLLAMA_BACKENDS, OLLAMA_MODEL, OLLAMA_EXTRACTION_MODEL, OLLAMA_TIMEOUT,
+    OLLAMA_MAX_RETRIES, OLLAMA_RETRY_BACKOFF, OLLAMA_CIRCUIT_FAILURES, OLLAMA_CIRCUIT_COOLDOWN, OLLAMA_HEDGE_AFTER, OLLAMA_KEEP_ALIVE,
+    MAX_TOKENS, TEMPERATURE, TOP_P, TOP_K, SYSTEM_PROMPT,
+    OLLAMA_NUM_PARALLEL, OLLAMA_POOL_SIZE, OLLAMA_HEALTH_INTERVAL,
+    LLM_CACHE_ENABLED, LLM_CACHE_DIR, LLM_CACHE_MEMORY_ENTRIES, LLM_CACHE_MAX_MB, LLM_CACHE_TTL,
+    OLLAMA_NUM_CTX, LLM_CONSOLIDATED_MODE, LLM_CONSOLIDATED_MAX_TOKENS,
+    LLM_STRUCTURED_OUTPUT, LLM_SCHEMA_MAX_RETRIES,
+    LLM_CHUNK_TOKENS, LLM_CHUNK_NOTES_TOKENS, LLM_STAGE_ROUTES, LLM_STAGE_NUM_PREDICT, LLM_STREAMING,
+    LLM_ADAPTIVE_NUM_PREDICT, LLM_NUM_PREDICT_PERCENTILE, LLM_NUM_PREDICT_MARGIN, LLM_NUM_PREDICT_MIN_SAMPLES, LLM_RELOAD_THRESHOLD_MS, LLM_FAST_PATH
 )
+from llm_service.utils.ollama_client import OllamaClient
+from llm_service.utils.response_cache import ResponseCache, make_cache_key
+from llm_service.utils.token_budget import estimate_tokens, split_into_chunks
+from llm_service.utils import json_schema
+from llm_service.utils.json_stream import JsonObjectScanner
+from llm_service.utils.generation_stats import GenerationStats, generation_record, summarize
+from llm_service.utils import fast_extractors
+from llm_service.utils.stage_routing import StageRouter, load_routes
+from llm_service.utils.output_budget import OutputBudget
+from llm_service.utils.cancellation import AnalysisCancelled, check_cancelled, current_cancel_token
+
+# Bump whenever prompt templates change so cached generations of old templates are not reused
+PROMPT_TEMPLATE_VERSION = "2"
+
+# JSON fields each per-document stage returns (and its _update_* method reads)
+STAGE_FIELDS = {
+    "passport": ["name", "gender", "date_of_birth", "nationality"],
+    "cv": ["cv_summary"],
+    "degree": ["university_name", "gpa"],
+    "motivation_letter": ["motivation_letter_summary"],
+    "recommendation_letter": ["recommendation_letter_summary", "recommendation_author"],
+    "language_certificate": ["russian_language_level"],
+    "achievements": ["achievements_summary"],
+    "additional_documents": ["additional_documents_summary"],
+    "degree_header": ["university_name"],
+    "evaluation": ["evaluation_score", "evaluation_comments"],
+}
+STUDENT_INFO_STAGES = ("passport", "degree", "language_certificate")
+
+FIELD_DESCRIPTIONS = {
+    "name": "string",
+    "gender": "string",
+    "date_of_birth": "string, YYYY-MM-DD",
+    "nationality": "string",
+    "university_name": "string, or \"Unknown\"",
+    "gpa": "float, rounded to 2 decimals",
+    "russian_language_level": "string, e.g. A1-C2",
+    "cv_summary": "string, max 200 words, software skills, programming languages and projects",
+    "motivation_letter_summary": "string, max 200 words, purpose of master's study and future plans",
+    "recommendation_letter_summary": "string, max 200 words",
+    "recommendation_author": "string",
+    "achievements_summary": "string, personal achievements and awards",
+    "additional_documents_summary": "string, brief summary of additional documents/certificates",
+    "evaluation_score": "integer, 0-100",
+    "evaluation_comments": "string, English",
+    "notes": "string, concise notes from a part of a long document",
+}
+
+# Rules every task shares. Together with the system prompt and the field reference they form the
+# system block, which is byte-identical for every prompt, so Ollama can reuse its KV cache for it
+# across stages and applications instead of evaluating it again.
+JSON_OUTPUT_RULES = """Output rules for every task:
+- Format your response STRICTLY as a JSON object. Ensure all string values are properly escaped for JSON (e.g., use \\" for quotes, \\n for newlines).
+- Return ONLY the JSON object without any text before or after it.
+- Include every field the task asks for. If the content is empty or a field is not found, still include it as null unless the task says otherwise.
+- Summary, comment and name values MUST be a single flat string, not a nested JSON object or dictionary."""
+
+FIELD_REFERENCE = "Field reference:\n" + "\n".join(f'- "{field}": {description}' for field, description in FIELD_DESCRIPTIONS.items())
+
+SYSTEM_BLOCK = f"{SYSTEM_PROMPT.strip()}\n\n{JSON_OUTPUT_RULES}\n\n{FIELD_REFERENCE}"
+
+SHARED_PROMPT_PREFIX = f"<s>[INST] <<SYS>>\n{SYSTEM_BLOCK}\n<</SYS>>\n\n"
+
+# Extra guidance for the map step of chunked documents, per document type
+CHUNK_NOTES_HINTS = {
+    "degree": "List every course grade (Отлично/Хорошо/Удовлетворительно/зачтено) exactly as written, one per course, and the university name if present.",
+    "passport": "Copy the name, gender, date of birth and nationality exactly as written.",
+}
+
+# Fixed prompt overhead of a per-document stage (shared prefix, instructions, example)
+STAGE_PROMPT_OVERHEAD_TOKENS = estimate_tokens(SHARED_PROMPT_PREFIX) + 200
+# Smallest document budget of a stage; a route whose num_ctx leaves less is misconfigured
+MIN_STAGE_DOCUMENT_TOKENS = 256
+
+# Fixed prompt overhead of the consolidated mode (shared prefix, instructions, field list)
+CONSOLIDATED_OVERHEAD_TOKENS = estimate_tokens(SHARED_PROMPT_PREFIX) + 400
+
+# Chunks read after the JSON object closed while waiting for Ollama's "done" chunk of a schema-constrained
+# generation (the grammar ends it right after the object; the bound only guards against whitespace runs)
+DONE_CHUNK_GRACE = 8
+
+# Leading characters of a prompt's instructions that identify its kind for slot scheduling
+PROMPT_KEY_CHARS = 64
+
+# The university name is on the first lines of a degree certificate
+DEGREE_HEADER_CHARS = 1500
+
+# Generation records of the application being processed; stage threads see it through the copied context
+_generation_log: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar("generation_log", default=None)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
@@ -24,13 +127,34 @@ logger = logging.getLogger(__name__)
 class LLMProcessor:
     """Class for processing documents with LLaMA2-7B using Ollama."""
 
-    def __init__(self):
-        """Initialize LLM processor with Ollama."""
+    def __init__(self, client: Optional[OllamaClient] = None, cache: Optional[ResponseCache] = None):
+        """
+        Initialize LLM processor with Ollama.
+        The processor is meant to be created once per process and shared between requests;
+        an unreachable Ollama at startup is logged and picked up later by the health probe.
+        """
         logger.info("Initializing LLM Processor with Ollama (LLaMA2-7B)...")
         
         try:
+            self.client = client or OllamaClient(
+                OLLAMA_BACKENDS, OLLAMA_MODEL, OLLAMA_NUM_PARALLEL, OLLAMA_POOL_SIZE, OLLAMA_HEALTH_INTERVAL,
+                max_retries=OLLAMA_MAX_RETRIES, retry_backoff=OLLAMA_RETRY_BACKOFF, failure_threshold=OLLAMA_CIRCUIT_FAILURES,
+                circuit_cooldown=OLLAMA_CIRCUIT_COOLDOWN, hedge_after=OLLAMA_HEDGE_AFTER,
+                keep_alive=OLLAMA_KEEP_ALIVE or None
+            )
+            if cache is None and LLM_CACHE_ENABLED:
+                cache = ResponseCache(LLM_CACHE_DIR or None, LLM_CACHE_MEMORY_ENTRIES, LLM_CACHE_MAX_MB * 1024 * 1024, LLM_CACHE_TTL)
+            self.cache = cache
+            self.router = StageRouter(
+                OLLAMA_MODEL, MAX_TOKENS, OLLAMA_NUM_CTX, TEMPERATURE, load_routes(LLM_STAGE_ROUTES), OLLAMA_EXTRACTION_MODEL,
+                builtin_num_predict={"consolidated": LLM_CONSOLIDATED_MAX_TOKENS, "chunk_notes": LLM_CHUNK_NOTES_TOKENS},
+                stage_num_predict=LLM_STAGE_NUM_PREDICT
+            )
             # Check if Ollama is running
-            self._check_ollama_status()
+            try:
+                self._check_ollama_status()
+            except Exception as e:
+                logger.error(f"Ollama is not reachable yet: {str(e)}")
 
             self.api_base = OLLAMA_API_BASE
             self.model = OLLAMA_MODEL
@@ -39,7 +163,26 @@ class LLMProcessor:
             self.top_p = TOP_P
             self.top_k = TOP_K
             self.timeout = OLLAMA_TIMEOUT
-            logger.info(f"LLM Processor initialized successfully with model: {self.model}")
+            self.max_parallel_stages = OLLAMA_NUM_PARALLEL * len(self.client.backends)
+            self.num_ctx = OLLAMA_NUM_CTX
+            self.consolidated_mode = LLM_CONSOLIDATED_MODE
+            self.structured_output = LLM_STRUCTURED_OUTPUT
+            self.schema_max_retries = LLM_SCHEMA_MAX_RETRIES
+            self.streaming = LLM_STREAMING
+            self.fast_path = LLM_FAST_PATH
+            self.adaptive_num_predict = LLM_ADAPTIVE_NUM_PREDICT
+            self.output_budget = OutputBudget(LLM_NUM_PREDICT_PERCENTILE, LLM_NUM_PREDICT_MARGIN, LLM_NUM_PREDICT_MIN_SAMPLES)
+            self._stats_lock = threading.Lock()
+            self.prefix_tokens = estimate_tokens(SHARED_PROMPT_PREFIX)
+            self.generation_stats = GenerationStats(LLM_RELOAD_THRESHOLD_MS)
+            self.prefill_stats = {"generations": 0, "prompt_tokens_estimated": 0, "prompt_eval_tokens": 0, "prompt_eval_ms": 0.0,
+                                  "first_token_samples": 0, "first_token_ms": 0.0}
+            self.stream_stats = {"streamed_generations": 0, "early_stops": 0, "tokens_received": 0, "tokens_saved_upper_bound": 0}
+            self.fast_path_stats: Dict[str, Dict[str, int]] = {}
+            self.cancel_stats = {"analyses_cancelled": 0, "generations_cancelled": 0, "tokens_discarded": 0, "tokens_avoided_upper_bound": 0}
+            self.schema_stats = {"generations": 0, "valid_first_try": 0, "retries": 0,
+                                 "recovered_by_retry": 0, "invalid_after_retries": 0, "wasted_generations": 0}
+            logger.info(f"LLM Processor initialized successfully with model: {self.model} (stage models: {self.router.models()})")
         except Exception as e:
             logger.error(f"Error initializing LLM Processor: {str(e)}")
             raise
@@ -50,61 +193,132 @@ class LLMProcessor:
         Raises:
             Exception: If Ollama is not running
         """
-        try:
-            response = requests.get(f"{OLLAMA_API_BASE}/api/tags", timeout=5)
-            if response.status_code != 200:
-                raise Exception(f"Ollama returned status code {response.status_code}")
-            models = response.json().get("models", [])
-            model_names = [model.get("name") for model in models]
-            if OLLAMA_MODEL not in model_names:
-                logger.warning(f"Model {OLLAMA_MODEL} not found in Ollama. Available models: {model_names}")
-                logger.warning(f"You may need to pull the model using: ollama pull {OLLAMA_MODEL}")
-            logger.info(f"Ollama is running. Available models: {model_names}")
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Could not connect to Ollama at {OLLAMA_API_BASE}: {str(e)}")
+        if not self.client.check_health():
+            raise Exception(f"Could not connect to Ollama at {OLLAMA_API_BASE}: {self.client.last_error}")
+        model_names = self.client.available_models
+        for model in self.router.models():
+            if model not in model_names:
+                logger.warning(f"Model {model} not found in Ollama. Available models: {model_names}")
+                logger.warning(f"You may need to pull the model using: ollama pull {model}")
+        logger.info(f"Ollama is running. Available models: {model_names}")
 
-    def _format_prompt(self, instruction: str, input_text: Optional[str] = None) -> str:
-        """Format prompt for LLaMA2-7B."""
-        if input_text:
-            prompt = f"<s>[INST] <<SYS>>\n{SYSTEM_PROMPT}\n<</SYS>>\n\n{instruction}\n\n{input_text} [/INST]"
-        else:
-            prompt = f"<s>[INST] <<SYS>>\n{SYSTEM_PROMPT}\n<</SYS>>\n\n{instruction} [/INST]"
-        return prompt
+    def _format_prompt(self, instruction: str, input_text: Optional[str] = None, prompt_format: str = "llama2") -> str:
+        """
+        Format prompt for LLaMA2-7B.
+        Everything variable comes after SHARED_PROMPT_PREFIX, so the prefix stays byte-stable.
+        For the "chat" format only the task is returned: the system block is sent as Ollama's
+        "system" field and the model's own chat template is applied around both.
+        """
+        body = f"{instruction}\n\n{input_text}" if input_text else instruction
+        if prompt_format == "chat":
+            return body
+        return f"{SHARED_PROMPT_PREFIX}{body} [/INST]"
 
-    def _process_with_llm(self, prompt_instruction: str, max_tokens_override: Optional[int] = None) -> str:
-        """Process text with LLaMA2-7B using Ollama."""
+    def _process_with_llm(self, prompt_instruction: str, max_tokens_override: Optional[int] = None, use_cache: bool = True,
+                          schema: Optional[Dict[str, Any]] = None, stage: str = "other", retry: bool = False) -> str:
+        """
+        Process text with LLaMA2-7B using Ollama.
+        Successful generations are served from / stored in the response cache unless use_cache is False.
+        A retry (regenerating an output that failed validation) skips the cache lookup without
+        counting as a hit, miss or bypass; a valid retried output is still stored.
+        With a schema, Ollama constrains the output to it (structured outputs) and only
+        outputs that validate against it are cached. Token and timing statistics are recorded under stage.
+        Model, num_predict, num_ctx and temperature come from the stage's route; max_tokens_override wins over its num_predict.
+        With adaptive num_predict the stage's budget is learned from earlier output lengths; an output
+        cut off by the budget before its JSON was complete is regenerated once with a larger one.
+        Raises AnalysisCancelled instead of generating when the current analysis was cancelled.
+        """
         try:
-            final_formatted_prompt = self._format_prompt(instruction=prompt_instruction)
-            max_new_tokens = max_tokens_override if max_tokens_override else self.max_tokens
+            check_cancelled()
+            route = self.router.route(stage)
+            final_formatted_prompt = self._format_prompt(instruction=prompt_instruction, prompt_format=route["prompt_format"])
+            ceiling = max_tokens_override if max_tokens_override else route["num_predict"]
+            max_new_tokens = self.output_budget.budget(stage, ceiling) if self.adaptive_num_predict else ceiling
             
             payload = {
-                "model": self.model,
+                "model": route["model"],
                 "prompt": final_formatted_prompt,
-                "stream": False,
+                "stream": self.streaming,
                 "options": {
                     "num_predict": max_new_tokens,
-                    "temperature": self.temperature,
+                    "temperature": route["temperature"],
                     "top_p": self.top_p,
-                    "top_k": self.top_k
+                    "top_k": self.top_k,
+                    "num_ctx": route["num_ctx"]
                 }
             }
+            if route["prompt_format"] == "chat":
+                payload["system"] = SYSTEM_BLOCK
+            else:
+                # The prompt already carries the LLaMA2 chat markup; don't let Ollama wrap it in its template again
+                payload["raw"] = True
+            if schema and self.structured_output:
+                payload["format"] = schema
+            if self.client.keep_alive is not None:
+                payload["keep_alive"] = self.client.keep_alive
             
-            logger.info(f"Generating text with max_tokens={max_new_tokens}. Prompt (first 200 chars): {prompt_instruction[:200]}...")
-            response = requests.post(
-                f"{self.api_base}/api/generate",
-                json=payload,
-                timeout=self.timeout
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Ollama API error: {response.status_code} - {response.text}")
-                return json.dumps({"error": f"Ollama API returned status code {response.status_code}"})
-            
-            result = response.json()
-            generated_text = result.get("response", "").strip()
-            logger.debug(f"LLM Raw Output: {generated_text}")
+            cache_key = None
+            if self.cache:
+                if use_cache:
+                    # num_predict is left out: it changes as budgets adapt, and truncated outputs are never stored
+                    key_options = {k: v for k, v in payload["options"].items() if k != "num_predict"}
+                    if "system" in payload:
+                        key_options["system"] = payload["system"]
+                    cache_key = make_cache_key(route["model"], {**key_options, "format": payload.get("format")},
+                                               PROMPT_TEMPLATE_VERSION, final_formatted_prompt)
+                    cached = None if retry else self.cache.get(cache_key)
+                    if cached is not None:
+                        logger.info(f"Cache hit for prompt (first 200 chars): {prompt_instruction[:200]}...")
+                        self.generation_stats.observe_cache_hit(stage)
+                        self._log_generation({"stage": stage, "cache_hit": True})
+                        return cached
+                else:
+                    self.cache.record_bypass()
+
+            prompt_tokens = estimate_tokens(payload.get("system", "") + final_formatted_prompt)
+            for attempt in range(2):
+                logger.info(f"Generating text with {route['model']}, max_tokens={max_new_tokens}. Prompt (first 200 chars): {prompt_instruction[:200]}...")
+                if self.streaming:
+                    with self.client.generate_stream(payload, timeout=self.timeout, key=prompt_instruction[:PROMPT_KEY_CHARS]) as response:
+                        if response.status_code != 200:
+                            logger.error(f"Ollama API error: {response.status_code} - {response.text}")
+                            return json.dumps({"error": f"Ollama API returned status code {response.status_code}"})
+                        elapsed = getattr(response, "elapsed", None)
+                        # Ollama sends the headers with the first token, so this is roughly the prefill time
+                        first_token_ms = elapsed.total_seconds() * 1000 if elapsed else None
+                        read_started = time.monotonic()
+                        generated_text, final_chunk, received = self._read_stream(response, max_new_tokens, constrained="format" in payload)
+                        generated_text = generated_text.strip()
+                        wall_ms = first_token_ms + (time.monotonic() - read_started) * 1000 if first_token_ms is not None else None
+                else:
+                    result = self.client.generate(payload, timeout=self.timeout, key=prompt_instruction[:PROMPT_KEY_CHARS])
+
+                    if result.status_code != 200:
+                        logger.error(f"Ollama API error: {result.status_code} - {result.error_text}")
+                        return json.dumps({"error": f"Ollama API returned status code {result.status_code}"})
+
+                    final_chunk = result.body
+                    generated_text = final_chunk.get("response", "").strip()
+                    first_token_ms = wall_ms = received = None
+                self._record_generation(stage, prompt_tokens, final_chunk, first_token_ms, wall_ms, received, model=route["model"])
+                logger.debug(f"LLM Raw Output: {generated_text}")
+
+                truncated, output_tokens = self._output_length(generated_text, final_chunk, received, max_new_tokens)
+                self.output_budget.observe(stage, output_tokens, max_new_tokens, ceiling, truncated)
+                retry_tokens = min(max(ceiling, 2 * max_new_tokens), route["num_ctx"] - prompt_tokens)
+                if not truncated or attempt > 0 or retry_tokens <= max_new_tokens:
+                    break
+                logger.warning(f"Output of stage '{stage}' was cut off at {max_new_tokens} tokens, retrying with {retry_tokens}")
+                self.output_budget.observe_retry(stage)
+                max_new_tokens = retry_tokens
+                payload["options"]["num_predict"] = max_new_tokens
+
+            if cache_key and generated_text and not truncated and not (schema and self._schema_errors(generated_text, schema)):
+                self.cache.put(cache_key, generated_text)
             return generated_text
             
+        except AnalysisCancelled:
+            raise
         except requests.exceptions.Timeout:
             logger.error(f"Timeout error when calling Ollama API (timeout={self.timeout}s)")
             return json.dumps({"error": "Request to Ollama API timed out"})
@@ -115,10 +329,276 @@ class LLMProcessor:
             logger.error(f"Error processing with LLM: {str(e)}")
             return json.dumps({"error": f"LLM processing error: {str(e)}"})
 
+    def _output_length(self, text: str, final_chunk: Optional[Dict[str, Any]], received: Optional[int],
+                       max_new_tokens: int) -> Tuple[bool, Optional[int]]:
+        """
+        Whether a generation was cut off by num_predict before its JSON object was complete, and
+        how many tokens the output needed (up to the end of the JSON object where that is known).
+        Returns:
+            tuple: (truncated, output tokens or None if unknown)
+        """
+        if final_chunk is None:
+            # Streaming stopped as soon as the JSON object closed
+            return False, received
+        generated = final_chunk.get("eval_count") or received
+        hit_limit = final_chunk.get("done_reason") == "length" or (generated or 0) >= max_new_tokens
+        scanner = JsonObjectScanner()
+        complete = bool(text) and scanner.feed(text)
+        if hit_limit and not complete:
+            return True, generated
+        if complete and generated and text:
+            # Non-streamed outputs include whatever followed the JSON; count only the JSON part
+            return False, max(1, math.ceil(generated * scanner.end_offset / len(text)))
+        return False, generated
+
+    def _read_stream(self, response: requests.Response, max_new_tokens: int,
+                     constrained: bool = False) -> Tuple[str, Optional[Dict[str, Any]], int]:
+        """
+        Read a streamed generation and stop as soon as the first top-level JSON object is complete.
+        Leaving the stream early closes the connection, so Ollama stops decoding the
+        explanations LLaMA2 tends to add after the JSON.
+        A constrained generation (format schema) ends right after its object anyway, so its stream is
+        read on, for at most DONE_CHUNK_GRACE chunks, to get the "done" chunk with the token counts and timings.
+        Returns:
+            tuple: Generated text, the final "done" chunk with Ollama's timings (None after an early stop)
+                and the number of chunks (tokens) received
+        """
+        final_chunk = None
+        scanner = JsonObjectScanner()
+        parts = []
+        received = 0
+        stopped_early = False
+        closed_at = None
+        cancel_token = current_cancel_token.get()
+        for line in response.iter_lines():
+            if cancel_token is not None and cancel_token.cancelled:
+                # Leaving the with block of the caller closes the connection and Ollama stops generating
+                cancel_token.record_discarded(received, max(0, max_new_tokens - received), generation_cancelled=True)
+                with self._stats_lock:
+                    self.cancel_stats["generations_cancelled"] += 1
+                    self.cancel_stats["tokens_discarded"] += received
+                    self.cancel_stats["tokens_avoided_upper_bound"] += max(0, max_new_tokens - received)
+                raise AnalysisCancelled(cancel_token.reason)
+            if not line:
+                continue
+            chunk = json.loads(line)
+            piece = chunk.get("response", "")
+            if piece:
+                parts.append(piece)
+                received += 1
+            if chunk.get("done"):
+                final_chunk = chunk
+                break
+            if closed_at is not None:
+                if received - closed_at >= DONE_CHUNK_GRACE:
+                    stopped_early = True
+                    break
+                continue
+            if piece and scanner.feed(piece):
+                closed_at = received
+                if not constrained:
+                    stopped_early = True
+                    break
+        text = "".join(parts)
+        if closed_at is not None:
+            text = text[:scanner.end_offset]
+        with self._stats_lock:
+            self.stream_stats["streamed_generations"] += 1
+            self.stream_stats["tokens_received"] += received
+            if stopped_early:
+                self.stream_stats["early_stops"] += 1
+                # A schema-constrained generation would have ended at its closing brace anyway: nothing saved
+                if not constrained:
+                    self.stream_stats["tokens_saved_upper_bound"] += max(0, max_new_tokens - received)
+        if stopped_early:
+            logger.debug(f"JSON object closed after {received} tokens, generation stopped early")
+        return text, final_chunk, received
+
+    def get_cancel_stats(self) -> Dict[str, int]:
+        """Cancelled analyses and generations, tokens generated for nothing and tokens not generated thanks to cancelling."""
+        with self._stats_lock:
+            return dict(self.cancel_stats)
+
+    def get_stream_stats(self) -> Dict[str, Any]:
+        """Streaming counters: early stops and (upper bound of) decode tokens saved by them."""
+        with self._stats_lock:
+            return dict(self.stream_stats)
+
+    def _log_generation(self, record: Dict[str, Any]) -> None:
+        """Append to the generation records of the application being processed, if any."""
+        log = _generation_log.get()
+        if log is not None:
+            log.append(record)
+
+    def _record_generation(self, stage: str, prompt_tokens: int, final_chunk: Optional[Dict[str, Any]],
+                           first_token_ms: Optional[float], wall_ms: Optional[float], received: Optional[int],
+                           model: Optional[str] = None) -> None:
+        """
+        Record token counts and timings of a generation: into the per-stage histograms, the records
+        of the current application and the prefill counters.
+        prompt_eval_count only counts tokens that were actually evaluated, so a count well below the
+        prompt size means the shared prefix was served from the KV cache.
+        """
+        record = generation_record(stage, final_chunk, first_token_ms, wall_ms, received, model=model)
+        self.generation_stats.observe(record)
+        self._log_generation(record)
+        if self.generation_stats.is_reload(record):
+            logger.warning(f"Ollama (re)loaded the model for stage '{stage}': load_duration {record['load_ms']:.0f} ms")
+        with self._stats_lock:
+            if final_chunk and "prompt_eval_count" in final_chunk:
+                self.prefill_stats["generations"] += 1
+                self.prefill_stats["prompt_tokens_estimated"] += prompt_tokens
+                self.prefill_stats["prompt_eval_tokens"] += final_chunk.get("prompt_eval_count", 0)
+                self.prefill_stats["prompt_eval_ms"] += final_chunk.get("prompt_eval_duration", 0) / 1e6
+            if first_token_ms is not None:
+                self.prefill_stats["first_token_samples"] += 1
+                self.prefill_stats["first_token_ms"] += first_token_ms
+        if final_chunk and "prompt_eval_count" in final_chunk:
+            logger.info(f"Prompt eval: {final_chunk.get('prompt_eval_count')} of ~{prompt_tokens} prompt tokens "
+                        f"(shared prefix ~{self.prefix_tokens}) in {final_chunk.get('prompt_eval_duration', 0) / 1e6:.0f} ms")
+
+    def get_prefill_stats(self) -> Dict[str, Any]:
+        """Prompt evaluation counters; evaluated_ratio well below 1 shows prefix reuse."""
+        with self._stats_lock:
+            stats = dict(self.prefill_stats)
+        stats["shared_prefix_tokens_estimated"] = self.prefix_tokens
+        stats["evaluated_ratio"] = round(stats["prompt_eval_tokens"] / stats["prompt_tokens_estimated"], 3) if stats["prompt_tokens_estimated"] else None
+        stats["avg_prompt_eval_ms"] = round(stats["prompt_eval_ms"] / stats["generations"], 1) if stats["generations"] else None
+        stats["avg_first_token_ms"] = round(stats["first_token_ms"] / stats["first_token_samples"], 1) if stats["first_token_samples"] else None
+        stats["prompt_eval_ms"] = round(stats["prompt_eval_ms"], 1)
+        stats["first_token_ms"] = round(stats["first_token_ms"], 1)
+        return stats
+
+    def warm_up(self, wait: bool = False) -> None:
+        """Load every model the stages are routed to on all backends, so the first analyses don't pay for loading them."""
+        models = self.router.models()
+        logger.info(f"Warming up {', '.join(models)} (keep_alive {self.client.keep_alive})")
+        self.client.warm_up(models, wait=wait)
+
+    def get_routing_report(self) -> Dict[str, Any]:
+        """
+        The routing table with the token usage of each stage so far, to weigh latency against quality:
+        generated tokens per generation against the stage's num_predict shows how much of the budget is used.
+        """
+        usage = self.generation_stats.snapshot()
+        report = {}
+        for stage, route in self.router.table().items():
+            entry = dict(route)
+            stats = usage.get(stage)
+            if stats:
+                prompt_tokens = stats["histograms"]["prompt_tokens"]["sum"]
+                eval_tokens = stats["histograms"]["eval_tokens"]["sum"]
+                eval_count = stats["histograms"]["eval_tokens"]["count"]
+                entry.update({
+                    "generations": stats["generations"],
+                    "prompt_tokens": prompt_tokens,
+                    "eval_tokens": eval_tokens,
+                    "avg_eval_tokens": round(eval_tokens / eval_count, 1) if eval_count else None,
+                    "num_predict_used": round(eval_tokens / eval_count / route["num_predict"], 3) if eval_count and route["num_predict"] > 0 else None,
+                })
+            report[stage] = entry
+        return report
+
+    def _schema_errors(self, output: str, schema: Dict[str, Any]) -> List[str]:
+        """Validation errors of an LLM output against a schema (empty list if valid)."""
+        data = self._extract_json_object(output)
+        if data is None:
+            return ["no JSON object in output"]
+        return json_schema.validate(data, schema)
+
+    def _generate_structured(self, prompt_instruction: str, schema: Dict[str, Any], max_tokens_override: Optional[int] = None,
+                             use_cache: bool = True, stage: str = "other") -> str:
+        """
+        Generate with a JSON schema and validate the output.
+        Invalid outputs are regenerated at most schema_max_retries times; every invalid generation is counted as wasted.
+        Returns the last output even if it never validated, so the lenient parser can still try it.
+        """
+        output = ""
+        for attempt in range(self.schema_max_retries + 1):
+            output = self._process_with_llm(prompt_instruction, max_tokens_override, use_cache=use_cache, schema=schema, stage=stage,
+                                            retry=attempt > 0)
+            if self._is_error_output(output):
+                # The request itself failed, nothing was generated
+                return output
+            errors = self._schema_errors(output, schema)
+            with self._stats_lock:
+                self.schema_stats["generations"] += 1
+                if not errors:
+                    if attempt == 0:
+                        self.schema_stats["valid_first_try"] += 1
+                    else:
+                        self.schema_stats["recovered_by_retry"] += 1
+                    return output
+                self.schema_stats["wasted_generations"] += 1
+                if attempt < self.schema_max_retries:
+                    self.schema_stats["retries"] += 1
+            logger.warning(f"LLM output failed schema validation (attempt {attempt + 1}): {errors[:3]}")
+        with self._stats_lock:
+            self.schema_stats["invalid_after_retries"] += 1
+        return output
+
+    def _is_error_output(self, output: str) -> bool:
+        """True for the {"error": ...} placeholder _process_with_llm returns when the request failed."""
+        data = self._extract_json_object(output)
+        return isinstance(data, dict) and list(data.keys()) == ["error"]
+
+    def _stage_schema(self, stage_name: str) -> Dict[str, Any]:
+        return json_schema.build_object_schema(STAGE_FIELDS[stage_name])
+
+    def get_schema_stats(self) -> Dict[str, Any]:
+        """Schema validation counters, including the share of generations that were wasted."""
+        with self._stats_lock:
+            stats = dict(self.schema_stats)
+        stats["wasted_rate"] = round(stats["wasted_generations"] / stats["generations"], 4) if stats["generations"] else None
+        return stats
+
+    def _fast_path_schema(self, doc_type: str, doc: Dict[str, Any]) -> str:
+        """Schema name the stage of a document will use (the degree stage is smaller when the grade table gives the GPA)."""
+        if doc_type == "degree":
+            grades = (doc.get("structured_data") or {}).get("grades")
+            if grades and self._compute_gpa_from_grades(grades) is not None:
+                return "degree_header"
+        return doc_type
+
+    def _fast_path_outputs(self, categorized_docs: Dict[str, List[Dict[str, Any]]], count: bool = True) -> Dict[str, str]:
+        """
+        Stage outputs produced by the deterministic extractors, as the JSON the LLM would return.
+        Only stages whose fields were all extracted are included; the others go to the LLM.
+        count=False leaves the attempt statistics alone (used to recognize reused rule outputs).
+        """
+        outputs = {}
+        for doc_type, docs in categorized_docs.items():
+            if doc_type not in STAGE_FIELDS or not docs or not docs[0].get("content"):
+                continue
+            schema_name = self._fast_path_schema(doc_type, docs[0])
+            if schema_name not in fast_extractors.SUPPORTED_SCHEMAS:
+                continue
+            fields = fast_extractors.extract_fields(schema_name, docs[0]["content"])
+            if count:
+                with self._stats_lock:
+                    stats = self.fast_path_stats.setdefault(doc_type, {"attempts": 0, "skipped": 0})
+                    stats["attempts"] += 1
+                    stats["skipped"] += 1 if fields else 0
+            if fields:
+                outputs[doc_type] = json.dumps(fields, ensure_ascii=False)
+        return outputs
+
+    def get_fast_path_stats(self) -> Dict[str, Any]:
+        """Per-stage attempts of the deterministic extractors and the share of LLM calls they skipped."""
+        with self._stats_lock:
+            stats = {stage: dict(entry) for stage, entry in self.fast_path_stats.items()}
+        for entry in stats.values():
+            entry["skip_rate"] = round(entry["skipped"] / entry["attempts"], 4) if entry["attempts"] else None
+        return stats
+
     def _parse_llm_json_output(self, json_str: str, fields: List[str]) -> Dict[str, Any]:
         """Safely parse JSON string from LLM output and extract specified fields."""
         logger.debug(f"Attempting to parse LLM output (first 1000 chars): {json_str[:1000]}")
 
+        data = self._extract_json_object(json_str)
+        if isinstance(data, dict):
+            return {field: data.get(field) for field in fields}
+
         match = re.search(r"\{([\"\w\s\S]*?)\}", json_str, re.DOTALL)
         if match:
             json_str_cleaned = match.group(0)
@@ -169,131 +649,258 @@ class LLMProcessor:
             logger.error(f"Unexpected error during JSON parsing: {e}. Output: {json_str_cleaned[:500]}...")
             return {field: None for field in fields}
 
-    def process_application(self, application_id: int, categorized_docs: Dict[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
-        """Process application documents and extract information."""
+    def process_application(self, application_id: int, categorized_docs: Dict[str, List[Dict[str, Any]]], bypass_cache: bool = False,
+                            progress: Optional[Callable[..., None]] = None,
+                            stage_records: Optional[Dict[str, Dict[str, str]]] = None) -> Dict[str, Any]:
+        """
+        Process application documents and extract information.
+        With bypass_cache=True every stage is regenerated instead of being served from the response cache.
+        progress(stage, state, result) is called when a stage starts ("running"), finishes ("done", with the
+        partial result so far), is served from a stored output ("reused") or is abandoned ("skipped").
+        stage_records maps stage name to {"input_hash", "output"} of a previous analysis: stages whose
+        inputs are unchanged reuse the stored output instead of calling the LLM. It is updated in place
+        with the records of this analysis, ready to be stored.
+        Stages the deterministic extractors fill completely skip the LLM; they are listed in "rule_derived".
+        The result carries "llm_stats": token counts and timings of the generations, per stage and in total.
+        A cancelled analysis (see cancellation.current_cancel_token) stops at the next stage boundary or
+        streamed token and raises AnalysisCancelled; the tokens it had generated are counted as discarded.
+        """
+        log: List[Dict[str, Any]] = []
+        token = _generation_log.set(log)
+        try:
+            result = self._process_application(application_id, categorized_docs, bypass_cache, progress, stage_records)
+        except AnalysisCancelled:
+            discarded = summarize(log, LLM_RELOAD_THRESHOLD_MS)["total"]["eval_tokens"]
+            cancel_token = current_cancel_token.get()
+            if cancel_token is not None:
+                cancel_token.record_discarded(discarded)
+            with self._stats_lock:
+                self.cancel_stats["analyses_cancelled"] += 1
+                self.cancel_stats["tokens_discarded"] += discarded
+            logger.info(f"Application {application_id}: analysis cancelled after {len(log)} generations ({discarded} tokens discarded)")
+            raise
+        finally:
+            _generation_log.reset(token)
+        result["llm_stats"] = summarize(log, LLM_RELOAD_THRESHOLD_MS)
+        totals = result["llm_stats"]["total"]
+        logger.info(f"Application {application_id}: {totals['generations']} generations, {totals['prompt_tokens']} prompt / "
+                    f"{totals['eval_tokens']} generated tokens, {totals['cache_hits']} cache hits")
+        return result
+
+    def _process_application(self, application_id: int, categorized_docs: Dict[str, List[Dict[str, Any]]], bypass_cache: bool,
+                             progress: Optional[Callable[..., None]], stage_records: Optional[Dict[str, Dict[str, str]]]) -> Dict[str, Any]:
+        report = progress or (lambda stage, state, result=None: None)
+        records = stage_records if stage_records is not None else {}
         logger.info(f"Processing application {application_id}")
+
+        input_hashes = {
+            doc_type: self._stage_input_hash(doc_type, docs[0])
+            for doc_type, docs in categorized_docs.items()
+            if doc_type in STAGE_FIELDS and docs and docs[0].get("content")
+        }
+        reusable = {name for name, input_hash in input_hashes.items() if records.get(name, {}).get("input_hash") == input_hash}
+        for name in [name for name in records if name != "evaluation" and name not in input_hashes]:
+            del records[name]  # the document is gone
+
+        # Rules run on the full text, before long documents are condensed for the prompt
+        changed = {doc_type: docs for doc_type, docs in categorized_docs.items() if doc_type not in reusable}
+        rule_outputs = self._fast_path_outputs(changed) if self.fast_path else {}
+        # Reused stages whose stored output is exactly what the rules give were rule-derived before
+        reused_rule_outputs = self._fast_path_outputs(
+            {doc_type: docs for doc_type, docs in categorized_docs.items() if doc_type in reusable}, count=False
+        ) if self.fast_path else {}
+        rule_derived = set(rule_outputs) | {name for name, output in reused_rule_outputs.items() if records[name]["output"] == output}
+
+        check_cancelled()
+        report("fit_documents", "running")
+        changed_docs = {doc_type: docs for doc_type, docs in changed.items() if doc_type not in rule_outputs}
+        categorized_docs = {**categorized_docs, **self._fit_documents_to_budget(changed_docs, use_cache=not bypass_cache)}
+        report("fit_documents", "done")
         result = {
             "student_info": {"name": "", "gender": "", "date_of_birth": "", "age": 0, "nationality": "", "previous_university": "", "gpa": 0.0, "russian_language_level": ""},
             "summaries": {"cv_summary": "", "motivation_letter_summary": "", "recommendation_letter_summary": "", "recommendation_author": "", "achievements_summary": "", "additional_documents_summary": ""},
-            "evaluation": {"score": 0, "comments": ""}
+            "evaluation": {"score": 0, "comments": ""},
+            "rule_derived": sorted(rule_derived)
         }
-        json_instruction = "Format your response STRICTLY as a JSON object. Ensure all string values are properly escaped for JSON (e.g., use \\\" for quotes, \\n for newlines). Return ONLY the JSON object without any text before or after it."
-        string_value_instruction = "The value for this field MUST be a single flat string, not a nested JSON object or dictionary."
+        # Output rules and field descriptions live in SHARED_PROMPT_PREFIX; each prompt below is
+        # task, fields, example and finally the document text.
+        # (stage name, prompt, update function, schema name) for the independent per-document extractions
+        stages = []
 
         # Passport
         if "passport" in categorized_docs and categorized_docs["passport"]:
             passport_text = categorized_docs["passport"][0]["content"]
             if passport_text:
-                prompt = f"""Extract information from the passport. {json_instruction}
+                prompt = f"""Extract information from the passport.
                 Fields: "name" (string), "gender" (string), "date_of_birth" (string, YYYY-MM-DD), "nationality" (string).
-                Calculate age as current year minus birth year. If content is empty or data not found, use appropriate null/empty string values within the JSON.
                 Example: {{"name": "John Doe", "gender": "Male", "date_of_birth": "1990-01-01", "nationality": "USA"}}
-                Passport content: {passport_text}
-                Return only the JSON object without any additional text or explanations.
-                If any field is missing, still include it as null."""
-                passport_info_json_str = self._process_with_llm(prompt)
-                self._update_student_info(result, passport_info_json_str)
+                Passport content: {passport_text}"""
+                stages.append(("passport", prompt, self._update_student_info, "passport"))
             else: logger.info("No passport data provided.")
 
         # CV
         if "cv" in categorized_docs and categorized_docs["cv"]:
             cv_text = categorized_docs["cv"][0]["content"]
             if cv_text:
-                prompt = f"""Summarize the CV, focusing on software skills, programming languages, and projects. {json_instruction}
-                Field: "cv_summary" (string, max 200 words). {string_value_instruction} If content empty, return {{"cv_summary": "No CV data provided"}}.
+                prompt = f"""Summarize the CV, focusing on software skills, programming languages, and projects.
+                Field: "cv_summary" (string, max 200 words). If content empty, return {{"cv_summary": "No CV data provided"}}.
                 Example: {{"cv_summary": "Proficient in Python and ROS. Developed a robotic arm controlled by a web application and a mobile app for remote control using ROS. Specializes in robotics and AI."}}
                 CV content: {cv_text}"""
-                cv_summary_json_str = self._process_with_llm(prompt)
-                self._update_cv_info(result, cv_summary_json_str)
+                stages.append(("cv", prompt, self._update_cv_info, "cv"))
             else: logger.info("No CV data provided."); result["summaries"]["cv_summary"] = "No CV data provided"
 
         # Degree (GPA)
         if "degree" in categorized_docs and categorized_docs["degree"]:
             degree_text = categorized_docs["degree"][0]["content"]
-            if degree_text:
-                prompt = f"""Extract university name and calculate GPA from the degree certificate. {json_instruction}
+            grades = (categorized_docs["degree"][0].get("structured_data") or {}).get("grades")
+            gpa = self._compute_gpa_from_grades(grades) if grades else None
+            if degree_text and gpa is not None:
+                # GPA comes from the OCR grade table; the model only needs the university name from the header
+                logger.info(f"Using GPA {gpa} computed from {len(grades)} structured grade rows.")
+                prompt = f"""Extract the university name from the beginning of the degree certificate.
+                Field: "university_name" (string, or "Unknown").
+                Example: {{"university_name": "Moscow State University"}}
+                Degree content (beginning): {degree_text[:DEGREE_HEADER_CHARS]}"""
+                stages.append(("degree", prompt, self._education_updater_with_gpa(gpa), "degree_header"))
+            elif degree_text:
+                prompt = f"""Extract university name and calculate GPA from the degree certificate.
                 To calculate GPA: Count "Отлично" (5), "Хорошо" (4), "Удовлетворительно" (3). Ignore "зачтено".
                 Formula: GPA = (3 * number of "Удовлетворительно" + 4 * number of "Xорошо" + 5 * number of "Отлично") / (number of "Удовлетворительно" + number of "Xорошо" + number of "Отлично"). 
                 If no such grades, GPA is 0.0. Round GPA to 2 decimal places.
                 Fields: "university_name" (string, or "Unknown"), "gpa" (float).
                 Example: {{"university_name": "Moscow State University", "gpa": 4.53}}
-                Degree content: {degree_text}
-                Return only the JSON object without any additional text or explanations.
-                If any field is missing, still include it as null."""
-                degree_info_json_str = self._process_with_llm(prompt)
-                self._update_education_info(result, degree_info_json_str)
+                Degree content: {degree_text}"""
+                stages.append(("degree", prompt, self._update_education_info, "degree"))
             else: logger.info("No degree data provided.")
 
         # Motivation Letter
         if "motivation_letter" in categorized_docs and categorized_docs["motivation_letter"]:
             motivation_text = categorized_docs["motivation_letter"][0]["content"]
             if motivation_text:
-                prompt = f"""Summarize the motivation letter: purpose for master's study, future plans. {json_instruction}
-                Field: "motivation_letter_summary" (string, max 200 words). {string_value_instruction} If empty, return {{"motivation_letter_summary": "No motivation letter data provided"}}.
+                prompt = f"""Summarize the motivation letter: purpose for master's study, future plans.
+                Field: "motivation_letter_summary" (string, max 200 words). If empty, return {{"motivation_letter_summary": "No motivation letter data provided"}}.
                 Example: {{"motivation_letter_summary": "Aims to specialize in AI..."}}
                 Motivation letter content: {motivation_text}"""
-                motivation_summary_json_str = self._process_with_llm(prompt)
-                self._update_motivation_info(result, motivation_summary_json_str)
+                stages.append(("motivation_letter", prompt, self._update_motivation_info, "motivation_letter"))
             else: logger.info("No motivation letter."); result["summaries"]["motivation_letter_summary"] = "No motivation letter data provided"
 
         # Recommendation Letter
         if "recommendation_letter" in categorized_docs and categorized_docs["recommendation_letter"]:
             recommendation_text = categorized_docs["recommendation_letter"][0]["content"]
             if recommendation_text:
-                prompt = f"""Summarize recommendation letter and identify author. {json_instruction}
+                prompt = f"""Summarize recommendation letter and identify author.
                 Fields: "recommendation_letter_summary" (string, max 200 words), "recommendation_author" (string).
-                {string_value_instruction} for recommendation_letter_summary. If empty, return {{"recommendation_letter_summary": "No recommendation letter data provided", "recommendation_author": ""}}.
+                If empty, return {{"recommendation_letter_summary": "No recommendation letter data provided", "recommendation_author": ""}}.
                 Example: {{"recommendation_letter_summary": "Highly recommended...", "recommendation_author": "Prof. Smith"}}
                 Recommendation letter content: {recommendation_text}"""
-                recommendation_info_json_str = self._process_with_llm(prompt)
-                self._update_recommendation_info(result, recommendation_info_json_str)
+                stages.append(("recommendation_letter", prompt, self._update_recommendation_info, "recommendation_letter"))
             else: logger.info("No recommendation letter."); result["summaries"]["recommendation_letter_summary"] = "No recommendation letter data provided"
 
         # Language Certificate
         if "language_certificate" in categorized_docs and categorized_docs["language_certificate"]:
             language_text = categorized_docs["language_certificate"][0]["content"]
             if language_text:
-                prompt = f"""Extract Russian language proficiency level (e.g., A1-C2). {json_instruction}
-                Field: "russian_language_level" (string). {string_value_instruction} If empty, return {{"russian_language_level": "No language certificate data provided"}}.
+                prompt = f"""Extract Russian language proficiency level (e.g., A1-C2).
+                Field: "russian_language_level" (string). If empty, return {{"russian_language_level": "No language certificate data provided"}}.
                 Example: {{"russian_language_level": "B2"}}
                 Certificate content: {language_text}"""
-                language_info_json_str = self._process_with_llm(prompt)
-                self._update_language_info(result, language_info_json_str)
+                stages.append(("language_certificate", prompt, self._update_language_info, "language_certificate"))
             else: logger.info("No language certificate."); result["student_info"]["russian_language_level"] = "No language certificate data provided"
 
         # Achievements
         if "achievements" in categorized_docs and categorized_docs["achievements"]:
             achievements_text = categorized_docs["achievements"][0]["content"]
             if achievements_text:
-                prompt = f"""List and summarize personal achievements and awards. {json_instruction}
-                Field: "achievements_summary" (string). {string_value_instruction} If empty, return {{"achievements_summary": "No achievements data provided"}}.
+                prompt = f"""List and summarize personal achievements and awards.
+                Field: "achievements_summary" (string). If empty, return {{"achievements_summary": "No achievements data provided"}}.
                 Example: {{"achievements_summary": "Won hackathon. Published paper."}}
                 Achievements document content: {achievements_text}"""
-                achievements_info_json_str = self._process_with_llm(prompt)
-                self._update_achievements_info(result, achievements_info_json_str)
+                stages.append(("achievements", prompt, self._update_achievements_info, "achievements"))
             else: logger.info("No achievements data."); result["summaries"]["achievements_summary"] = "No achievements data provided"
 
         # Additional Documents
         if "additional_documents" in categorized_docs and categorized_docs["additional_documents"]:
             additional_text = categorized_docs["additional_documents"][0]["content"]
             if additional_text:
-                prompt = f"""Briefly summarize additional documents/certificates. {json_instruction}
-                Field: "additional_documents_summary" (string). {string_value_instruction} If empty, return {{"additional_documents_summary": "No additional documents data provided"}}.
+                prompt = f"""Briefly summarize additional documents/certificates.
+                Field: "additional_documents_summary" (string). If empty, return {{"additional_documents_summary": "No additional documents data provided"}}.
                 Example: {{"additional_documents_summary": "IELTS score 7.0. Coursera certificate in ML."}}
                 Additional documents content: {additional_text}"""
-                additional_info_json_str = self._process_with_llm(prompt)
-                self._update_additional_docs_info(result, additional_info_json_str)
+                stages.append(("additional_documents", prompt, self._update_additional_docs_info, "additional_documents"))
             else: logger.info("No additional documents."); result["summaries"]["additional_documents_summary"] = "No additional documents data provided"
 
-        # Evaluation
-        evaluation_prompt_instruction = self._create_evaluation_prompt_instruction(result, json_instruction)
-        evaluation_result_json_str = self._process_with_llm(evaluation_prompt_instruction)
-        self._update_evaluation(result, evaluation_result_json_str)
+        def record(name: str, output: str) -> None:
+            if not self._is_error_output(output):
+                records[name] = {"input_hash": input_hashes[name], "output": output}
+
+        for name, _, update, _ in stages:
+            if name in reusable:
+                update(result, records[name]["output"])
+                report(name, "reused", result)
+            elif name in rule_outputs:
+                update(result, rule_outputs[name])
+                record(name, rule_outputs[name])
+                report(name, "done", result)
+        stages_to_run = [stage for stage in stages if stage[0] not in reusable and stage[0] not in rule_outputs]
+        logger.info(f"Application {application_id}: {len(stages_to_run)} of {len(stages)} extraction stages need the LLM "
+                    f"({len(rule_outputs)} filled by rules)")
+
+        if stages_to_run:
+            check_cancelled()
+            report("consolidated", "running")
+            merged = self._try_consolidated_extraction(result, categorized_docs, stages_to_run, use_cache=not bypass_cache)
+            if merged is not None:
+                for name, _, _, _ in stages_to_run:
+                    record(name, merged)
+                report("consolidated", "done", result)
+            else:
+                report("consolidated", "skipped")
+                updates = {name: update for name, _, update, _ in stages_to_run}
+                for name in updates:
+                    report(name, "running")
+
+                def apply_stage(name: str, output: str) -> None:
+                    updates[name](result, output)
+                    record(name, output)
+                    report(name, "done", result)
+
+                self._run_stages(stages_to_run, use_cache=not bypass_cache, on_done=apply_stage)
+
+        # Evaluation needs every extraction, so it runs last; it is reused only if the profile it sees is unchanged
+        check_cancelled()
+        evaluation_prompt_instruction = self._create_evaluation_prompt_instruction(result)
+        evaluation_hash = self._stage_input_hash("evaluation", {"content": evaluation_prompt_instruction})
+        if records.get("evaluation", {}).get("input_hash") == evaluation_hash:
+            self._update_evaluation(result, records["evaluation"]["output"])
+            report("evaluation", "reused", result)
+        else:
+            report("evaluation", "running")
+            evaluation_result_json_str = self._generate_structured(evaluation_prompt_instruction, self._stage_schema("evaluation"),
+                                                                   use_cache=not bypass_cache, stage="evaluation")
+            self._update_evaluation(result, evaluation_result_json_str)
+            if not self._is_error_output(evaluation_result_json_str):
+                records["evaluation"] = {"input_hash": evaluation_hash, "output": evaluation_result_json_str}
+            report("evaluation", "done", result)
         
         return result
 
+    def _stage_input_hash(self, stage_name: str, doc: Dict[str, Any]) -> str:
+        """Hash of everything a stage output depends on: the document, the prompt version and the stage's model."""
+        route = self.router.route(stage_name)
+        material = json.dumps({
+            "stage": stage_name,
+            "template_version": PROMPT_TEMPLATE_VERSION,
+            "model": route["model"],
+            "structured_output": self.structured_output,
+            "content": doc.get("content"),
+            "structured_data": doc.get("structured_data") or None,
+            # Left out for LLaMA2 markup, so outputs stored before other formats existed stay valid
+            **({"prompt_format": route["prompt_format"]} if route["prompt_format"] != "llama2" else {}),
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
     def _update_student_info(self, result: Dict[str, Any], passport_info_json_str: str) -> None:
-        parsed_info = self._parse_llm_json_output(passport_info_json_str, ["name", "gender", "date_of_birth", "nationality"])
+        parsed_info = self._parse_llm_json_output(passport_info_json_str, STAGE_FIELDS["passport"])
         if parsed_info.get("name"): result["student_info"]["name"] = parsed_info["name"]
         if parsed_info.get("gender"): result["student_info"]["gender"] = parsed_info["gender"]
         if parsed_info.get("date_of_birth"): 
@@ -308,7 +915,7 @@ class LLMProcessor:
         if parsed_info.get("nationality"): result["student_info"]["nationality"] = parsed_info["nationality"]
 
     def _update_cv_info(self, result: Dict[str, Any], cv_summary_json_str: str) -> None:
-        parsed_info = self._parse_llm_json_output(cv_summary_json_str, ["cv_summary"])
+        parsed_info = self._parse_llm_json_output(cv_summary_json_str, STAGE_FIELDS["cv"])
         summary_data = parsed_info.get("cv_summary")
         if summary_data:
             if isinstance(summary_data, dict):
@@ -322,7 +929,7 @@ class LLMProcessor:
             result["summaries"]["cv_summary"] = "" 
 
     def _update_education_info(self, result: Dict[str, Any], degree_info_json_str: str) -> None:
-        parsed_info = self._parse_llm_json_output(degree_info_json_str, ["university_name", "gpa"])
+        parsed_info = self._parse_llm_json_output(degree_info_json_str, STAGE_FIELDS["degree"])
         if parsed_info.get("university_name"): result["student_info"]["previous_university"] = parsed_info["university_name"]
         else: result["student_info"]["previous_university"] = "Unknown"
         if parsed_info.get("gpa") is not None:
@@ -334,8 +941,235 @@ class LLMProcessor:
                 result["student_info"]["gpa"] = 0.0
         else: result["student_info"]["gpa"] = 0.0
 
+    def _try_consolidated_extraction(self, result: Dict[str, Any], categorized_docs: Dict[str, List[Dict[str, Any]]],
+                                     stages: List[Tuple[str, str, Callable, str]], use_cache: bool = True) -> Optional[str]:
+        """
+        Extract all stages with a single generation when every document fits into the context window.
+        The combined output is handed to each stage's update function, exactly as the per-stage outputs would be.
+        Returns:
+            str: The combined output that was applied, or None if the caller should run the stages one by one
+        """
+        if self.consolidated_mode == "off" or len(stages) < 2:
+            return None
+
+        sections = []
+        for name, _, _, _ in stages:
+            text = categorized_docs[name][0]["content"]
+            if name == "degree" and (categorized_docs[name][0].get("structured_data") or {}).get("grades"):
+                text = text[:DEGREE_HEADER_CHARS]
+            sections.append(f"=== {name.replace('_', ' ').upper()} ===\n{text}")
+        documents_block = "\n\n".join(sections)
+
+        route = self.router.route("consolidated")
+        prompt_tokens = estimate_tokens(documents_block) + CONSOLIDATED_OVERHEAD_TOKENS
+        if prompt_tokens + route["num_predict"] > route["num_ctx"]:
+            logger.info(f"Consolidated extraction skipped: ~{prompt_tokens} prompt tokens do not fit num_ctx={route['num_ctx']}")
+            return None
+
+        student_fields = [f for name, _, _, schema_name in stages if name in STUDENT_INFO_STAGES for f in STAGE_FIELDS[schema_name]]
+        summary_fields = [f for name, _, _, schema_name in stages if name not in STUDENT_INFO_STAGES for f in STAGE_FIELDS[schema_name]]
+        field_lines = "\n".join(
+            [f'"student_info"."{f}" ({FIELD_DESCRIPTIONS[f]})' for f in student_fields] +
+            [f'"summaries"."{f}" ({FIELD_DESCRIPTIONS[f]})' for f in summary_fields]
+        )
+        gpa_rule = ""
+        if "gpa" in student_fields:
+            gpa_rule = """To calculate GPA: Count "Отлично" (5), "Хорошо" (4), "Удовлетворительно" (3). Ignore "зачтено". GPA is the average of these grades, 0.0 if there are none."""
+        prompt = f"""Extract information from all documents of the applicant below in a single response.
+        Return one JSON object with exactly two keys, "student_info" and "summaries", each an object with these fields:
+        {field_lines}
+        {gpa_rule}
+        Example: {{"student_info": {{"name": "John Doe", "nationality": "USA"}}, "summaries": {{"cv_summary": "Proficient in Python..."}}}}
+        Documents:
+        {documents_block}"""
+
+        logger.info(f"Using consolidated extraction for {len(stages)} stages (~{prompt_tokens} prompt tokens)")
+        schema = {
+            "type": "object",
+            "properties": {
+                "student_info": json_schema.build_object_schema(student_fields),
+                "summaries": json_schema.build_object_schema(summary_fields),
+            },
+            "required": ["student_info", "summaries"],
+        }
+        output = self._generate_structured(prompt, schema, use_cache=use_cache, stage="consolidated")
+        parsed = self._extract_json_object(output)
+        if not (isinstance(parsed, dict) and isinstance(parsed.get("student_info"), dict) and isinstance(parsed.get("summaries"), dict)):
+            logger.warning("Consolidated extraction returned no usable JSON object, falling back to per-document stages")
+            return None
+
+        merged = json.dumps({**parsed["summaries"], **parsed["student_info"]}, ensure_ascii=False)
+        for _, _, update, _ in stages:
+            update(result, merged)
+        return merged
+
+    def _extract_json_object(self, text: str) -> Optional[Any]:
+        """
+        Parse the first balanced top-level JSON object in the text, ignoring anything around it.
+        Unlike the lazy regex in _parse_llm_json_output this handles nested objects.
+        """
+        start = text.find("{")
+        while start != -1:
+            depth = 0
+            in_string = False
+            escaped = False
+            for i in range(start, len(text)):
+                ch = text[i]
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif ch == "\\":
+                        escaped = True
+                    elif ch == '"':
+                        in_string = False
+                elif ch == '"':
+                    in_string = True
+                elif ch == "{":
+                    depth += 1
+                elif ch == "}":
+                    depth -= 1
+                    if depth == 0:
+                        candidate = text[start:i + 1]
+                        try:
+                            return json.loads(candidate)
+                        except json.JSONDecodeError:
+                            try:
+                                return json.loads(re.sub(r",\s*([\}\]])", r"\1", candidate))
+                            except json.JSONDecodeError:
+                                break
+            start = text.find("{", start + 1)
+        return None
+
+    def _run_parallel(self, tasks: Dict[Any, Callable[[], str]],
+                      on_done: Optional[Callable[[Any, str], None]] = None) -> Dict[Any, str]:
+        """
+        Run independent LLM calls concurrently, at most max_parallel_stages at a time.
+        on_done(key, output) is called in the calling thread as each call finishes.
+        """
+        if not tasks:
+            return {}
+        workers = max(1, min(self.max_parallel_stages, len(tasks)))
+        outputs = {}
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-stage") as executor:
+            # Run in a copy of the caller's context so stage calls keep the request priority
+            futures = {executor.submit(contextvars.copy_context().run, task): key for key, task in tasks.items()}
+            try:
+                for future in as_completed(futures):
+                    key = futures[future]
+                    outputs[key] = future.result()
+                    if on_done:
+                        on_done(key, outputs[key])
+            except AnalysisCancelled:
+                # Calls that have not started are dropped; running ones stop at their next token
+                for future in futures:
+                    future.cancel()
+                raise
+        return {key: outputs[key] for key in tasks}
+
+    def _run_stages(self, stages: List[Tuple[str, str, Callable, str]], use_cache: bool = True,
+                    on_done: Optional[Callable[[str, str], None]] = None) -> Dict[str, str]:
+        """
+        Run independent stage prompts concurrently; on_done(name, output) is called as each stage finishes.
+        Returns:
+            dict: Raw LLM output per stage name
+        """
+        if not stages:
+            return {}
+        started = time.monotonic()
+        for name, prompt, _, _ in stages:
+            logger.info(f"Stage '{name}': ~{estimate_tokens(prompt)} prompt tokens")
+        outputs = self._run_parallel({
+            name: partial(self._generate_structured, prompt, self._stage_schema(schema_name), use_cache=use_cache, stage=name)
+            for name, prompt, _, schema_name in stages
+        }, on_done=on_done)
+        logger.info(f"Ran {len(stages)} extraction stages in {time.monotonic() - started:.1f}s")
+        return outputs
+
+    def _fit_documents_to_budget(self, categorized_docs: Dict[str, List[Dict[str, Any]]], use_cache: bool = True,
+                                 depth: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Map-reduce documents that do not fit into a stage prompt.
+        An oversized document is split on OCR page breaks into chunks, every chunk is condensed
+        into notes for the stage's fields in parallel (map), and the joined notes replace the
+        document text for the stage prompt (reduce). Returns a new dict; the input is not modified.
+        """
+        tasks = {}
+        for doc_type, docs in categorized_docs.items():
+            if doc_type not in STAGE_FIELDS or not docs or not docs[0].get("content"):
+                continue
+            route = self.router.route(doc_type)
+            budget = route["num_ctx"] - route["num_predict"] - STAGE_PROMPT_OVERHEAD_TOKENS
+            if budget < MIN_STAGE_DOCUMENT_TOKENS:
+                logger.warning(f"Route of stage '{doc_type}' leaves {budget} prompt tokens (num_ctx {route['num_ctx']}, "
+                               f"num_predict {route['num_predict']}), using {MIN_STAGE_DOCUMENT_TOKENS}")
+                budget = MIN_STAGE_DOCUMENT_TOKENS
+            if doc_type == "degree" and (docs[0].get("structured_data") or {}).get("grades"):
+                # Only the header is sent when the grade table was extracted by OCR
+                continue
+            tokens = estimate_tokens(docs[0]["content"])
+            if tokens <= budget:
+                continue
+            chunks = split_into_chunks(docs[0]["content"], min(LLM_CHUNK_TOKENS, budget))
+            logger.info(f"Document '{doc_type}' is ~{tokens} tokens (stage budget {budget}), summarizing {len(chunks)} chunks")
+            for index, chunk in enumerate(chunks):
+                prompt = self._create_chunk_notes_prompt(doc_type, chunk, index, len(chunks))
+                tasks[(doc_type, index)] = partial(
+                    self._generate_structured, prompt, json_schema.build_object_schema(["notes"]),
+                    use_cache=use_cache, stage=f"{doc_type}_chunk_notes"
+                )
+        if not tasks:
+            return categorized_docs
+
+        started = time.monotonic()
+        outputs = self._run_parallel(tasks)
+        fitted = dict(categorized_docs)
+        for doc_type in {doc_type for doc_type, _ in tasks}:
+            indexes = sorted(index for t, index in tasks if t == doc_type)
+            notes = []
+            for index in indexes:
+                chunk_notes = self._parse_llm_json_output(outputs[(doc_type, index)], ["notes"]).get("notes")
+                if chunk_notes:
+                    notes.append(f"[Part {index + 1}/{len(indexes)}] {chunk_notes if isinstance(chunk_notes, str) else json.dumps(chunk_notes, ensure_ascii=False)}")
+            reduced = "\n".join(notes)
+            original = categorized_docs[doc_type][0]
+            logger.info(f"Document '{doc_type}' reduced from ~{estimate_tokens(original['content'])} to ~{estimate_tokens(reduced)} tokens")
+            fitted[doc_type] = [{**original, "content": reduced}] + categorized_docs[doc_type][1:]
+        logger.info(f"Map step over {len(tasks)} chunks took {time.monotonic() - started:.1f}s")
+
+        if depth < 1:
+            # Notes of very long documents can still be over budget: reduce once more
+            return self._fit_documents_to_budget(fitted, use_cache=use_cache, depth=depth + 1)
+        return fitted
+
+    def _create_chunk_notes_prompt(self, doc_type: str, chunk: str, index: int, total: int) -> str:
+        field_list = ", ".join(f'"{f}" ({FIELD_DESCRIPTIONS[f]})' for f in STAGE_FIELDS[doc_type])
+        hint = CHUNK_NOTES_HINTS.get(doc_type, "Keep names, dates, numbers and results exactly as written.")
+        return f"""This is part {index + 1} of {total} of the applicant's {doc_type.replace('_', ' ')}.
+        Write concise notes with everything in this part that is needed for these fields: {field_list}.
+        {hint} Leave out anything irrelevant.
+        Field: "notes" (string).
+        Document part: {chunk}"""
+
+    def _education_updater_with_gpa(self, gpa: float) -> Callable:
+        """Update function for the degree stage when GPA was computed from the grade table."""
+        def update(result: Dict[str, Any], degree_info_json_str: str) -> None:
+            self._update_education_info(result, degree_info_json_str)
+            result["student_info"]["gpa"] = gpa
+        return update
+
+    def _compute_gpa_from_grades(self, grades: List[Dict[str, Any]]) -> Optional[float]:
+        """
+        Compute GPA from structured grade rows produced by the OCR service.
+        Same rule as the LLM prompt: mean of 3/4/5 grades, pass/fail ("зачтено") ignored.
+        Returns None when there are no numeric grades.
+        """
+        values = [row.get("grade_value") for row in grades if row.get("grade_value") in (3, 4, 5)]
+        if not values:
+            return None
+        return round(sum(values) / len(values), 2)
+
     def _update_motivation_info(self, result: Dict[str, Any], motivation_summary_json_str: str) -> None:
-        parsed_info = self._parse_llm_json_output(motivation_summary_json_str, ["motivation_letter_summary"])
+        parsed_info = self._parse_llm_json_output(motivation_summary_json_str, STAGE_FIELDS["motivation_letter"])
         summary_data = parsed_info.get("motivation_letter_summary")
         if summary_data:
             if isinstance(summary_data, dict):
@@ -349,7 +1183,7 @@ class LLMProcessor:
             result["summaries"]["motivation_letter_summary"] = ""
 
     def _update_recommendation_info(self, result: Dict[str, Any], recommendation_info_json_str: str) -> None:
-        parsed_info = self._parse_llm_json_output(recommendation_info_json_str, ["recommendation_letter_summary", "recommendation_author"])
+        parsed_info = self._parse_llm_json_output(recommendation_info_json_str, STAGE_FIELDS["recommendation_letter"])
         summary_data = parsed_info.get("recommendation_letter_summary")
         if summary_data:
             if isinstance(summary_data, dict):
@@ -364,7 +1198,7 @@ class LLMProcessor:
         if parsed_info.get("recommendation_author"): result["summaries"]["recommendation_author"] = parsed_info["recommendation_author"]
 
     def _update_language_info(self, result: Dict[str, Any], language_info_json_str: str) -> None:
-        parsed_info = self._parse_llm_json_output(language_info_json_str, ["russian_language_level"])
+        parsed_info = self._parse_llm_json_output(language_info_json_str, STAGE_FIELDS["language_certificate"])
         summary_data = parsed_info.get("russian_language_level")
         if summary_data:
             if isinstance(summary_data, dict):
@@ -378,7 +1212,7 @@ class LLMProcessor:
             result["student_info"]["russian_language_level"] = ""
 
     def _update_achievements_info(self, result: Dict[str, Any], achievements_info_json_str: str) -> None:
-        parsed_info = self._parse_llm_json_output(achievements_info_json_str, ["achievements_summary"])
+        parsed_info = self._parse_llm_json_output(achievements_info_json_str, STAGE_FIELDS["achievements"])
         summary_data = parsed_info.get("achievements_summary")
         if summary_data:
             if isinstance(summary_data, dict):
@@ -392,7 +1226,7 @@ class LLMProcessor:
             result["summaries"]["achievements_summary"] = ""
 
     def _update_additional_docs_info(self, result: Dict[str, Any], additional_info_json_str: str) -> None:
-        parsed_info = self._parse_llm_json_output(additional_info_json_str, ["additional_documents_summary"])
+        parsed_info = self._parse_llm_json_output(additional_info_json_str, STAGE_FIELDS["additional_documents"])
         summary_data = parsed_info.get("additional_documents_summary")
         if summary_data:
             if isinstance(summary_data, dict):
@@ -405,7 +1239,7 @@ class LLMProcessor:
         else:
             result["summaries"]["additional_documents_summary"] = ""
 
-    def _create_evaluation_prompt_instruction(self, current_result: Dict[str, Any], json_instruction: str) -> str:
+    def _create_evaluation_prompt_instruction(self, current_result: Dict[str, Any]) -> str:
         profile_summary = "Applicant Profile:\n"
         for key, value in current_result["student_info"].items(): 
             formatted_key = key.replace('_', ' ').title()
@@ -418,7 +1252,6 @@ class LLMProcessor:
 
         instruction = f"""Based on the applicant profile, provide an overall evaluation score (0-100) and brief comments in English.
         Consider all aspects: academics, skills, motivation, recommendations, language.
-        {json_instruction}
         Fields: "evaluation_score" (integer, 0-100), "evaluation_comments" (string, English).
         Example: {{"evaluation_score": 85, "evaluation_comments": "Strong candidate with good GPA and relevant skills."}}
         Profile:
@@ -427,7 +1260,7 @@ class LLMProcessor:
         return instruction
 
     def _update_evaluation(self, result: Dict[str, Any], evaluation_result_json_str: str) -> None:
-        parsed_info = self._parse_llm_json_output(evaluation_result_json_str, ["evaluation_score", "evaluation_comments"])
+        parsed_info = self._parse_llm_json_output(evaluation_result_json_str, STAGE_FIELDS["evaluation"])
         if parsed_info.get("evaluation_score") is not None:
             try:
                 result["evaluation"]["score"] = int(parsed_info["evaluation_score"])
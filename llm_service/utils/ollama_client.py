@@ -0,0 +1,572 @@
+"""
+HTTP client for one or more Ollama backends with a pooled keep-alive session, a background
+health probe, least-outstanding routing, circuit breaking, retries and optional hedging.
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from llm_service.utils.slot_scheduler import SlotScheduler
+from llm_service.utils.cancellation import check_cancelled, current_cancel_token
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = "closed"
+CIRCUIT_OPEN = "open"
+CIRCUIT_HALF_OPEN = "half_open"
+
+# Loading a model into memory can take minutes on a cold disk
+WARMUP_TIMEOUT = 600
+
+
+def keep_alive_seconds(keep_alive: Union[str, int, float, None]) -> Optional[float]:
+    """
+    Seconds Ollama keeps a model loaded for a keep_alive value ("30m", "1h30m", "300", 300),
+    None if it stays loaded indefinitely (negative values). Unset means Ollama's default of 5 minutes.
+    """
+    if keep_alive is None or keep_alive == "":
+        return 300.0
+    if isinstance(keep_alive, (int, float)) or re.fullmatch(r"-?\d+(\.\d+)?", str(keep_alive).strip()):
+        seconds = float(keep_alive)
+        return None if seconds < 0 else seconds
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"(-?\d+(?:\.\d+)?)(ms|h|m|s)", str(keep_alive))
+    if not parts:
+        return 300.0
+    seconds = sum(float(value) * units[unit] for value, unit in parts)
+    return None if seconds < 0 else seconds
+
+
+class GenerateResult:
+    """Outcome of a non-streamed generation: the final Ollama body on status 200, the error text otherwise."""
+
+    def __init__(self, status_code: int, body: Optional[Dict[str, Any]] = None, error_text: str = ""):
+        self.status_code = status_code
+        self.body = body or {}
+        self.error_text = error_text
+
+
+class _Backend:
+    """State of one Ollama server: health, circuit breaker and load counters. Guarded by the client's lock."""
+
+    def __init__(self, api_base: str):
+        self.api_base = api_base.rstrip("/")
+        self.healthy = False
+        self.available_models: List[str] = []
+        self.last_health_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+        self.circuit = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.latency_ms_total = 0.0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+        # Models loaded in memory according to /api/ps (None: the server does not report it)
+        self.resident_models: Optional[List[str]] = None
+        self.last_activity: Optional[float] = None  # monotonic time of the last generation or warm-up
+        self.warming = False
+        self.warmups = 0
+        self.last_warmup_ms: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "api_base": self.api_base,
+            "healthy": self.healthy,
+            "circuit": self.circuit,
+            "consecutive_failures": self.consecutive_failures,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.requests, 4) if self.requests else None,
+            "avg_response_ms": round(self.latency_ms_total / (self.requests - self.errors), 1) if self.requests > self.errors else None,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "resident_models": self.resident_models,
+            "warmups": self.warmups,
+            "last_warmup_ms": self.last_warmup_ms,
+            "last_error": self.last_error,
+        }
+
+
+class OllamaClient:
+    """
+    Process-wide Ollama client.
+    All calls share one requests.Session, so TCP connections to Ollama are kept
+    alive and reused instead of being opened for every generation. A SlotScheduler
+    limits generate calls in flight to the parallel slots of the available backends
+    and decides which waiting call gets the next free slot.
+
+    Each generation goes to the backend with the fewest outstanding requests. A backend
+    whose requests fail failure_threshold times in a row (connection errors, timeouts,
+    HTTP 5xx) is taken out of rotation for circuit_cooldown seconds and then gets a single
+    trial request. Generations are idempotent, so a failed one is retried on another backend
+    with exponential backoff. With hedge_after > 0 a streamed generation whose response has not
+    started after that many seconds is also sent to another backend with a free slot, and
+    whichever answers first is used. Non-streamed generations are never hedged: their response
+    only starts once the whole generation is done, so the loser could not be stopped early.
+
+    Models passed to warm_up() are preloaded on every backend with keep_alive and loaded again
+    when the health probe finds that a backend restarted, or evicted a model it should still hold.
+    """
+
+    def __init__(self, api_base: Union[str, Sequence[str]], model: str, num_parallel: int, pool_size: int, health_interval: float,
+                 max_retries: int = 2, retry_backoff: float = 0.5, failure_threshold: int = 3,
+                 circuit_cooldown: float = 30.0, hedge_after: float = 0.0, keep_alive: Union[str, int, None] = None):
+        """
+        Args:
+            api_base: Base URL of the Ollama server, a list of them or a comma-separated string
+        """
+        bases = api_base.split(",") if isinstance(api_base, str) else list(api_base)
+        self.backends = [_Backend(base.strip()) for base in bases if base.strip()]
+        if not self.backends:
+            raise ValueError("No Ollama backend configured")
+        self.api_base = self.backends[0].api_base
+        self.model = model
+        self.num_parallel = num_parallel
+        self.health_interval = health_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.failure_threshold = failure_threshold
+        self.circuit_cooldown = circuit_cooldown
+        self.hedge_after = hedge_after
+        self.keep_alive = keep_alive
+        self.keep_alive_seconds = keep_alive_seconds(keep_alive)
+        self.warm_models: List[str] = []
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.backends), pool_maxsize=max(pool_size, num_parallel), max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.scheduler = SlotScheduler(num_parallel * len(self.backends))
+        self._lock = threading.Lock()
+        # A primary and its hedge for every scheduler slot (at most num_parallel per backend), so requests never queue in the pool
+        # (queued time would count towards hedge_after and cap concurrency below the slots)
+        self._hedge_pool = ThreadPoolExecutor(max_workers=2 * num_parallel * len(self.backends), thread_name_prefix="ollama-hedge") if hedge_after > 0 else None
+        self.counters = {"retries": 0, "exhausted": 0, "hedges": 0, "hedge_wins": 0}
+
+        self.last_health_check: Optional[float] = None
+
+        self._stop_event = threading.Event()
+        self._probe_thread: Optional[threading.Thread] = None
+
+    @property
+    def healthy(self) -> bool:
+        return any(backend.healthy for backend in self.backends)
+
+    @property
+    def available_models(self) -> List[str]:
+        return sorted({model for backend in self.backends if backend.healthy for model in backend.available_models})
+
+    @property
+    def last_error(self) -> Optional[str]:
+        errors = [f"{backend.api_base}: {backend.last_error}" for backend in self.backends if backend.last_error]
+        return "; ".join(errors) or None
+
+    def _check_backend(self, backend: _Backend) -> bool:
+        recovering = not backend.healthy and backend.last_health_check is not None
+        try:
+            response = self.session.get(f"{backend.api_base}/api/tags", timeout=5)
+            if response.status_code != 200:
+                raise Exception(f"Ollama returned status code {response.status_code}")
+            models = response.json().get("models", [])
+            backend.available_models = [model.get("name") for model in models]
+            backend.resident_models = self._resident_models(backend)
+            if recovering:
+                logger.info(f"Ollama at {backend.api_base} is reachable again. Models: {backend.available_models}")
+            backend.healthy = True
+            backend.last_error = None
+        except Exception as e:
+            if backend.healthy:
+                logger.warning(f"Ollama at {backend.api_base} became unreachable: {str(e)}")
+            backend.healthy = False
+            backend.last_error = str(e)
+        backend.last_health_check = time.time()
+        with self._lock:
+            if backend.healthy and backend.circuit == CIRCUIT_OPEN:
+                # Let the next generation try it instead of waiting out the cooldown
+                backend.circuit = CIRCUIT_HALF_OPEN
+            elif not backend.healthy and backend.circuit != CIRCUIT_OPEN:
+                self._open_circuit(backend)
+            self._update_capacity()
+        if backend.healthy:
+            self._rewarm_if_needed(backend, recovering)
+        return backend.healthy
+
+    def _resident_models(self, backend: _Backend) -> Optional[List[str]]:
+        """Models currently loaded by a backend (GET /api/ps), None if it can't tell."""
+        try:
+            response = self.session.get(f"{backend.api_base}/api/ps", timeout=5)
+            if response.status_code != 200:
+                return None
+            return [model.get("name") for model in response.json().get("models", [])]
+        except Exception:
+            return None
+
+    def _rewarm_if_needed(self, backend: _Backend, recovered: bool) -> None:
+        """
+        Load the warm models again on a backend that came back (it probably restarted), or that
+        dropped a model before its keep_alive expired (restart between probes, or eviction).
+        """
+        if not self.warm_models or backend.warming:
+            return
+        if recovered:
+            reason = "backend is reachable again"
+        elif backend.resident_models is not None:
+            missing = [model for model in self.warm_models if model not in backend.resident_models]
+            expected = backend.last_activity is not None and (
+                self.keep_alive_seconds is None or time.monotonic() - backend.last_activity < self.keep_alive_seconds
+            )
+            if not (missing and expected):
+                return
+            reason = f"{', '.join(missing)} no longer loaded"
+        else:
+            return
+        logger.info(f"Warming up {backend.api_base} again: {reason}")
+        self._start_warmup(backend)
+
+    def _start_warmup(self, backend: _Backend) -> None:
+        backend.warming = True
+        threading.Thread(target=self._warm_backend, args=(backend,), name="ollama-warmup", daemon=True).start()
+
+    def _warm_backend(self, backend: _Backend) -> None:
+        """Load every warm model on one backend: a generate request without prompt only loads the model."""
+        try:
+            for model in self.warm_models:
+                started = time.monotonic()
+                payload = {"model": model}
+                if self.keep_alive is not None:
+                    payload["keep_alive"] = self.keep_alive
+                try:
+                    response = self.session.post(f"{backend.api_base}/api/generate", json=payload, timeout=WARMUP_TIMEOUT)
+                    if response.status_code != 200:
+                        raise Exception(f"Ollama returned status code {response.status_code}")
+                except Exception as e:
+                    logger.warning(f"Warm-up of {model} on {backend.api_base} failed: {str(e)}")
+                    continue
+                elapsed_ms = (time.monotonic() - started) * 1000
+                with self._lock:
+                    backend.warmups += 1
+                    backend.last_warmup_ms = round(elapsed_ms, 1)
+                    backend.last_activity = time.monotonic()
+                logger.info(f"{model} is loaded on {backend.api_base} (warm-up took {elapsed_ms:.0f} ms)")
+            backend.resident_models = self._resident_models(backend)
+        finally:
+            backend.warming = False
+
+    def warm_up(self, models: List[str], wait: bool = False) -> None:
+        """
+        Preload models on every reachable backend and keep them loaded from now on; unreachable
+        backends are warmed when the health probe sees them come back. Runs in the background
+        unless wait is True.
+        """
+        self.warm_models = list(models)
+        threads = []
+        for backend in self.backends:
+            if backend.healthy and not backend.warming:
+                self._start_warmup(backend)
+                threads.append(backend)
+        if wait:
+            while any(backend.warming for backend in threads):
+                time.sleep(0.1)
+
+    def models_resident(self) -> Optional[bool]:
+        """
+        True if every warm model (or the default model) is loaded on at least one healthy backend,
+        None if no backend reports its loaded models.
+        """
+        models = self.warm_models or [self.model]
+        reporting = [b for b in self.backends if b.healthy and b.resident_models is not None]
+        if not reporting:
+            return None
+        return all(any(model in b.resident_models for b in reporting) for model in models)
+
+    def check_health(self) -> bool:
+        """
+        Query /api/tags of every backend and refresh their health state.
+        Returns:
+            bool: True if at least one backend answered
+        """
+        for backend in self.backends:
+            self._check_backend(backend)
+        self.last_health_check = time.time()
+        return self.healthy
+
+    def start_health_probe(self) -> None:
+        """Start the background health probe (idempotent)."""
+        if self._probe_thread and self._probe_thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._probe_thread = threading.Thread(target=self._probe_loop, name="ollama-health-probe", daemon=True)
+        self._probe_thread.start()
+
+    def stop(self) -> None:
+        """Stop the health probe and close pooled connections."""
+        self._stop_event.set()
+        if self._hedge_pool:
+            self._hedge_pool.shutdown(wait=False)
+        self.session.close()
+
+    def _probe_loop(self) -> None:
+        while not self._stop_event.wait(self.health_interval):
+            self.check_health()
+
+    # Circuit breaker and routing; the methods below that start with _ expect self._lock to be held
+
+    def _open_circuit(self, backend: _Backend) -> None:
+        backend.circuit = CIRCUIT_OPEN
+        backend.opened_at = time.monotonic()
+        backend.trial_in_flight = False
+        logger.warning(f"Ollama backend {backend.api_base} taken out of rotation for {self.circuit_cooldown:g}s "
+                       f"after {backend.consecutive_failures} failures")
+
+    def _update_capacity(self) -> None:
+        """Size the slot scheduler to the backends in rotation, so queued calls wait here by priority rather than at a dead server."""
+        in_rotation = sum(1 for backend in self.backends if backend.circuit != CIRCUIT_OPEN)
+        self.scheduler.resize(self.num_parallel * max(1, in_rotation))
+
+    def _selectable(self, backend: _Backend, now: float) -> bool:
+        if backend.circuit == CIRCUIT_OPEN and now - backend.opened_at >= self.circuit_cooldown:
+            backend.circuit = CIRCUIT_HALF_OPEN
+        if backend.circuit == CIRCUIT_HALF_OPEN:
+            return not backend.trial_in_flight
+        return backend.circuit == CIRCUIT_CLOSED
+
+    def _pick(self, exclude: Set[_Backend], spare_only: bool = False) -> Optional[_Backend]:
+        """
+        Reserve the backend with the fewest outstanding requests, preferring ones not in exclude.
+        With spare_only, only a backend with a free slot qualifies (used for hedges).
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends if self._selectable(b, now)]
+            if spare_only:
+                candidates = [b for b in candidates if b not in exclude and b.outstanding < self.num_parallel]
+            else:
+                candidates = [b for b in candidates if b not in exclude] or candidates
+            if not candidates:
+                return None
+            backend = min(candidates, key=lambda b: (b.outstanding, random.random()))
+            backend.outstanding += 1
+            if backend.circuit == CIRCUIT_HALF_OPEN:
+                backend.trial_in_flight = True
+            return backend
+
+    def _release(self, backend: _Backend) -> None:
+        with self._lock:
+            backend.outstanding -= 1
+
+    def _record(self, backend: _Backend, ok: bool, latency_ms: float, error: Optional[str] = None) -> None:
+        with self._lock:
+            backend.requests += 1
+            backend.trial_in_flight = False
+            if ok:
+                backend.latency_ms_total += latency_ms
+                backend.last_activity = time.monotonic()
+                backend.consecutive_failures = 0
+                if backend.circuit != CIRCUIT_CLOSED:
+                    logger.info(f"Ollama backend {backend.api_base} is back in rotation")
+                    backend.circuit = CIRCUIT_CLOSED
+                    self._update_capacity()
+                return
+            backend.errors += 1
+            backend.consecutive_failures += 1
+            backend.last_error = error
+            if backend.circuit == CIRCUIT_HALF_OPEN or (backend.circuit == CIRCUIT_CLOSED and backend.consecutive_failures >= self.failure_threshold):
+                self._open_circuit(backend)
+                self._update_capacity()
+
+    def _post_once(self, backend: _Backend, payload: Dict[str, Any], timeout: float, stream: bool) -> requests.Response:
+        """One POST /api/generate to a reserved backend; the outcome feeds its circuit breaker."""
+        started = time.monotonic()
+        try:
+            response = self.session.post(f"{backend.api_base}/api/generate", json=payload, timeout=timeout, stream=stream)
+        except requests.exceptions.RequestException as e:
+            self._record(backend, False, 0.0, str(e))
+            raise
+        ok = response.status_code < 500
+        self._record(backend, ok, (time.monotonic() - started) * 1000, None if ok else f"HTTP {response.status_code}")
+        return response
+
+    def _discard(self, backend: _Backend, future) -> None:
+        """Close the response of a losing hedge as soon as it arrives, which makes its server stop generating."""
+        def close(done):
+            try:
+                done.result().close()
+            except Exception:
+                pass
+            finally:
+                self._release(backend)
+        future.add_done_callback(close)
+
+    def _post_hedged(self, backend: _Backend, payload: Dict[str, Any], timeout: float, stream: bool,
+                     tried: Set[_Backend]) -> Tuple[_Backend, requests.Response]:
+        """
+        POST to backend; if the response has not started after hedge_after seconds, race it against
+        the same request on another backend with a free slot. The loser is closed and released.
+        Only streamed requests are hedged (see the class docstring).
+        Returns:
+            tuple: The backend that answered (still reserved) and its response
+        """
+        if not self._hedge_pool or not stream:
+            return backend, self._post_once(backend, payload, timeout, stream)
+        primary = self._hedge_pool.submit(self._post_once, backend, payload, timeout, stream)
+        try:
+            return backend, primary.result(timeout=self.hedge_after)
+        except FutureTimeoutError:
+            pass
+        hedge_backend = self._pick(tried | {backend}, spare_only=True)
+        if hedge_backend is None:
+            return backend, primary.result()
+        with self._lock:
+            hedge_backend.hedges += 1
+            self.counters["hedges"] += 1
+        logger.info(f"No response from {backend.api_base} after {self.hedge_after}s, hedging on {hedge_backend.api_base}")
+        hedge = self._hedge_pool.submit(self._post_once, hedge_backend, payload, timeout, stream)
+        racers = {primary: backend, hedge: hedge_backend}
+        pending = set(racers)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result().status_code < 500:
+                    winner = racers[future]
+                    for other, other_backend in racers.items():
+                        if other is not future:
+                            self._discard(other_backend, other)
+                    if winner is hedge_backend:
+                        with self._lock:
+                            hedge_backend.hedge_wins += 1
+                            self.counters["hedge_wins"] += 1
+                    return winner, future.result()
+        # Both failed: report the primary's outcome, the hedge backend is done
+        self._release(hedge_backend)
+        if hedge.exception() is None:
+            hedge.result().close()
+        return backend, primary.result()
+
+    def _send(self, payload: Dict[str, Any], timeout: float, stream: bool) -> Tuple[_Backend, requests.Response]:
+        """
+        Send a generation, retrying failed attempts on other backends with exponential backoff.
+        The returned backend stays reserved until the caller releases it.
+        Raises:
+            requests.exceptions.RequestException: If every attempt failed to connect
+            AnalysisCancelled: If the analysis was cancelled while waiting for the slot or between attempts
+        """
+        tried: Set[_Backend] = set()
+        last_error: Optional[Exception] = None
+        for attempt in range(self.max_retries + 1):
+            check_cancelled()
+            if attempt:
+                with self._lock:
+                    self.counters["retries"] += 1
+                time.sleep(self.retry_backoff * (2 ** (attempt - 1)) * (1 + random.random() * 0.25))
+            backend = self._pick(tried)
+            if backend is None:
+                break
+            tried.add(backend)
+            try:
+                backend, response = self._post_hedged(backend, payload, timeout, stream, tried)
+            except requests.exceptions.RequestException as e:
+                self._release(backend)
+                last_error = e
+                logger.warning(f"Generation on {backend.api_base} failed (attempt {attempt + 1}): {str(e)}")
+                continue
+            if response.status_code >= 500 and attempt < self.max_retries:
+                logger.warning(f"Generation on {backend.api_base} returned {response.status_code} (attempt {attempt + 1})")
+                response.close()
+                self._release(backend)
+                continue
+            return backend, response
+        with self._lock:
+            self.counters["exhausted"] += 1
+        raise last_error or requests.exceptions.ConnectionError("No Ollama backend is available")
+
+    def generate(self, payload: Dict[str, Any], timeout: float, key: Optional[str] = None) -> GenerateResult:
+        """
+        POST /api/generate over the pooled session, waiting for a free server slot, and return the whole generation.
+        key identifies the prompt's instructions so that similar prompts can be scheduled back to back.
+        Inside a cancellable analysis the generation is streamed and assembled here, so cancelling it
+        closes the connection and stops Ollama.
+        """
+        if current_cancel_token.get() is not None:
+            return self._generate_interruptible(payload, timeout, key)
+        with self.scheduler.slot(key=key):
+            backend, response = self._send(payload, timeout, stream=False)
+            self._release(backend)
+        if response.status_code != 200:
+            return GenerateResult(response.status_code, error_text=response.text)
+        return GenerateResult(response.status_code, response.json())
+
+    def _generate_interruptible(self, payload: Dict[str, Any], timeout: float, key: Optional[str]) -> GenerateResult:
+        """
+        Raises:
+            AnalysisCancelled: If the analysis is cancelled before or during the generation
+        """
+        parts = []
+        final: Dict[str, Any] = {}
+        with self.generate_stream({**payload, "stream": True}, timeout, key=key) as response:
+            if response.status_code != 200:
+                return GenerateResult(response.status_code, error_text=response.text)
+            for line in response.iter_lines():
+                check_cancelled()
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                parts.append(chunk.get("response", ""))
+                if chunk.get("done"):
+                    final = chunk
+                    break
+        return GenerateResult(200, {**final, "response": "".join(parts)})
+
+    @contextmanager
+    def generate_stream(self, payload: Dict[str, Any], timeout: float, key: Optional[str] = None) -> Iterator[requests.Response]:
+        """
+        POST /api/generate with a streamed response body. The server slot is held until the
+        context exits; the response is closed on exit, which drops the connection and makes
+        Ollama stop generating if the stream was abandoned early.
+        Only failures before the stream starts are retried on another backend.
+        """
+        with self.scheduler.slot(key=key):
+            backend, response = self._send(payload, timeout, stream=True)
+            try:
+                yield response
+            finally:
+                response.close()
+                self._release(backend)
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-backend load, error rates and circuit state, plus retry and hedge counters."""
+        with self._lock:
+            return {**self.counters, "backends": [backend.to_dict() for backend in self.backends]}
+
+    def status(self) -> Dict[str, Any]:
+        """Health state for the service health endpoint."""
+        return {
+            "api_base": self.api_base,
+            "healthy": self.healthy,
+            "model_available": self.model in self.available_models,
+            "last_health_check": self.last_health_check,
+            "last_error": self.last_error,
+            "model_resident": self.models_resident(),
+            "keep_alive": self.keep_alive,
+            "backends": [
+                {"api_base": b.api_base, "healthy": b.healthy, "circuit": b.circuit, "model_available": self.model in b.available_models,
+                 "resident_models": b.resident_models, "warming": b.warming}
+                for b in self.backends
+            ],
+        }
@@ -0,0 +1,80 @@
+"""
+Adaptive num_predict per stage, learned from the output lengths of earlier generations.
+"""
+import math
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+
+class OutputBudget:
+    """
+    Keeps the recent output token counts of every stage and sizes the stage's num_predict to
+    a high percentile of them plus a margin, never above the configured budget (the ceiling).
+    Until a stage has min_samples outputs it gets the ceiling. Truncated outputs are not
+    length samples (their real length is unknown) but are counted, as are the retries they cause.
+    """
+
+    def __init__(self, percentile: float = 0.99, margin: float = 0.2, min_samples: int = 20,
+                 window: int = 500, floor: int = 32, margin_tokens: int = 16):
+        self.percentile = percentile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.floor = floor
+        self.margin_tokens = margin_tokens
+        self._window = window
+        self._lock = threading.Lock()
+        self._lengths: Dict[str, deque] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _stage_stats(self, stage: str) -> Dict[str, int]:
+        if stage not in self._stats:
+            self._stats[stage] = {"generations": 0, "budgeted_tokens": 0, "ceiling_tokens": 0,
+                                  "truncations": 0, "truncation_retries": 0}
+        return self._stats[stage]
+
+    def _percentile(self, lengths: deque) -> int:
+        ordered = sorted(lengths)
+        return ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))]
+
+    def budget(self, stage: str, ceiling: int) -> int:
+        """num_predict for the next generation of a stage."""
+        with self._lock:
+            lengths = self._lengths.get(stage)
+            if not lengths or len(lengths) < self.min_samples:
+                return ceiling
+            learned = math.ceil(self._percentile(lengths) * (1 + self.margin)) + self.margin_tokens
+        return max(self.floor, min(ceiling, learned))
+
+    def observe(self, stage: str, output_tokens: Optional[int], requested: int, ceiling: int, truncated: bool) -> None:
+        """Record a finished generation: its output length, the num_predict it got and the ceiling it could have had."""
+        with self._lock:
+            stats = self._stage_stats(stage)
+            stats["generations"] += 1
+            stats["budgeted_tokens"] += requested
+            stats["ceiling_tokens"] += ceiling
+            if truncated:
+                stats["truncations"] += 1
+            elif output_tokens:
+                self._lengths.setdefault(stage, deque(maxlen=self._window)).append(output_tokens)
+
+    def observe_retry(self, stage: str) -> None:
+        with self._lock:
+            self._stage_stats(stage)["truncation_retries"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Per stage: learned length percentiles, the budget tokens saved against the ceiling and the truncation rates."""
+        with self._lock:
+            report = {}
+            for stage, stats in sorted(self._stats.items()):
+                lengths = self._lengths.get(stage) or deque()
+                entry = dict(stats)
+                entry["samples"] = len(lengths)
+                entry["adapted"] = len(lengths) >= self.min_samples
+                entry["p50_output_tokens"] = sorted(lengths)[len(lengths) // 2] if lengths else None
+                entry["high_percentile_output_tokens"] = self._percentile(lengths) if lengths else None
+                entry["saved_tokens"] = stats["ceiling_tokens"] - stats["budgeted_tokens"]
+                entry["truncation_rate"] = round(stats["truncations"] / stats["generations"], 4) if stats["generations"] else None
+                entry["retry_rate"] = round(stats["truncation_retries"] / stats["generations"], 4) if stats["generations"] else None
+                report[stage] = entry
+            return report
@@ -0,0 +1,172 @@
+"""
+Persistent prompt/response cache for Ollama generations.
+Two tiers: an in-memory LRU and a directory of JSON files on disk,
+both with TTL expiry; the disk tier is bounded by total size.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(model: str, options: Dict[str, Any], template_version: str, prompt: str) -> str:
+    """Hash of everything that determines a generation."""
+    material = json.dumps(
+        {"model": model, "options": options, "template_version": template_version, "prompt": prompt},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier (memory + disk) cache of raw LLM outputs keyed by make_cache_key()."""
+
+    def __init__(self, cache_dir: Optional[str], memory_entries: int, disk_max_bytes: int, ttl: float):
+        """
+        Args:
+            cache_dir: Directory of the disk tier, None to keep the cache in memory only
+            memory_entries: Maximum number of entries in the memory tier
+            disk_max_bytes: Maximum total size of the disk tier
+            ttl: Seconds after which an entry is considered stale
+        """
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.disk_max_bytes = disk_max_bytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (created_at, response)
+        self._disk_index: "OrderedDict[str, int]" = OrderedDict()  # key -> file size, oldest first
+        self._disk_bytes = 0
+        self.stats_counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "bypassed": 0, "evictions": 0}
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _load_disk_index(self) -> None:
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, name))
+                except OSError:
+                    continue
+                files.append((st.st_mtime, name[:-5], st.st_size))
+        for _, key, size in sorted(files):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response, or None on a miss or an expired entry."""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.stats_counters["memory_hits"] += 1
+                return entry[1]
+            if entry:
+                del self._memory[key]
+            on_disk = key in self._disk_index
+
+        if on_disk:
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if now - data["created_at"] <= self.ttl:
+                    os.utime(self._path(key))
+                    with self._lock:
+                        self._disk_index.move_to_end(key)
+                        self._remember(key, data["created_at"], data["response"])
+                        self.stats_counters["disk_hits"] += 1
+                    return data["response"]
+                self._remove_disk(key)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Dropping unreadable cache entry {key}: {e}")
+                self._remove_disk(key)
+
+        with self._lock:
+            self.stats_counters["misses"] += 1
+        return None
+
+    def put(self, key: str, response: str) -> None:
+        """Store a response in both tiers."""
+        created_at = time.time()
+        with self._lock:
+            self._remember(key, created_at, response)
+            self.stats_counters["stores"] += 1
+        if not self.cache_dir:
+            return
+
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"created_at": created_at, "response": response}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {key}: {e}")
+            return
+
+        evicted = []
+        with self._lock:
+            self._disk_bytes -= self._disk_index.pop(key, 0)
+            self._disk_index[key] = size
+            self._disk_bytes += size
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk_index) > 1:
+                old_key, old_size = self._disk_index.popitem(last=False)
+                self._disk_bytes -= old_size
+                evicted.append(old_key)
+                self.stats_counters["evictions"] += 1
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def record_bypass(self) -> None:
+        with self._lock:
+            self.stats_counters["bypassed"] += 1
+
+    def _remember(self, key: str, created_at: float, response: str) -> None:
+        """Insert into the memory tier; caller holds the lock."""
+        self._memory[key] = (created_at, response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.stats_counters["evictions"] += 1
+
+    def _remove_disk(self, key: str) -> None:
+        with self._lock:
+            self._disk_bytes -= self._disk_index.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and tier sizes."""
+        with self._lock:
+            counters = dict(self.stats_counters)
+            lookups = counters["memory_hits"] + counters["disk_hits"] + counters["misses"]
+            counters.update({
+                "hit_rate": round((counters["memory_hits"] + counters["disk_hits"]) / lookups, 3) if lookups else None,
+                "memory_entries": len(self._memory),
+                "disk_entries": len(self._disk_index),
+                "disk_bytes": self._disk_bytes,
+            })
+            return counters
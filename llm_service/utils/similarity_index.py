@@ -0,0 +1,312 @@
+"""
+Near-duplicate detection between applicants' documents (copied or templated motivation letters, CVs).
+
+Every document is embedded as a signed feature-hashed vector of its 3-word shingles, L2-normalized,
+so the cosine similarity of two documents approximates the share of phrases they have in common.
+Vectors are kept per document type in a float16 matrix (dim * 2 bytes per document) and searched
+with one vectorized cosine pass per query, using simsimd when it is installed and numpy otherwise.
+"""
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_WORDS = 3
+# Documents with fewer shingles than this are not indexed: short texts match each other by chance
+MIN_SHINGLES = 20
+# Rows converted to float32 at once by the numpy search
+_SEARCH_CHUNK = 16384
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def embed_text(text: str, dim: int) -> Optional[np.ndarray]:
+    """
+    Unit-length float32 vector of the text's distinct 3-word shingles, None if the text is too short.
+    Each shingle adds +1 or -1 (from its hash) to one of dim buckets, so collisions cancel out on average.
+    """
+    words = re.findall(r"\w+", text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    vector = np.zeros(dim, dtype=np.float32)
+    for shingle in shingles:
+        h = zlib.crc32(shingle.encode("utf-8"))
+        vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = float(np.linalg.norm(vector))
+    if norm == 0.0:
+        return None
+    return vector / norm
+
+
+class _TypeIndex:
+    """Vectors of one document type with their document and application ids; rows grow by doubling."""
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.vectors = np.zeros((capacity, dim), dtype=np.float16)
+        self.document_ids = np.zeros(capacity, dtype=np.int64)
+        self.application_ids = np.zeros(capacity, dtype=np.int64)
+        self.digests: List[str] = []
+        self.row_of: Dict[int, int] = {}
+        self.size = 0
+
+    def _grow(self) -> None:
+        capacity = max(1024, len(self.document_ids) * 2)
+        for name in ("vectors", "document_ids", "application_ids"):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def upsert(self, document_id: int, application_id: int, vector: np.ndarray, digest: str) -> None:
+        row = self.row_of.get(document_id)
+        if row is None:
+            if self.size == len(self.document_ids):
+                self._grow()
+            row = self.size
+            self.size += 1
+            self.row_of[document_id] = row
+            self.digests.append(digest)
+        else:
+            self.digests[row] = digest
+        self.vectors[row] = vector
+        self.document_ids[row] = document_id
+        self.application_ids[row] = application_id
+
+    def remove(self, document_id: int) -> None:
+        """Delete a row by moving the last row into its place."""
+        row = self.row_of.pop(document_id)
+        last = self.size - 1
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.document_ids[row] = self.document_ids[last]
+            self.application_ids[row] = self.application_ids[last]
+            self.digests[row] = self.digests[last]
+            self.row_of[int(self.document_ids[row])] = row
+        self.digests.pop()
+        self.size = last
+
+    def similarities(self, query: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query to every row."""
+        if self.size == 0:
+            return np.zeros(0, dtype=np.float32)
+        if simsimd is not None:
+            distances = simsimd.cdist(query.astype(np.float16)[None, :], self.vectors[:self.size], metric="cosine")
+            return 1.0 - np.asarray(distances, dtype=np.float32).reshape(-1)
+        scores = np.empty(self.size, dtype=np.float32)
+        for start in range(0, self.size, _SEARCH_CHUNK):
+            end = min(self.size, start + _SEARCH_CHUNK)
+            scores[start:end] = self.vectors[start:end].astype(np.float32) @ query
+        return scores
+
+
+class SimilarityIndex:
+    """
+    In-memory index of document vectors per document type, updated one document at a time
+    (a changed text replaces the document's vector) and optionally saved to an .npz file.
+    """
+
+    def __init__(self, dim: int, document_types: Iterable[str], path: Optional[str] = None,
+                 save_interval: float = 60.0):
+        """
+        Args:
+            dim: Number of hash buckets of the vectors
+            document_types: Document types that are indexed, e.g. motivation_letter and cv
+            path: .npz file the index is loaded from and saved to, None to keep it in memory only
+            save_interval: Minimum seconds between two saves triggered by maybe_save()
+        """
+        self.dim = dim
+        self.document_types = list(document_types)
+        self.path = path
+        self.save_interval = save_interval
+        self._lock = threading.RLock()
+        self._indexes = {document_type: _TypeIndex(dim) for document_type in self.document_types}
+        self._type_of: Dict[int, str] = {}
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self.stats_counters = {"embedded": 0, "unchanged": 0, "too_short": 0, "removed": 0, "searches": 0, "search_ms": 0.0}
+        if path and os.path.exists(path):
+            self._load()
+
+    def add(self, document_id: int, application_id: int, document_type: str, text: Optional[str]) -> bool:
+        """
+        Index (or re-index) a document. Returns whether it is in the index afterwards: documents of
+        other types, and texts too short to compare, are not (an earlier version is removed).
+        """
+        if document_type not in self._indexes or not text:
+            self.remove(document_id)
+            return False
+        digest = text_digest(text)
+        with self._lock:
+            index = self._indexes[document_type]
+            row = index.row_of.get(document_id)
+            if row is not None and index.digests[row] == digest and index.application_ids[row] == application_id:
+                self.stats_counters["unchanged"] += 1
+                return True
+        vector = embed_text(text, self.dim)
+        with self._lock:
+            if vector is None:
+                self.stats_counters["too_short"] += 1
+                self._remove_locked(document_id)
+                return False
+            if self._type_of.get(document_id, document_type) != document_type:
+                self._remove_locked(document_id)
+            index.upsert(document_id, application_id, vector, digest)
+            self._type_of[document_id] = document_type
+            self.stats_counters["embedded"] += 1
+            self._dirty = True
+        return True
+
+    def remove(self, document_id: int) -> None:
+        with self._lock:
+            self._remove_locked(document_id)
+
+    def _remove_locked(self, document_id: int) -> None:
+        document_type = self._type_of.pop(document_id, None)
+        if document_type is not None:
+            self._indexes[document_type].remove(document_id)
+            self.stats_counters["removed"] += 1
+            self._dirty = True
+
+    def sync(self, documents: Iterable[Tuple[int, int, str, Optional[str]]]) -> int:
+        """
+        Bring the index in line with all stored documents, given as (document_id, application_id,
+        document_type, text): new and changed texts are embedded, documents no longer listed are dropped.
+        Returns the number of indexed documents.
+        """
+        seen = set()
+        for document_id, application_id, document_type, text in documents:
+            seen.add(document_id)
+            self.add(document_id, application_id, document_type, text)
+        with self._lock:
+            for document_id in [d for d in self._type_of if d not in seen]:
+                self._remove_locked(document_id)
+            return len(self._type_of)
+
+    def near_duplicates(self, document_id: int, threshold: float, top_k: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Most similar documents of the same type from other applications with a similarity of at least
+        threshold, most similar first. None if the document is not indexed.
+        """
+        with self._lock:
+            document_type = self._type_of.get(document_id)
+            if document_type is None:
+                return None
+            index = self._indexes[document_type]
+            row = index.row_of[document_id]
+            started = time.monotonic()
+            scores = index.similarities(index.vectors[row].astype(np.float32))
+            scores[index.application_ids[:index.size] == index.application_ids[row]] = -1.0
+            candidates = np.flatnonzero(scores >= threshold)
+            if len(candidates) > top_k:
+                candidates = candidates[np.argpartition(scores[candidates], -top_k)[-top_k:]]
+            candidates = candidates[np.argsort(-scores[candidates])]
+            matches = [
+                {"document_id": int(index.document_ids[i]), "application_id": int(index.application_ids[i]),
+                 "similarity": round(float(min(scores[i], 1.0)), 4)}
+                for i in candidates
+            ]
+            self.stats_counters["searches"] += 1
+            self.stats_counters["search_ms"] += (time.monotonic() - started) * 1000
+            return matches
+
+    def application_report(self, documents: Iterable[Tuple[int, str]], threshold: float, top_k: int) -> List[Dict[str, Any]]:
+        """Near-duplicates of each (document_id, document_type) of an application; only indexed types are listed."""
+        report = []
+        for document_id, document_type in documents:
+            if document_type not in self._indexes:
+                continue
+            matches = self.near_duplicates(document_id, threshold, top_k)
+            report.append({
+                "document_id": document_id,
+                "document_type": document_type,
+                "indexed": matches is not None,
+                "near_duplicates": matches or [],
+            })
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self.stats_counters)
+            searches = counters.pop("searches")
+            search_ms = counters.pop("search_ms")
+            return {
+                **counters,
+                "backend": "simsimd" if simsimd is not None else "numpy",
+                "dim": self.dim,
+                "documents": {document_type: index.size for document_type, index in self._indexes.items()},
+                "vector_bytes": sum(index.size * self.dim * 2 for index in self._indexes.values()),
+                "searches": searches,
+                "avg_search_ms": round(search_ms / searches, 3) if searches else None,
+            }
+
+    def save(self) -> None:
+        """Write the index to path (through a temporary file, so a crash leaves the previous one intact)."""
+        if not self.path:
+            return
+        with self._lock:
+            arrays = {"dim": np.array(self.dim)}
+            for document_type, index in self._indexes.items():
+                arrays[f"{document_type}.vectors"] = index.vectors[:index.size]
+                arrays[f"{document_type}.document_ids"] = index.document_ids[:index.size]
+                arrays[f"{document_type}.application_ids"] = index.application_ids[:index.size]
+                arrays[f"{document_type}.digests"] = np.array(index.digests, dtype="U40")
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+            self._last_save = time.monotonic()
+
+    def maybe_save(self) -> None:
+        """Save if the index changed and the last save is at least save_interval seconds old."""
+        if self._dirty and time.monotonic() - self._last_save >= self.save_interval:
+            try:
+                self.save()
+            except Exception as e:
+                logger.warning(f"Could not save the similarity index to {self.path}: {str(e)}")
+
+    def _load(self) -> None:
+        try:
+            with np.load(self.path) as data:
+                if int(data["dim"]) != self.dim:
+                    logger.info(f"Similarity index {self.path} has another dimension, rebuilding it")
+                    return
+                for document_type, index in self._indexes.items():
+                    if f"{document_type}.vectors" not in data:
+                        continue
+                    document_ids = data[f"{document_type}.document_ids"]
+                    while len(index.document_ids) < len(document_ids):
+                        index._grow()
+                    index.size = len(document_ids)
+                    index.vectors[:index.size] = data[f"{document_type}.vectors"]
+                    index.document_ids[:index.size] = document_ids
+                    index.application_ids[:index.size] = data[f"{document_type}.application_ids"]
+                    index.digests = [str(digest) for digest in data[f"{document_type}.digests"]]
+                    for row, document_id in enumerate(document_ids.tolist()):
+                        index.row_of[document_id] = row
+                        self._type_of[document_id] = document_type
+        except Exception as e:
+            logger.warning(f"Could not load the similarity index from {self.path}: {str(e)}")
+            self._indexes = {document_type: _TypeIndex(self.dim) for document_type in self.document_types}
+            self._type_of = {}
+            return
+        logger.info(f"Loaded {len(self._type_of)} document vectors from {self.path}")
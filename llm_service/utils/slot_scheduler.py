@@ -0,0 +1,112 @@
+"""
+Priority scheduling of generations onto the parallel slots of the Ollama server.
+"""
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from llm_service.utils.cancellation import AnalysisCancelled, current_cancel_token
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+# Seconds between checks of the waiting analysis' cancel token while queued for a slot
+CANCEL_POLL_SECONDS = 0.25
+
+# Priority of the generations issued by the current analysis. Stage worker threads
+# inherit it because LLMProcessor runs them inside a copy of the caller's context.
+request_priority: ContextVar[int] = ContextVar("request_priority", default=PRIORITY_INTERACTIVE)
+
+
+class _Ticket:
+    __slots__ = ("priority", "key", "seq")
+
+    def __init__(self, priority: int, key: Optional[str], seq: int):
+        self.priority = priority
+        self.key = key
+        self.seq = seq
+
+
+class SlotScheduler:
+    """
+    Drop-in replacement for a semaphore over the server slots that decides who goes next.
+    Waiters are served by priority (interactive before batch), then prefer the same prompt
+    key as the last dispatched generation (its prefix is most likely still in a slot's KV
+    cache), then first come first served. A waiter whose analysis is cancelled (or whose deadline
+    passes) leaves the queue with AnalysisCancelled instead of taking a slot first.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self._free = slots
+        self._cond = threading.Condition()
+        self._waiting: List[_Ticket] = []
+        self._seq = itertools.count()
+        self._last_key: Optional[str] = None
+        self.stats_counters = {"granted_interactive": 0, "granted_batch": 0, "waited": 0, "key_affinity_grants": 0,
+                               "cancelled_waits": 0}
+
+    def _next(self) -> _Ticket:
+        return min(self._waiting, key=lambda t: (t.priority, t.key != self._last_key, t.seq))
+
+    def acquire(self, priority: int = PRIORITY_INTERACTIVE, key: Optional[str] = None) -> None:
+        """
+        Raises:
+            AnalysisCancelled: If the current analysis is cancelled while waiting
+        """
+        cancel_token = current_cancel_token.get()
+        with self._cond:
+            ticket = _Ticket(priority, key, next(self._seq))
+            self._waiting.append(ticket)
+            if self._free <= 0:
+                self.stats_counters["waited"] += 1
+            while self._free <= 0 or self._next() is not ticket:
+                if cancel_token is not None and cancel_token.cancelled:
+                    self._waiting.remove(ticket)
+                    self.stats_counters["cancelled_waits"] += 1
+                    # The ticket may have been the next in line
+                    self._cond.notify_all()
+                    raise AnalysisCancelled(cancel_token.reason)
+                self._cond.wait(CANCEL_POLL_SECONDS if cancel_token is not None else None)
+            self._waiting.remove(ticket)
+            self._free -= 1
+            if key is not None and key == self._last_key:
+                self.stats_counters["key_affinity_grants"] += 1
+            self._last_key = key
+            self.stats_counters["granted_interactive" if priority == PRIORITY_INTERACTIVE else "granted_batch"] += 1
+            if self._free > 0 and self._waiting:
+                self._cond.notify_all()
+
+    def release(self) -> None:
+        with self._cond:
+            self._free += 1
+            self._cond.notify_all()
+
+    def resize(self, slots: int) -> None:
+        """Change the number of slots; holders above a reduced capacity finish normally, new waiters wait for them."""
+        with self._cond:
+            self._free += slots - self.slots
+            self.slots = slots
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, priority: Optional[int] = None, key: Optional[str] = None) -> Iterator[None]:
+        """Hold a slot; priority defaults to the request_priority of the current context."""
+        self.acquire(request_priority.get() if priority is None else priority, key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            counters = dict(self.stats_counters)
+            counters.update({
+                "slots": self.slots,
+                "busy": self.slots - self._free,
+                "waiting_interactive": sum(1 for t in self._waiting if t.priority == PRIORITY_INTERACTIVE),
+                "waiting_batch": sum(1 for t in self._waiting if t.priority != PRIORITY_INTERACTIVE),
+            })
+            return counters
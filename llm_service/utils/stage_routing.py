@@ -0,0 +1,122 @@
+"""
+Per-stage generation settings: which model a stage runs on, how its prompt is formatted for that
+model, and its num_predict, num_ctx and temperature.
+"""
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+ROUTE_FIELDS = ("model", "num_predict", "num_ctx", "temperature", "prompt_format")
+
+# "llama2": the prompt carries LLaMA2 [INST] <<SYS>> markup and is sent raw.
+# "chat": the system block goes into Ollama's "system" field and the model's own template is applied.
+PROMPT_FORMATS = ("llama2", "chat")
+
+# Opt-in output budgets of the stages (LLM_STAGE_NUM_PREDICT). Field extraction needs well under
+# 100 tokens; summaries are capped at 200 words (~270 tokens) plus the JSON around them.
+STAGE_NUM_PREDICT = {
+    "passport": 128,
+    "degree": 128,
+    "language_certificate": 64,
+    "cv": 400,
+    "motivation_letter": 400,
+    "recommendation_letter": 448,
+    "achievements": 320,
+    "additional_documents": 320,
+    "evaluation": 320,
+}
+
+# Stages with an instance per document type ("cv_chunk_notes") share the route of their suffix
+STAGE_FAMILIES = ("chunk_notes",)
+
+
+def default_prompt_format(model: str) -> str:
+    """Prompt format of a model by its name: LLaMA2 chat markup for the LLaMA2 family, the model's own template otherwise."""
+    name = model.lower().split("/")[-1]
+    return "llama2" if name.startswith(("llama2", "llama-2")) else "chat"
+
+
+def load_routes(value: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Parse LLM_STAGE_ROUTES: a JSON object, or the path of a JSON file, mapping a stage name
+    (or "default") to any of model, num_predict, num_ctx, temperature and prompt_format.
+    Raises:
+        ValueError: If the value is not such an object
+    """
+    if not value:
+        return {}
+    if os.path.isfile(value):
+        with open(value, 'r', encoding='utf-8') as f:
+            value = f.read()
+    try:
+        routes = json.loads(value)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"LLM_STAGE_ROUTES is not valid JSON: {e}")
+    if not isinstance(routes, dict) or not all(isinstance(route, dict) for route in routes.values()):
+        raise ValueError("LLM_STAGE_ROUTES must map stage names to objects")
+    for stage, route in routes.items():
+        unknown = set(route) - set(ROUTE_FIELDS)
+        if unknown:
+            raise ValueError(f"LLM_STAGE_ROUTES['{stage}'] has unknown settings: {sorted(unknown)}")
+        if "prompt_format" in route and route["prompt_format"] not in PROMPT_FORMATS:
+            raise ValueError(f"LLM_STAGE_ROUTES['{stage}'] prompt_format must be one of {list(PROMPT_FORMATS)}")
+    return routes
+
+
+class StageRouter:
+    """
+    Resolves the generation settings of a stage. Precedence, highest first: the stage's entry in
+    the configured routes, its family entry ("chunk_notes"), the built-in budget of the stage,
+    the "default" entry, then the service-wide settings. Unless a route sets prompt_format,
+    it follows from the resolved model (default_prompt_format).
+    """
+
+    def __init__(self, model: str, num_predict: int, num_ctx: int, temperature: float,
+                 routes: Optional[Dict[str, Dict[str, Any]]] = None, extraction_model: Optional[str] = None,
+                 builtin_num_predict: Optional[Dict[str, int]] = None, stage_num_predict: bool = False):
+        """
+        Args:
+            extraction_model: Model for every stage except evaluation, unless a route names another one
+            builtin_num_predict: Budgets of specific stages (e.g. consolidated, chunk_notes)
+            stage_num_predict: Also apply STAGE_NUM_PREDICT; otherwise every other stage gets num_predict
+        """
+        self.base = {"model": model, "num_predict": num_predict, "num_ctx": num_ctx, "temperature": temperature}
+        self.routes = routes or {}
+        self.extraction_model = extraction_model or None
+        self.builtin_num_predict = {**(STAGE_NUM_PREDICT if stage_num_predict else {}), **(builtin_num_predict or {})}
+        self._resolved: Dict[str, Dict[str, Any]] = {}
+
+    def _family(self, stage: str) -> Optional[str]:
+        for family in STAGE_FAMILIES:
+            if stage.endswith(f"_{family}"):
+                return family
+        return None
+
+    def route(self, stage: str) -> Dict[str, Any]:
+        """Generation settings of a stage: model, num_predict, num_ctx and temperature."""
+        if stage in self._resolved:
+            return self._resolved[stage]
+        family = self._family(stage)
+        route = dict(self.base)
+        route.update(self.routes.get("default", {}))
+        if self.extraction_model and stage != "evaluation":
+            route["model"] = self.extraction_model
+        for name in (family, stage):
+            if name in self.builtin_num_predict:
+                route["num_predict"] = self.builtin_num_predict[name]
+        for name in (family, stage):
+            if name and name in self.routes:
+                route.update(self.routes[name])
+        route.setdefault("prompt_format", default_prompt_format(route["model"]))
+        self._resolved[stage] = route
+        return route
+
+    def models(self) -> List[str]:
+        """Every model some stage can be routed to."""
+        stages = set(self.builtin_num_predict) | set(self.routes) | set(STAGE_NUM_PREDICT) | {"default"}
+        return sorted({self.route(stage)["model"] for stage in stages})
+
+    def table(self) -> Dict[str, Dict[str, Any]]:
+        """Resolved settings of every known stage, for reporting."""
+        stages = (set(self.builtin_num_predict) | set(self.routes) | set(STAGE_NUM_PREDICT) | set(self._resolved)) - {"default"}
+        return {stage: dict(self.route(stage)) for stage in sorted(stages)}
@@ -0,0 +1,78 @@
+"""
+Token budget helpers for prompts sent to Ollama.
+"""
+from typing import List
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token count estimate for the LLaMA tokenizer without loading it.
+    English text averages about 4 characters per token; Cyrillic and other
+    non-ASCII text splits into far more pieces, about 1.5 characters per token.
+    """
+    if not text:
+        return 0
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    ascii_chars = len(text) - non_ascii
+    return int(ascii_chars / 4 + non_ascii / 1.5) + 1
+
+
+# Page separator inserted by the OCR service between PDF pages
+PAGE_BREAK_MARKER = "--- Page Break ---"
+
+
+def _split_oversized(text: str, max_tokens: int) -> List[str]:
+    """Split a single page that is over budget on paragraph, then line boundaries."""
+    pieces = []
+    current = ""
+    for separator in ("\n\n", "\n"):
+        if separator in text:
+            parts = text.split(separator)
+            break
+    else:
+        parts = [text]
+        separator = ""
+    for part in parts:
+        candidate = f"{current}{separator}{part}" if current else part
+        if estimate_tokens(candidate) <= max_tokens:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        if estimate_tokens(part) <= max_tokens:
+            current = part
+        else:
+            # No usable boundary left: cut by characters proportionally to the estimate
+            step = max(1, int(len(part) * max_tokens / estimate_tokens(part)))
+            pieces.extend(part[i:i + step] for i in range(0, len(part), step))
+            current = ""
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """
+    Split a document into chunks of at most max_tokens (estimated).
+    Consecutive OCR pages are packed together; a page that alone exceeds
+    the budget is split further on paragraph and line boundaries.
+    """
+    pages = [page.strip() for page in text.split(PAGE_BREAK_MARKER) if page.strip()]
+    chunks = []
+    current = ""
+    for page in pages:
+        if estimate_tokens(page) > max_tokens:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.extend(_split_oversized(page, max_tokens))
+            continue
+        candidate = f"{current}\n\n{page}" if current else page
+        if estimate_tokens(candidate) <= max_tokens:
+            current = candidate
+        else:
+            chunks.append(current)
+            current = page
+    if current:
+        chunks.append(current)
+    return chunks
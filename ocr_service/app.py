@@ -5,12 +5,19 @@ from flask import Flask, request, jsonify
 import os
 import sys
 import uuid
+import json
 from werkzeug.utils import secure_filename
 # Thêm thư mục cha vào đường dẫn để nhập các mô-đun cơ sở dữ liệu
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from ocr_service.config import OCR_SERVICE_HOST, OCR_SERVICE_PORT, UPLOAD_FOLDER, ALLOWED_EXTENSIONS
+from ocr_service.config import (
+    OCR_SERVICE_HOST, OCR_SERVICE_PORT, UPLOAD_FOLDER, ALLOWED_EXTENSIONS,
+    OCR_MAX_IN_FLIGHT, OCR_MAX_QUEUE, OCR_QUEUE_TIMEOUT,
+    OCR_RASTER_CACHE_DIR, OCR_RASTER_CACHE_MAX_MB, OCR_PDF_ZOOM
+)
 from ocr_service.utils.ocr_processor import OCRProcessor
+from ocr_service.utils.admission import AdmissionController
+from ocr_service.utils.raster_cache import RasterCache
 from database.db import get_session, init_db
 from database.models import Document, ProcessingStatus, DocumentType
 
@@ -22,7 +29,9 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 
-ocr_processor = OCRProcessor()
+raster_cache = RasterCache(OCR_RASTER_CACHE_DIR, OCR_RASTER_CACHE_MAX_MB * 1024 * 1024) if OCR_RASTER_CACHE_DIR else None
+ocr_processor = OCRProcessor(raster_cache=raster_cache, pdf_zoom=OCR_PDF_ZOOM)
+admission = AdmissionController(OCR_MAX_IN_FLIGHT, OCR_MAX_QUEUE, OCR_QUEUE_TIMEOUT)
 
 def allowed_file(filename):
     """Check if file has an allowed extension."""
@@ -33,6 +42,15 @@ def health_check():
     """Health check endpoint."""
     return jsonify({"status": "healthy", "service": "ocr_service"})
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Admission control counters and raster cache statistics."""
+    return jsonify({
+        "service": "ocr_service",
+        "admission": admission.stats(),
+        "raster_cache": raster_cache.stats() if raster_cache else None
+    })
+
 @app.route('/api/process', methods=['POST'])
 def process_document():
     """
@@ -44,9 +62,26 @@ def process_document():
         "file_path": "string",
         "document_type": "string"  
     }
+
+    Returns 429 with a Retry-After header when the node is over capacity.
     """
+    started_at = admission.acquire()
+    if started_at is None:
+        retry_after = admission.retry_after()
+        response = jsonify({
+            "error": "OCR service is over capacity, retry later",
+            "retry_after": retry_after
+        })
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
+
+    try:
+        return _process_document(request.json)
+    finally:
+        admission.release(started_at)
 
-    data = request.json
+def _process_document(data):
+    """Run OCR for one admitted request."""
     
     if not data or 'document_id' not in data or 'file_path' not in data or 'document_type' not in data:
         return jsonify({"error": "Invalid request data"}), 400
@@ -77,10 +112,13 @@ def process_document():
     
     try:
 
-        extracted_text = ocr_processor.process_document(file_path)
+        processed = ocr_processor.process_document_structured(file_path, document_type)
+        extracted_text = processed["text"]
+        grades = processed["grades"]
         
 
         language = ocr_processor.detect_language(extracted_text)
+        page_languages = ocr_processor.detect_page_languages(extracted_text)
         
 
         processed_file_path = f"{os.path.splitext(file_path)[0]}_processed.txt"
@@ -92,6 +130,7 @@ def process_document():
             document = session.query(Document).filter(Document.id == document_id).first()
             if document:
                 document.content_text = extracted_text
+                document.structured_data = json.dumps({"grades": grades}, ensure_ascii=False) if grades else None
                 document.processing_status = ProcessingStatus.COMPLETED.value
                 session.commit()
         except Exception as e:
@@ -105,7 +144,9 @@ def process_document():
             "status": "completed",
             "document_id": document_id,
             "document_type": document_type,
-            "language": language
+            "language": language,
+            "page_languages": page_languages,
+            "grade_rows": len(grades) if grades else 0
         })
     
     except Exception as e:
@@ -138,4 +179,4 @@ def get_task_status(task_id):
 
 if __name__ == '__main__':
     init_db()
-    app.run(host=OCR_SERVICE_HOST, port=OCR_SERVICE_PORT, debug=True)
+    app.run(host=OCR_SERVICE_HOST, port=OCR_SERVICE_PORT, debug=True, threaded=True)
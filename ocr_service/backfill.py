@@ -0,0 +1,228 @@
+"""
+Offline bulk OCR backfill.
+
+Re-processes Document rows straight from the database with a pool of worker
+processes, bypassing the HTTP service. Results are written back in batched
+commits and every successfully committed document id is appended to a
+checkpoint file named after the selection, so an interrupted run can be
+restarted with the same arguments and resumes where it stopped (retrying
+failed documents). The checkpoint is removed once a run finishes cleanly.
+
+Example:
+    python ocr_service/backfill.py --status completed --type degree --since 2025-01-01 --workers 4
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+
+# Add parent directory to path to import database modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ocr_service.config import OCR_RASTER_CACHE_DIR, OCR_RASTER_CACHE_MAX_MB, OCR_PDF_ZOOM
+from database.db import get_session
+from database.models import Document, ProcessingStatus
+
+_worker_processor = None
+
+
+def _init_worker():
+    """Create one OCRProcessor per worker process."""
+    global _worker_processor
+    from ocr_service.utils.ocr_processor import OCRProcessor
+    from ocr_service.utils.raster_cache import RasterCache
+    # Workers share the cache directory: shared=True makes the byte budget hold for all of them together
+    raster_cache = RasterCache(OCR_RASTER_CACHE_DIR, OCR_RASTER_CACHE_MAX_MB * 1024 * 1024, shared=True) if OCR_RASTER_CACHE_DIR else None
+    _worker_processor = OCRProcessor(raster_cache=raster_cache, pdf_zoom=OCR_PDF_ZOOM)
+
+
+def _process_one(job):
+    """
+    OCR a single document in a worker process.
+    Returns:
+        dict: document_id, text, grades and error (None on success)
+    """
+    document_id, file_path, document_type = job
+    try:
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"File not found: {file_path}")
+        processed = _worker_processor.process_document_structured(file_path, document_type)
+        return {"document_id": document_id, "text": processed["text"], "grades": processed["grades"], "error": None}
+    except Exception as e:
+        return {"document_id": document_id, "text": None, "grades": None, "error": str(e)}
+
+
+def _load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, 'r', encoding='utf-8') as f:
+        return {int(line) for line in f if line.strip().isdigit()}
+
+
+def default_checkpoint_path(statuses, document_types, since, until, limit):
+    """Checkpoint file of one selection, so a backfill with other filters never skips documents because of it."""
+    selection = json.dumps({
+        "statuses": sorted(statuses or []), "document_types": sorted(document_types or []),
+        "since": since.isoformat() if since else None, "until": until.isoformat() if until else None, "limit": limit,
+    }, sort_keys=True)
+    return f"ocr_backfill-{hashlib.sha1(selection.encode('utf-8')).hexdigest()[:12]}.checkpoint"
+
+
+def _append_checkpoint(path, document_ids):
+    if not path:
+        return
+    with open(path, 'a', encoding='utf-8') as f:
+        for document_id in document_ids:
+            f.write(f"{document_id}\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def select_documents(statuses=None, document_types=None, since=None, until=None, limit=None):
+    """
+    Select documents to re-process.
+    Returns:
+        list: (document_id, file_path, document_type) tuples ordered by id
+    """
+    session = get_session()
+    try:
+        query = session.query(Document.id, Document.file_path, Document.document_type)
+        if statuses:
+            query = query.filter(Document.processing_status.in_(statuses))
+        if document_types:
+            query = query.filter(Document.document_type.in_(document_types))
+        if since:
+            query = query.filter(Document.upload_date >= since)
+        if until:
+            query = query.filter(Document.upload_date < until)
+        query = query.order_by(Document.id)
+        if limit:
+            query = query.limit(limit)
+        return [(row.id, row.file_path, row.document_type) for row in query.all()]
+    finally:
+        session.close()
+
+
+def write_batch(results):
+    """
+    Write a batch of OCR results back to the documents table in one commit.
+    Returns:
+        tuple: (completed count, failed count)
+    """
+    completed = failed = 0
+    session = get_session()
+    try:
+        ids = [r["document_id"] for r in results]
+        documents = {d.id: d for d in session.query(Document).filter(Document.id.in_(ids)).all()}
+        for r in results:
+            document = documents.get(r["document_id"])
+            if not document:
+                continue
+            if r["error"] is None:
+                document.content_text = r["text"]
+                document.structured_data = json.dumps({"grades": r["grades"]}, ensure_ascii=False) if r["grades"] else None
+                document.processing_status = ProcessingStatus.COMPLETED.value
+                completed += 1
+            else:
+                document.processing_status = ProcessingStatus.FAILED.value
+                failed += 1
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    return completed, failed
+
+
+def run_backfill(jobs, workers, batch_size, checkpoint_path=None):
+    """Process jobs with a process pool and write results back in batches."""
+    total = len(jobs)
+    completed = failed = 0
+    started = time.monotonic()
+    batch = []
+
+    def flush():
+        nonlocal completed, failed
+        if not batch:
+            return
+        done_ok, done_failed = write_batch(batch)
+        completed += done_ok
+        failed += done_failed
+        # Failed documents are not checkpointed, so a resumed run retries them
+        _append_checkpoint(checkpoint_path, [r["document_id"] for r in batch if r["error"] is None])
+        for r in batch:
+            if r["error"]:
+                print(f"  Document {r['document_id']} failed: {r['error']}")
+        batch.clear()
+        done = completed + failed
+        elapsed = time.monotonic() - started
+        rate = done / elapsed if elapsed > 0 else 0.0
+        eta = (total - done) / rate if rate > 0 else 0.0
+        print(f"[{done}/{total}] completed={completed} failed={failed} "
+              f"{rate:.2f} docs/s ({rate * 3600:.0f} docs/h), ETA {eta:.0f}s")
+
+    with multiprocessing.Pool(processes=workers, initializer=_init_worker) as pool:
+        try:
+            for result in pool.imap_unordered(_process_one, jobs):
+                batch.append(result)
+                if len(batch) >= batch_size:
+                    flush()
+        except KeyboardInterrupt:
+            print("Interrupted, saving finished documents...")
+            pool.terminate()
+        finally:
+            flush()
+
+    elapsed = time.monotonic() - started
+    print(f"Backfill finished: {completed} completed, {failed} failed in {elapsed:.1f}s")
+    return completed, failed
+
+
+def _parse_date(value):
+    return datetime.fromisoformat(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-run OCR for documents selected from the database.")
+    parser.add_argument('--status', action='append', choices=[s.value for s in ProcessingStatus],
+                        help="Processing status to select (repeatable)")
+    parser.add_argument('--type', dest='document_types', action='append',
+                        help="Document type to select, e.g. degree (repeatable)")
+    parser.add_argument('--since', type=_parse_date, help="Only documents uploaded on/after this date (ISO format)")
+    parser.add_argument('--until', type=_parse_date, help="Only documents uploaded before this date (ISO format)")
+    parser.add_argument('--limit', type=int, help="Maximum number of documents to select")
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument('--batch-size', type=int, default=20, help="Documents per database commit")
+    parser.add_argument('--checkpoint',
+                        help="File recording successfully committed document ids, used to resume "
+                             "(default: ocr_backfill-<hash of the selection>.checkpoint; removed after a clean run)")
+    parser.add_argument('--restart', action='store_true', help="Ignore an existing checkpoint file")
+    parser.add_argument('--dry-run', action='store_true', help="Only print how many documents would be processed")
+    args = parser.parse_args(argv)
+
+    if not args.checkpoint:
+        args.checkpoint = default_checkpoint_path(args.status, args.document_types, args.since, args.until, args.limit)
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    jobs = select_documents(args.status, args.document_types, args.since, args.until, args.limit)
+    done_ids = _load_checkpoint(args.checkpoint)
+    pending = [job for job in jobs if job[0] not in done_ids]
+    print(f"Selected {len(jobs)} document(s), {len(jobs) - len(pending)} already done, {len(pending)} to process.")
+
+    if args.dry_run or not pending:
+        return 0
+    completed, failed = run_backfill(pending, args.workers, args.batch_size, args.checkpoint)
+    if not failed and completed == len(pending) and os.path.exists(args.checkpoint):
+        # Every selected document is done; a later run with the same filters should process them again
+        os.remove(args.checkpoint)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
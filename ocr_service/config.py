@@ -18,4 +18,14 @@ ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'txt'}
 # Sử dụng CPU thay vì GPU để tránh xung đột bộ nhớ với LLM_service
 USE_GPU = False
 
+# Rendered PDF page cache (memory-mapped rasters); disabled when OCR_RASTER_CACHE_DIR is empty
+OCR_RASTER_CACHE_DIR = os.getenv('OCR_RASTER_CACHE_DIR', '')
+OCR_RASTER_CACHE_MAX_MB = int(os.getenv('OCR_RASTER_CACHE_MAX_MB', 2048))
+OCR_PDF_ZOOM = float(os.getenv('OCR_PDF_ZOOM', 2.0))
+
+# Admission control (per node): concurrent OCR jobs, waiting requests and queue wait limit
+OCR_MAX_IN_FLIGHT = int(os.getenv('OCR_MAX_IN_FLIGHT', max(1, (os.cpu_count() or 2) // 2)))
+OCR_MAX_QUEUE = int(os.getenv('OCR_MAX_QUEUE', OCR_MAX_IN_FLIGHT * 4))
+OCR_QUEUE_TIMEOUT = float(os.getenv('OCR_QUEUE_TIMEOUT', 30))
+
 
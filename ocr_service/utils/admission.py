@@ -0,0 +1,129 @@
+"""
+Admission control for the OCR service.
+"""
+import math
+import threading
+import time
+from collections import deque
+
+
+class AdmissionController:
+    """
+    Bounded work queue in front of the OCR pipeline.
+    At most `max_in_flight` documents are processed at once; up to `max_queue`
+    further requests wait for a free slot. Anything beyond that is rejected so
+    the caller can back off instead of piling more Tesseract processes on the CPU.
+    """
+
+    def __init__(self, max_in_flight, max_queue, queue_timeout, drain_window=60.0, default_service_time=10.0):
+        """
+        Args:
+            max_in_flight (int): Maximum number of documents processed concurrently
+            max_queue (int): Maximum number of requests waiting for a slot
+            queue_timeout (float): Seconds a queued request waits before being rejected
+            drain_window (float): Seconds of completion history used to estimate drain rate
+            default_service_time (float): Assumed seconds per document before any has completed
+        """
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = queue_timeout
+        self.drain_window = drain_window
+        self.default_service_time = default_service_time
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._queued = 0
+        self._completions = deque()
+        self._avg_service_time = None
+
+        self.admitted_total = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.completed_total = 0
+
+    def acquire(self):
+        """
+        Wait for a processing slot.
+        Returns:
+            float or None: Start timestamp to pass to release(), or None if the request was rejected
+        """
+        with self._cond:
+            if self._in_flight >= self.max_in_flight:
+                if self._queued >= self.max_queue:
+                    self.rejected_queue_full += 1
+                    return None
+                self._queued += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self._in_flight >= self.max_in_flight:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected_timeout += 1
+                            return None
+                        self._cond.wait(remaining)
+                finally:
+                    self._queued -= 1
+            self._in_flight += 1
+            self.admitted_total += 1
+            return time.monotonic()
+
+    def release(self, started_at):
+        """Free a processing slot and record how long the document took."""
+        now = time.monotonic()
+        with self._cond:
+            self._in_flight -= 1
+            self.completed_total += 1
+            self._completions.append(now)
+            self._trim_completions(now)
+            duration = now - started_at
+            if self._avg_service_time is None:
+                self._avg_service_time = duration
+            else:
+                self._avg_service_time = 0.8 * self._avg_service_time + 0.2 * duration
+            self._cond.notify()
+
+    def _trim_completions(self, now):
+        while self._completions and now - self._completions[0] > self.drain_window:
+            self._completions.popleft()
+
+    def _drain_rate(self, now):
+        """Completed documents per second over the recent window."""
+        self._trim_completions(now)
+        if len(self._completions) < 2:
+            return 0.0
+        span = max(now - self._completions[0], 1.0)
+        return len(self._completions) / span
+
+    def retry_after(self):
+        """
+        Estimate how many seconds a rejected client should wait before retrying.
+        Based on the current queue depth and the observed drain rate.
+        """
+        now = time.monotonic()
+        with self._cond:
+            backlog = self._queued + max(0, self._in_flight - self.max_in_flight + 1)
+            drain_rate = self._drain_rate(now)
+            if drain_rate > 0:
+                seconds = backlog / drain_rate
+            else:
+                service_time = self._avg_service_time or self.default_service_time
+                seconds = backlog * service_time / self.max_in_flight
+        return int(min(max(math.ceil(seconds), 1), 300))
+
+    def stats(self):
+        """Snapshot of queue depth, capacity and rejection counters."""
+        now = time.monotonic()
+        with self._cond:
+            return {
+                "in_flight": self._in_flight,
+                "queue_depth": self._queued,
+                "max_in_flight": self.max_in_flight,
+                "max_queue": self.max_queue,
+                "admitted_total": self.admitted_total,
+                "completed_total": self.completed_total,
+                "rejected_total": self.rejected_queue_full + self.rejected_timeout,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_timeout": self.rejected_timeout,
+                "drain_rate_per_sec": round(self._drain_rate(now), 3),
+                "avg_service_time_sec": round(self._avg_service_time, 3) if self._avg_service_time else None,
+            }
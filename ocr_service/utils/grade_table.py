@@ -0,0 +1,216 @@
+"""
+Grade table extraction for degree transcripts (diploma supplements).
+Turns table rows of a transcript page into structured records:
+{"course": str, "grade": str, "grade_value": int or None, "credits": float or None, "raw": str}
+"""
+import re
+
+import cv2
+import pytesseract
+from PIL import Image
+
+# (pattern on the lowercased token, numeric value or None for pass/fail grades).
+# "неудовл" must be checked before "удовл".
+GRADE_PATTERNS = [
+    (re.compile(r'^неуд'), 2),
+    (re.compile(r'^удовл|^удов'), 3),
+    (re.compile(r'^хор'), 4),
+    (re.compile(r'^отл'), 5),
+    (re.compile(r'^unsatisfactory$|^fail(ed)?$'), 2),
+    (re.compile(r'^satisfactory$'), 3),
+    (re.compile(r'^good$'), 4),
+    (re.compile(r'^excellent$'), 5),
+    (re.compile(r'^зач[её]т|^зачтено'), None),
+    (re.compile(r'^pass(ed)?$'), None),
+]
+
+NUMBER_RE = re.compile(r'^\d{1,3}([.,]\d{1,2})?$')
+ROW_INDEX_RE = re.compile(r'^\d{1,3}[.)]?$')
+HOUR_UNITS = ('час', 'ч', 'hours', 'hrs')
+CREDIT_UNITS = ('з.е', 'зе', 'з/е', 'зет', 'ects', 'credits', 'cr')
+HOURS_PER_CREDIT = 36
+
+# Minimum number of graded rows before a page is considered a transcript table
+MIN_GRADED_ROWS = 3
+
+
+def _clean(token):
+    return token.strip().strip('|()[]:;,').lower()
+
+
+def _parenthesized(token):
+    token = token.strip().strip('|:;,')
+    return token.startswith('(') or token.endswith(')')
+
+
+def match_grade(token):
+    """
+    Match a single token against the grade vocabulary.
+    Returns:
+        tuple: (matched, grade_value)
+    """
+    cleaned = _clean(token)
+    if not cleaned:
+        return False, None
+    for pattern, value in GRADE_PATTERNS:
+        if pattern.search(cleaned):
+            return True, value
+    return False, None
+
+
+def parse_grade_row(tokens):
+    """
+    Parse one table row given as a left-to-right list of tokens.
+    Returns:
+        dict or None: Row record, or None if the row carries no grade
+    """
+    tokens = [t for t in tokens if t.strip() and t.strip() != '|']
+    if not tokens:
+        return None
+    raw = " ".join(tokens)
+
+    grade_idx = None
+    grade_value = None
+    for i in range(len(tokens) - 1, -1, -1):
+        matched, value = match_grade(tokens[i])
+        if matched:
+            grade_idx, grade_value = i, value
+            break
+
+    if grade_idx is None:
+        # Numeric-only grade column: "... 4 з.е. 5"
+        last = _clean(tokens[-1])
+        if len(tokens) >= 3 and last in ('2', '3', '4', '5') and any(t.isalpha() for t in tokens[:-1]):
+            grade_idx, grade_value = len(tokens) - 1, int(last)
+        else:
+            return None
+    else:
+        # "5 (отлично)" / "отлично (5)": the digit next to the grade word is the same grade written
+        # as a number. It only wins over the word when the pair is marked by parentheses; a digit that
+        # disagrees with the word otherwise belongs to another column (credits, hours, row number).
+        for j in (grade_idx - 1, grade_idx + 1):
+            if not (0 <= j < len(tokens) and _clean(tokens[j]) in ('2', '3', '4', '5') and grade_value is not None):
+                continue
+            digit = int(_clean(tokens[j]))
+            if digit == grade_value or _parenthesized(tokens[j]) or _parenthesized(tokens[grade_idx]):
+                grade_value = digit
+                if j < grade_idx:
+                    grade_idx = j
+                break
+
+    credits = None
+    course_end = grade_idx
+    for i in range(grade_idx - 1, -1, -1):
+        cleaned = _clean(tokens[i])
+        if cleaned.rstrip('.') in CREDIT_UNITS or cleaned.rstrip('.') in HOUR_UNITS:
+            continue
+        if NUMBER_RE.match(cleaned):
+            value = float(cleaned.replace(',', '.'))
+            unit = _clean(tokens[i + 1]).rstrip('.') if i + 1 < grade_idx else ''
+            if unit in HOUR_UNITS or (not unit and value > 30):
+                value = round(value / HOURS_PER_CREDIT, 2)
+            credits = value
+            course_end = i
+            # An hours column next to the credits column ("144 4 отлично") is not part of the course name
+            while course_end > 0 and (NUMBER_RE.match(_clean(tokens[course_end - 1]))
+                                      or _clean(tokens[course_end - 1]).rstrip('.') in HOUR_UNITS + CREDIT_UNITS):
+                course_end -= 1
+        break
+
+    course_tokens = tokens[:course_end]
+    if course_tokens and ROW_INDEX_RE.match(course_tokens[0].strip()):
+        course_tokens = course_tokens[1:]
+    course = " ".join(t.strip('|') for t in course_tokens).strip(" .|-—")
+
+    return {
+        "course": course,
+        "grade": tokens[grade_idx].strip('|()[]:;,'),
+        "grade_value": grade_value,
+        "credits": credits,
+        "raw": raw,
+    }
+
+
+def parse_grade_lines(lines):
+    """
+    Parse rows from a list of text lines. A course name wrapped onto the
+    line above its grade is joined back to the row.
+    """
+    rows = []
+    pending_name = None
+    for line in lines:
+        tokens = re.split(r'\s+|\|', line.strip())
+        row = parse_grade_row(tokens)
+        if row is None:
+            stripped = line.strip()
+            pending_name = stripped if stripped and not any(ch.isdigit() for ch in stripped) else None
+            continue
+        if pending_name and (not row["course"] or row["course"][:1].islower()):
+            row["course"] = f"{pending_name} {row['course']}".strip()
+            row["raw"] = f"{pending_name} {row['raw']}"
+        pending_name = None
+        rows.append(row)
+    return rows
+
+
+def extract_grades_from_text(text):
+    """Extract grade rows from already extracted plain text (TXT/DOCX transcripts)."""
+    rows = parse_grade_lines(text.splitlines())
+    return rows if len(rows) >= MIN_GRADED_ROWS else []
+
+
+def has_table_structure(gray_image, min_horizontal=3, min_vertical=2):
+    """
+    Detect ruled table structure on a grayscale page by extracting long
+    horizontal and vertical lines with morphological opening.
+    """
+    _, binary = cv2.threshold(gray_image, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    height, width = binary.shape[:2]
+
+    horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(10, width // 30), 1))
+    horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN, horizontal_kernel)
+    vertical_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (1, max(10, height // 30)))
+    vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN, vertical_kernel)
+
+    h_count = len(cv2.findContours(horizontal, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0])
+    v_count = len(cv2.findContours(vertical, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)[0])
+    return h_count >= min_horizontal and v_count >= min_vertical
+
+
+def count_grade_words(text):
+    """Number of grade-vocabulary tokens in a text; used to spot unruled transcript tables."""
+    return sum(1 for token in text.split() if match_grade(token)[0])
+
+
+def extract_grades_from_image(gray_image, lang='eng+rus'):
+    """
+    OCR a transcript page with word positions and rebuild its table rows.
+    Words are grouped by Tesseract line and ordered left to right, so cells
+    of the same row stay together even when the page has multiple columns of text.
+    """
+    try:
+        data = pytesseract.image_to_data(
+            Image.fromarray(gray_image),
+            config=f'-l {lang} --psm 6',
+            output_type=pytesseract.Output.DICT
+        )
+    except pytesseract.TesseractError as e:
+        print(f"Tesseract error during grade table extraction: {e}")
+        return []
+
+    lines = {}
+    for i, word in enumerate(data.get('text', [])):
+        if not word or not word.strip():
+            continue
+        try:
+            if float(data['conf'][i]) < 0:
+                continue
+        except (ValueError, TypeError):
+            pass
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        lines.setdefault(key, []).append((data['top'][i], data['left'][i], word))
+
+    ordered = sorted(lines.values(), key=lambda words: (min(w[0] for w in words), min(w[1] for w in words)))
+    text_lines = [" ".join(w[2] for w in sorted(words, key=lambda w: w[1])) for words in ordered]
+    rows = parse_grade_lines(text_lines)
+    return rows if len(rows) >= MIN_GRADED_ROWS else []
@@ -0,0 +1,109 @@
+"""
+Fast language detection based on Cyrillic/Latin script ratios.
+"""
+import langdetect
+from langdetect import DetectorFactory
+
+# Make langdetect deterministic for the ambiguous cases that still reach it
+DetectorFactory.seed = 0
+
+CYRILLIC_LANGS = ['ru', 'uk', 'bg', 'sr', 'mk']
+
+
+def _is_cyrillic(ch):
+    return 'Ѐ' <= ch <= 'ӿ'
+
+
+def _is_latin(ch):
+    return ('a' <= ch <= 'z') or ('A' <= ch <= 'Z') or ('À' <= ch <= 'ɏ' and ch not in '×÷')
+
+
+class ScriptLanguageDetector:
+    """
+    Decide between Russian and English from the share of Cyrillic letters
+    in a bounded sample of the text. Only when the ratio is ambiguous
+    (mixed-script documents) a seeded langdetect call is run, and only on the sample.
+    Cost is O(sample_size) regardless of document length.
+    """
+
+    def __init__(self, sample_size=3000, windows=3, cyrillic_threshold=0.6, latin_threshold=0.4, min_letters=20):
+        """
+        Args:
+            sample_size (int): Total number of characters inspected per text
+            windows (int): Number of evenly spaced windows the sample is taken from
+            cyrillic_threshold (float): Cyrillic share at or above which text is Russian
+            latin_threshold (float): Cyrillic share at or below which text is English
+            min_letters (int): Minimum letters in the sample for the ratio to be trusted
+        """
+        self.sample_size = sample_size
+        self.windows = max(1, windows)
+        self.cyrillic_threshold = cyrillic_threshold
+        self.latin_threshold = latin_threshold
+        self.min_letters = min_letters
+
+    def sample(self, text):
+        """Take evenly spaced windows (start, middle, ..., end) totalling at most sample_size characters."""
+        if len(text) <= self.sample_size:
+            return text
+        window = self.sample_size // self.windows
+        step = (len(text) - window) / max(1, self.windows - 1)
+        parts = []
+        for i in range(self.windows):
+            start = int(i * step)
+            parts.append(text[start:start + window])
+        return "\n".join(parts)
+
+    def script_ratio(self, sample):
+        """
+        Returns:
+            tuple: (share of Cyrillic letters among Cyrillic+Latin letters, number of letters counted)
+        """
+        cyrillic = 0
+        latin = 0
+        for ch in sample:
+            if _is_cyrillic(ch):
+                cyrillic += 1
+            elif _is_latin(ch):
+                latin += 1
+        letters = cyrillic + latin
+        if letters == 0:
+            return 0.0, 0
+        return cyrillic / letters, letters
+
+    def detect(self, text):
+        """
+        Detect the language of the text.
+        Args:
+            text (str): Text to detect language from
+        Returns:
+            str: Language code ('rus', 'eng', or the langdetect code for other languages)
+        """
+        if not text or len(text.strip()) < 10:
+            return 'en'
+        sample = self.sample(text)
+        ratio, letters = self.script_ratio(sample)
+        if letters >= self.min_letters:
+            if ratio >= self.cyrillic_threshold:
+                return 'rus'
+            if ratio <= self.latin_threshold:
+                return 'eng' if self._looks_english(sample) else self._langdetect(sample)
+        return self._langdetect(sample)
+
+    def _looks_english(self, sample):
+        """Latin-script text is assumed English unless it carries many non-ASCII letters (de, fr, vi...)."""
+        accented = sum(1 for ch in sample if 'À' <= ch <= 'ɏ')
+        ascii_letters = sum(1 for ch in sample if ch.isascii() and ch.isalpha())
+        return accented <= 0.02 * max(1, ascii_letters)
+
+    def _langdetect(self, sample):
+        try:
+            lang = langdetect.detect(sample)
+            if lang in CYRILLIC_LANGS:
+                return 'rus'
+            elif lang == 'en':
+                return 'eng'
+            return lang
+        except langdetect.lang_detect_exception.LangDetectException:
+            return 'en'
+        except Exception:
+            return 'en'
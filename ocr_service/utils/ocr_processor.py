@@ -8,7 +8,6 @@ import numpy as np
 import pytesseract
 import fitz  #
 from PIL import Image 
-import langdetect
 import docx 
 
 from skimage.transform import radon
@@ -17,6 +16,14 @@ from skimage.transform import rotate
 from skimage.color import rgb2gray
 from skimage.util import img_as_ubyte
 
+from ocr_service.utils.language_detector import ScriptLanguageDetector
+from ocr_service.utils.grade_table import (
+    MIN_GRADED_ROWS, count_grade_words, extract_grades_from_image,
+    extract_grades_from_text, has_table_structure
+)
+
+PAGE_BREAK = "\n\n--- Page Break ---\n\n"
+
 class OCRProcessor:
     """
     Class for processing documents and extracting text.
@@ -25,11 +32,15 @@ class OCRProcessor:
     Implements layout analysis for structured documents.
     """
 
-    def __init__(self):
+    def __init__(self, raster_cache=None, pdf_zoom=2.0):
         """Initialize OCR processor.
         Tesseract installation and tesseract_cmd path should be handled in environment setup.
         Example for Windows (in setup_environment.md):
         pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+        Args:
+            raster_cache (RasterCache, optional): Cache of rendered PDF pages
+            pdf_zoom (float): PDF render zoom, 2.0 = 144 DPI
         """
         try:
             pytesseract.get_tesseract_version()
@@ -38,28 +49,29 @@ class OCRProcessor:
             print("Warning: Tesseract OCR not found or not in PATH. OCR will fail.")
         except Exception as e:
             print(f"Warning: Error checking Tesseract version: {e}")
+        self.language_detector = ScriptLanguageDetector()
+        self.raster_cache = raster_cache
+        self.pdf_zoom = pdf_zoom
 
     def detect_language(self, text):
         """
-        Detect the language of the text using langdetect.
+        Detect the language of the text from a bounded sample (see ScriptLanguageDetector).
         Args:
             text (str): Text to detect language from
         Returns:
-            str: Language code (e.g., 'en', 'ru')
+            str: Language code (e.g., 'eng', 'rus')
         """
-        try:
-            if not text or len(text.strip()) < 10:
-                return 'en'
-            lang = langdetect.detect(text)
-            if lang in ['ru', 'uk', 'bg', 'sr', 'mk']:
-                return 'rus'
-            elif lang == 'en':
-                return 'eng'
-            return lang
-        except langdetect.lang_detect_exception.LangDetectException:
-            return 'en'
-        except Exception as e:
-            return 'en'
+        return self.language_detector.detect(text)
+
+    def detect_page_languages(self, text):
+        """
+        Detect the language of every page of a processed document.
+        Args:
+            text (str): Extracted text with PAGE_BREAK separators
+        Returns:
+            list: Language code per page
+        """
+        return [self.language_detector.detect(page) for page in text.split(PAGE_BREAK)]
 
     def _deskew(self, image_gray_ubyte):
         """
@@ -93,13 +105,15 @@ class OCRProcessor:
             print(f"Error during deskewing: {e}. Returning original image.")
             return image_gray_ubyte
 
-    def _ocr_image_tesseract(self, image_cv, lang='eng+rus'):
+    def _ocr_image_tesseract(self, image_cv, lang='eng+rus', deskewed_gray=None):
         """
         Perform OCR on a single OpenCV image (BGR) after preprocessing and deskewing.
+        An already deskewed grayscale image can be passed to avoid deskewing twice.
         """
-        gray_image = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
-        deskewed_gray_image = self._deskew(gray_image)
-        ocr_ready_image = deskewed_gray_image
+        if deskewed_gray is None:
+            gray_image = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
+            deskewed_gray = self._deskew(gray_image)
+        ocr_ready_image = deskewed_gray
 
         try:
             custom_config = f'-l {lang} --psm 3'
@@ -112,15 +126,15 @@ class OCRProcessor:
             print(f"Unexpected error during Tesseract OCR: {e}")
             return ""
 
-    def _analyze_layout_and_ocr(self, image_cv, lang='eng+rus'):
+    def _analyze_layout_and_ocr(self, image_cv, lang='eng+rus', deskewed_gray=None):
         """
         Perform layout analysis and OCR for structured documents.
         Optimization: Limit number of contours, adjust min area.
         """
 
-        gray_image = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
-
-        deskewed_gray = self._deskew(gray_image)
+        if deskewed_gray is None:
+            gray_image = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
+            deskewed_gray = self._deskew(gray_image)
 
 
         _, binary_img = cv2.threshold(deskewed_gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
@@ -165,9 +179,42 @@ class OCRProcessor:
 
         return "\n\n".join(extracted_texts)
 
-    def _process_pdf(self, pdf_path, document_type, lang='eng+rus'):
+    def _extract_page_grades(self, deskewed_gray, page_text, lang='eng+rus'):
+        """
+        Extract grade rows from a transcript page. The positional OCR pass only runs
+        on pages that have ruled table structure or several grade words in their text.
+        """
+        try:
+            if count_grade_words(page_text) >= MIN_GRADED_ROWS or has_table_structure(deskewed_gray):
+                return extract_grades_from_image(deskewed_gray, lang=lang)
+        except Exception as e:
+            print(f"Error extracting grade table: {e}")
+        return []
+
+    def _render_pdf_page(self, doc, page_num, file_hash=None):
+        """
+        Render a PDF page to a BGR image, going through the raster cache when enabled.
+        """
+        zoom = self.pdf_zoom
+        if file_hash:
+            cached = self.raster_cache.get(file_hash, page_num, zoom)
+            if cached is not None:
+                return cached
+
+        page = doc.load_page(page_num)
+        mat = fitz.Matrix(zoom, zoom)
+        pix = page.get_pixmap(matrix=mat, alpha=False)
+
+        img_np = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+        img_cv = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
+        if file_hash:
+            self.raster_cache.put(file_hash, page_num, zoom, img_cv)
+        return img_cv
+
+    def _process_pdf(self, pdf_path, document_type, lang='eng+rus', grade_rows=None):
         """
         Extract text from a PDF file using Tesseract OCR.
+        If grade_rows is a list, grade table rows found on the pages are appended to it.
         """
         extracted_text_parts = []
         structured_doc_keywords = ['degree', 'certificate', 'additional_documents'] 
@@ -182,23 +229,23 @@ class OCRProcessor:
 
         try:
             doc = fitz.open(pdf_path)
+            file_hash = self.raster_cache.file_hash(pdf_path) if self.raster_cache else None
             for page_num in range(len(doc)):
                 # print(f"Processing page {page_num + 1}/{len(doc)} of PDF: {pdf_path}")
-                page = doc.load_page(page_num)
-                zoom = 2.0  # 144 DPI
-                mat = fitz.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=mat, alpha=False)
-                
-                img_np = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
-                img_cv = cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
+                img_cv = self._render_pdf_page(doc, page_num, file_hash)
 
                 page_text = ""
+                deskewed_gray = None
+                if grade_rows is not None:
+                    deskewed_gray = self._deskew(cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY))
                 if is_structured:
                     # print(f"  Applying layout analysis for page {page_num + 1}...")
-                    page_text = self._analyze_layout_and_ocr(img_cv, lang=lang)
+                    page_text = self._analyze_layout_and_ocr(img_cv, lang=lang, deskewed_gray=deskewed_gray)
                 else:
                     # print(f"  Applying standard OCR for page {page_num + 1}...")
-                    page_text = self._ocr_image_tesseract(img_cv, lang=lang)
+                    page_text = self._ocr_image_tesseract(img_cv, lang=lang, deskewed_gray=deskewed_gray)
+                if grade_rows is not None:
+                    grade_rows.extend(self._extract_page_grades(deskewed_gray, page_text, lang=lang))
                 
                 extracted_text_parts.append(page_text)
                 # print(f"  Finished processing page {page_num + 1}. Text length: {len(page_text)}")
@@ -207,16 +254,43 @@ class OCRProcessor:
             print(f"Error processing PDF {pdf_path}: {e}")
             raise Exception(f"Failed to process PDF with Tesseract: {str(e)}")
             
-        return "\n\n--- Page Break ---\n\n".join(extracted_text_parts)
+        return PAGE_BREAK.join(extracted_text_parts)
 
-    def _process_image(self, image_path, lang='eng+rus'):
+    def _process_image(self, image_path, lang='eng+rus', grade_rows=None):
         """
         Extract text from an image file using Tesseract OCR.
         """
         img_cv = cv2.imread(image_path)
         if img_cv is None:
             raise ValueError(f"Could not read image file: {image_path}")
-        return self._ocr_image_tesseract(img_cv, lang=lang)
+        if grade_rows is None:
+            return self._ocr_image_tesseract(img_cv, lang=lang)
+        deskewed_gray = self._deskew(cv2.cvtColor(img_cv, cv2.COLOR_BGR2GRAY))
+        text = self._ocr_image_tesseract(img_cv, lang=lang, deskewed_gray=deskewed_gray)
+        grade_rows.extend(self._extract_page_grades(deskewed_gray, text, lang=lang))
+        return text
+
+    def process_document_structured(self, file_path, document_type=None):
+        """
+        Process a document and also return structured data.
+        For degree transcripts the grade table is extracted as a list of
+        {"course", "grade", "grade_value", "credits", "raw"} rows.
+        Returns:
+            dict: {"text": str, "grades": list or None}
+        """
+        if document_type != 'degree':
+            return {"text": self.process_document(file_path, document_type), "grades": None}
+
+        grade_rows = []
+        file_ext = os.path.splitext(file_path)[1].lower()
+        if file_ext == '.pdf' and os.path.exists(file_path):
+            text = self._process_pdf(file_path, document_type, grade_rows=grade_rows)
+        elif file_ext in ['.png', '.jpg', '.jpeg', '.bmp', '.tiff'] and os.path.exists(file_path):
+            text = self._process_image(file_path, grade_rows=grade_rows)
+        else:
+            text = self.process_document(file_path, document_type)
+            grade_rows = extract_grades_from_text(text)
+        return {"text": text, "grades": grade_rows}
 
     def process_document(self, file_path, document_type=None):
         """
@@ -0,0 +1,167 @@
+"""
+On-disk cache of rendered PDF page rasters.
+Pages are stored as .npy files and read back as read-only memory-mapped uint8
+arrays, so re-running OCR with different settings skips PyMuPDF rendering
+and reads pixels straight from the OS page cache.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class RasterCache:
+    """
+    Memory-mapped page raster cache keyed by (file hash, page number, zoom).
+    Least recently used entries are evicted once the total size exceeds max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes, shared=False):
+        """
+        Args:
+            cache_dir (str): Directory for cached rasters
+            max_bytes (int): Upper bound on the total size of cached files
+            shared (bool): Other processes write to the same directory (backfill workers); the index is
+                re-read from the directory before every eviction, so max_bytes bounds all of them together,
+                and a miss looks for a file written by another process before giving up
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.shared = shared
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # file name -> size, oldest first
+        self._total_bytes = 0
+        self._hash_memo = {}
+        self.hits = 0
+        self.misses = 0
+        self._load_index()
+
+    def _load_index(self):
+        """Rebuild the LRU order from file modification times (updated on every hit)."""
+        self._entries.clear()
+        self._total_bytes = 0
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npy'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._total_bytes += size
+
+    def file_hash(self, file_path):
+        """SHA-256 of the file contents, memoized by path, size and mtime."""
+        st = os.stat(file_path)
+        memo_key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+        cached = self._hash_memo.get(memo_key)
+        if cached:
+            return cached
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        value = digest.hexdigest()
+        self._hash_memo[memo_key] = value
+        return value
+
+    def _name(self, file_hash, page_num, zoom):
+        return f"{file_hash}_p{page_num}_z{zoom:g}.npy"
+
+    def get(self, file_hash, page_num, zoom):
+        """
+        Returns:
+            numpy.memmap or None: Read-only page raster, or None on a miss
+        """
+        name = self._name(file_hash, page_num, zoom)
+        path = os.path.join(self.cache_dir, name)
+        with self._lock:
+            if name not in self._entries and self.shared:
+                # Possibly rasterized by another process since the index was last read
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    size = None
+                if size is not None:
+                    self._entries[name] = size
+                    self._total_bytes += size
+            if name not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+        try:
+            os.utime(path)
+            return np.load(path, mmap_mode='r')
+        except (OSError, ValueError) as e:
+            print(f"Raster cache entry {name} unreadable, dropping it: {e}")
+            self._remove(name)
+            return None
+
+    def put(self, file_hash, page_num, zoom, image):
+        """Store a page raster. The file is written under a temporary name and renamed into place."""
+        image = np.ascontiguousarray(image, dtype=np.uint8)
+        if image.nbytes > self.max_bytes:
+            return
+        name = self._name(file_hash, page_num, zoom)
+        path = os.path.join(self.cache_dir, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            mm = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8, shape=image.shape)
+            mm[...] = image
+            mm.flush()
+            del mm
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"Could not write raster cache entry {name}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            if self.shared:
+                self._load_index()
+            else:
+                self._total_bytes -= self._entries.pop(name, 0)
+                self._entries[name] = size
+                self._total_bytes += size
+            if name in self._entries:
+                # Another process may have evicted it between the write and the index reload
+                self._entries.move_to_end(name)
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+                old_name, old_size = self._entries.popitem(last=False)
+                self._total_bytes -= old_size
+                evicted.append(old_name)
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.cache_dir, old_name))
+            except OSError:
+                pass
+
+    def _remove(self, name):
+        with self._lock:
+            self._total_bytes -= self._entries.pop(name, 0)
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            pass
+
+    def stats(self):
+        """Entry count, size and hit/miss counters."""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "total_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
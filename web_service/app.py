@@ -18,7 +18,7 @@ logger = logging.getLogger(__name__)
 try:
     from web_service.config import (
         WEB_SERVICE_HOST, WEB_SERVICE_PORT, UPLOAD_FOLDER,
-        ALLOWED_EXTENSIONS, OCR_SERVICE_URL, LLM_SERVICE_URL,
+        ALLOWED_EXTENSIONS, OCR_SERVICE_URL, LLM_SERVICE_URL, LLM_ANALYSIS_DEADLINE,
         DOCUMENT_TYPES
     )
     from database.db import get_session, init_db
@@ -451,6 +451,7 @@ def application(application_id):
         all_processed_successfully = all(doc.processing_status == ProcessingStatus.COMPLETED.value for doc in documents) if documents else False
         analysis_pending = application.status in [ApplicationStatus.SUBMITTED.value, ApplicationStatus.PROCESSING.value] and not summary
         can_analyze = all_processed_successfully and analysis_pending
+        can_reanalyze = all_processed_successfully and summary is not None and application.status != ApplicationStatus.ANALYZING.value
 
         return render_template(
             "application.html",
@@ -463,6 +464,7 @@ def application(application_id):
             processing_status_enum=ProcessingStatus,
             can_process=can_process,
             can_analyze=can_analyze,
+            can_reanalyze=can_reanalyze,
             current_user=g.current_user
         )
 
@@ -563,11 +565,16 @@ def process_documents(application_id):
             return redirect(url_for("application", application_id=application_id))
 
         logger.info(f"Starting document processing for application ID: {application_id}")
+        # Restored once the OCR requests are done; PROCESSING only means "documents are being OCR'd"
+        previous_status = application.status
+        if previous_status in (ApplicationStatus.PROCESSING.value, ApplicationStatus.ANALYZING.value):
+            previous_status = ApplicationStatus.SUBMITTED.value
         application.status = ApplicationStatus.PROCESSING.value
         db_session.commit()
 
         processed_count = 0
         failed_count = 0
+        deferred_count = 0
         for document in documents_to_process:
             logger.info(f"Sending document ID {document.id} ({document.file_name}) to OCR service.")
             try:
@@ -581,6 +588,14 @@ def process_documents(application_id):
                 }
                 ocr_response = requests.post(f"{OCR_SERVICE_URL}/api/process", json=ocr_payload, timeout=240) 
 
+                if ocr_response.status_code == 429:
+                    retry_after = ocr_response.headers.get("Retry-After", "?")
+                    logger.warning(f"OCR service is over capacity, document ID {document.id} left pending (retry after {retry_after}s).")
+                    document.processing_status = ProcessingStatus.PENDING.value
+                    db_session.commit()
+                    deferred_count += 1
+                    continue
+
                 ocr_response.raise_for_status() 
                 logger.info(f"Successfully requested processing for document ID {document.id}. OCR service response: {ocr_response.status_code}")
                 processed_count += 1
@@ -597,13 +612,17 @@ def process_documents(application_id):
                 failed_count += 1
 
         db_session.refresh(application)
+        application.status = previous_status
+        db_session.commit()
 
-        all_docs = db_session.query(Document).filter(Document.application_id == application_id).all()
-        if all(doc.processing_status != ProcessingStatus.PENDING.value for doc in all_docs):
-             pass
-
+        if deferred_count > 0:
+            flash(f"OCR service is busy: {deferred_count} document(s) are still pending. Please try processing them again shortly.", "warning")
         if failed_count > 0:
             flash(f"Requested processing for {processed_count} document(s). {failed_count} request(s) failed. Check document statuses.", "warning")
+        elif deferred_count > 0:
+            # Not a success: the busy warning above asks to retry the rest
+            if processed_count > 0:
+                flash(f"Requested processing for {processed_count} document(s). Check status updates below.", "info")
         else:
             flash(f"Requested processing for {processed_count} document(s). Check status updates below.", "success")
 
@@ -632,10 +651,9 @@ def analyze_application(application_id):
              flash("You do not have permission to analyze this application.", "error")
              return redirect(url_for("application", application_id=application_id))
 
+        # A running analysis is detected by the LLM service, which answers with the active task instead of queuing another
+        # A previous analysis is no reason to refuse: the LLM service re-runs only the stages whose documents changed
         existing_summary = db_session.query(Summary).filter(Summary.application_id == application_id).first()
-        if existing_summary:
-             flash("Application has already been analyzed.", "info")
-             return redirect(url_for("application", application_id=application_id))
 
         documents = db_session.query(Document).filter(Document.application_id == application_id).all()
         if not documents:
@@ -673,17 +691,27 @@ def analyze_application(application_id):
                     "document_id": doc.id,
                     "document_type": doc.document_type,
                     "content_text": doc.content_text,
+                    "structured_data": doc.structured_data,
                 }
                 for doc in completed_docs
             ]
         }
+        if LLM_ANALYSIS_DEADLINE > 0:
+            llm_payload["deadline_seconds"] = LLM_ANALYSIS_DEADLINE
 
         try:
-            llm_response = requests.post(f"{LLM_SERVICE_URL}/api/analyze", json=llm_payload, timeout=240) 
+            # The LLM service queues the analysis and answers 202 with a task id right away
+            llm_response = requests.post(f"{LLM_SERVICE_URL}/api/analyze", json=llm_payload, timeout=30) 
             llm_response.raise_for_status()
+            task_id = llm_response.json().get("task_id")
 
-            logger.info(f"Successfully requested LLM analysis for application ID {application_id}. LLM service response: {llm_response.status_code}")
-            flash("Analysis requested successfully. Results will appear once processed by the LLM service.", "success")
+            logger.info(f"Successfully requested LLM analysis for application ID {application_id}. LLM service response: {llm_response.status_code}, task {task_id}")
+            if not llm_response.json().get("created", True):
+                flash("Application is already being analyzed.", "info")
+            elif existing_summary:
+                flash("Re-analysis requested. Only stages whose documents changed are run again.", "success")
+            else:
+                flash("Analysis requested successfully. Results will appear once processed by the LLM service.", "success")
 
         except requests.exceptions.RequestException as req_err:
             logger.error(f"Failed to send analysis request for application ID {application_id} to LLM service: {req_err}")
@@ -10,6 +10,8 @@ WEB_SERVICE_PORT = int(os.getenv("WEB_SERVICE_PORT", 5000))
 OCR_SERVICE_URL = os.getenv("OCR_SERVICE_URL", "http://localhost:5001")
 
 LLM_SERVICE_URL = os.getenv("LLM_SERVICE_URL", "http://localhost:5002")
+# Seconds after which the LLM service abandons an analysis requested by the web service (0 = no deadline)
+LLM_ANALYSIS_DEADLINE = float(os.getenv("LLM_ANALYSIS_DEADLINE", 0))
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 UPLOAD_FOLDER = os.path.join(BASE_DIR, "../uploads")